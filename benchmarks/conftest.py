@@ -0,0 +1,122 @@
+"""
+pytest-benchmark suite of the hot paths, checked against the minimums in benchmarks/baseline.json.
+Needs `pip install pytest pytest-benchmark` on top of requirements.txt.
+
+    pytest benchmarks                          # run, report and fail on regressions
+    pytest benchmarks --regression-threshold 0.5
+    pytest benchmarks --update-baseline        # write the current minimums as the baseline
+
+A benchmark regresses when its minimum is more than `--regression-threshold` (a fraction)
+above the baseline. Benchmarks missing from the baseline are reported but never fail.
+"""
+import os
+import sys
+import json
+import platform
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+
+# The webapp and analysis scripts import their siblings as top-level modules
+for path in (ROOT, os.path.join(ROOT, "webapp"), os.path.join(ROOT, "analysis")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+_TIMES = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("baseline")
+    group.addoption("--baseline", default=BASELINE_PATH, help="baseline JSON of benchmark minimums")
+    group.addoption("--regression-threshold", type=float, default=DEFAULT_THRESHOLD,
+                    help="allowed slowdown of a minimum over the baseline, as a fraction")
+    group.addoption("--update-baseline", action="store_true", help="write the measured minimums to the baseline")
+
+
+@pytest.fixture
+def bench(benchmark, request):
+    """
+    `benchmark`, with its minimum recorded for the baseline check
+    """
+    yield benchmark
+    if benchmark.stats is not None:
+        _TIMES[request.node.name] = benchmark.stats.stats.min
+
+
+def _load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)["benchmarks"]
+
+
+def _regressions(config):
+    baseline = _load_baseline(config.getoption("--baseline"))
+    threshold = config.getoption("--regression-threshold")
+    rows = []
+    for name, minimum in sorted(_TIMES.items()):
+        reference = baseline.get(name, {}).get("min")
+        change = minimum / reference - 1 if reference else None
+        rows.append((name, minimum, reference, change, change is not None and change > threshold))
+    return rows
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not _TIMES:
+        return
+    if config.getoption("--update-baseline"):
+        data = {
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor()},
+            "benchmarks": {name: {"min": minimum} for name, minimum in sorted(_TIMES.items())},
+        }
+        with open(config.getoption("--baseline"), "w") as f:
+            json.dump(data, f, indent=4)
+            f.write("\n")
+        terminalreporter.write_line(f"Baseline written to {config.getoption('--baseline')}")
+        return
+    terminalreporter.section("baseline")
+    for name, minimum, reference, change, regressed in _regressions(config):
+        status = "no baseline" if change is None else f"{change:+.1%}" + (" REGRESSION" if regressed else "")
+        terminalreporter.write_line(f"{name}: {minimum * 1e6:.1f} us ({status})")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if _TIMES and not session.config.getoption("--update-baseline"):
+        if any(regressed for *_, regressed in _regressions(session.config)):
+            session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+
+def therapy_kwargs(log_dir, turns=40, persuasion_flag=True, **kwargs):
+    """
+    Therapy environment of two offline agents (the "sim:instant" backend) over `turns` turns
+    """
+    return dict(
+        agents=[
+            {"name": "assistant", "engine": "sim:instant", "system": "You are a therapist.",
+             "action_space": {"name": "therapy", "action": -1}, "role": "assistant"},
+            {"name": "user", "engine": "sim:instant", "system": "You are a patient.",
+             "action_space": {"name": "patient"}, "role": "user"},
+        ],
+        transit=["assistant", "user"] * (turns // 2),
+        persuasion_flag=persuasion_flag,
+        message_layout="system",
+        log_dir=log_dir,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def session_40(tmp_path, capsys):
+    """
+    A finished 40-turn persuasion session
+    """
+    import therapy_system
+    env = therapy_system.make("Therapy", **therapy_kwargs(str(tmp_path)))
+    while not env.is_truncated_state():
+        env.step(env.sample_action())
+    capsys.readouterr()
+    return env
@@ -0,0 +1,101 @@
+"""
+Cold import cost of therapy_system entry points, measured with `python -X importtime`
+in fresh interpreters and checked against benchmarks/import_budget.json.
+
+    python benchmarks/import_time.py            # report and fail on budget overruns
+    python benchmarks/import_time.py --runs 10 --top 15
+    python benchmarks/import_time.py --update   # write the current medians (x2) as the budget
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_budget.json")
+# Headroom applied to the measured medians by --update
+UPDATE_HEADROOM = 2.0
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _importtime(statement: str) -> str:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, env=env, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(f"`{statement}` failed: {result.stderr.strip().splitlines()[-1]}")
+    return result.stderr
+
+
+def _parse(output: str):
+    """
+    (module, self us, cumulative us, depth) of every import in the output
+    """
+    entries = []
+    for line in output.splitlines():
+        match = _LINE.match(line)
+        if match:
+            entries.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return entries
+
+
+def measure(module: str, startup: set):
+    """
+    Cold import time of `module` in ms, with the modules it pulled in and their self times
+    """
+    entries = _parse(_importtime(f"import {module}"))
+    # Top-level entries not imported by the bare interpreter are the ones caused by the import
+    total = sum(cumulative for name, _, cumulative, depth in entries if depth == 0 and name not in startup)
+    loaded = {name: self_us for name, self_us, _, _ in entries if name not in startup}
+    return total / 1000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="heaviest modules to list per entry point")
+    parser.add_argument("--update", action="store_true", help="rewrite the budgets from this run")
+    args = parser.parse_args()
+
+    with open(BUDGET_PATH) as f:
+        budget = json.load(f)
+    startup = {name for name, _, _, _ in _parse(_importtime("pass"))}
+
+    failures = []
+    for module, spec in budget["modules"].items():
+        try:
+            runs = [measure(module, startup) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{module}: skipped, {e}")
+            continue
+        median = statistics.median(ms for ms, _ in runs)
+        loaded = runs[-1][1]
+        forbidden = sorted({name.split(".")[0] for name in loaded} & set(spec.get("forbidden", [])))
+        status = "ok"
+        if median > spec["budget_ms"]:
+            status = "OVER BUDGET"
+            failures.append(module)
+        if forbidden:
+            status = f"IMPORTS {', '.join(forbidden)}"
+            failures.append(module)
+        print(f"{module}: {median:.1f} ms (budget {spec['budget_ms']} ms, {len(loaded)} modules) {status}")
+        for name, self_us in sorted(loaded.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {self_us / 1000:8.2f} ms  {name}")
+        if args.update:
+            spec["budget_ms"] = round(max(median * UPDATE_HEADROOM, 1.0), 1)
+
+    if args.update:
+        with open(BUDGET_PATH, "w") as f:
+            json.dump(budget, f, indent=4)
+            f.write("\n")
+        print(f"Budgets written to {BUDGET_PATH}")
+        return 0
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
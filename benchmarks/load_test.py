@@ -0,0 +1,416 @@
+"""
+Load test of the participant web app: virtual participants log in, chat for `--turns` turns and
+answer the three surveys of webapp/Chat_with_AI_Therapist.py and webapp/pages/Survey.py, driven
+headlessly through streamlit's AppTest. LLM calls are served offline by a simulated engine
+(LLM_ENGINE_OVERRIDE) and Firestore is replaced by an in-memory store, so no credentials are needed.
+
+    python benchmarks/load_test.py                                   # 1, 4 and 8 concurrent participants
+    python benchmarks/load_test.py --concurrency 1,16,32 --participants 64 --turns 25
+    python benchmarks/load_test.py --engine sim:default --output load_test.json
+
+AppTest swaps process-wide streamlit state (the runtime and st.secrets) on every run, so each
+concurrent participant gets its own worker process. For every concurrency level the report gives
+per-rerun (script run) and per-turn latency percentiles, script reruns per chat turn, the memory
+of a session (tracemalloc peak and retained size, `--no-memory` to skip the tracing overhead) and
+the errors met. Conversation logs are written under .logs as by the app itself.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import uuid
+import types
+import random
+import logging
+import importlib
+import argparse
+import threading
+import functools
+import tracemalloc
+import multiprocessing
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_SCRIPT = os.path.join(ROOT, "webapp", "Chat_with_AI_Therapist.py")
+PERSONA_FILENAME = os.path.join(ROOT, "persona_info_hierarchy.csv")
+POSTHOC_SURVEY_FILENAME = os.path.join(ROOT, "posthoc_survey.csv")
+SURVEY_PAGE = "pages/Survey.py"
+APP_MODULES = ("streamlit.testing.v1", "therapy_system", "therapy_utils", "feedback_utils",
+               "webapp.post_survey_1", "webapp.post_survey_2", "webapp.post_survey_3")
+
+# The app imports its siblings as top-level modules and the survey pages as webapp.*
+for path in (ROOT, os.path.join(ROOT, "webapp")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from therapy_system.agents.llm import BACKENDS, ENGINE_OVERRIDE_ENV
+from therapy_system.agents.llm.sim import SimAgent
+from therapy_system.envs.session_store import SESSION_STORE_ENV
+
+PASSWORD = "load-test"
+SECRETS = {
+    "openai_api_key": "sk-load-test-offline",
+    "web_login_password": PASSWORD,
+    "firebase_service_account": {"type": "service_account", "project_id": "load-test"},
+}
+# Surveys and the end of the chat take a handful of screens, more means the flow is stuck
+MAX_SURVEY_STEPS = 12
+REASONING = "I shared it because it explains why the move and the friendship made my sleep worse lately."
+
+_SCRIPT_RUNS = []
+_THREAD_ERRORS = []
+_FIRESTORE = None
+
+
+class FlowError(Exception):
+    """
+    The app did not show the screen the participant expected
+    """
+
+
+class InMemoryFirestore:
+    """
+    Stand-in of a Firestore client, documents by collection name and document id
+    """
+
+    def __init__(self):
+        self.collections = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return _Collection(self, name)
+
+    def count(self) -> int:
+        with self._lock:
+            return sum(len(documents) for documents in self.collections.values())
+
+
+class _Collection:
+    def __init__(self, db: InMemoryFirestore, name: str):
+        self.db = db
+        self.name = name
+
+    def document(self, document_id):
+        return _Document(self, document_id)
+
+
+class _Document:
+    def __init__(self, collection: _Collection, document_id: str):
+        self.collection = collection
+        self.id = document_id
+
+    def set(self, data):
+        db = self.collection.db
+        with db._lock:
+            db.collections[self.collection.name][self.id] = data
+
+
+def install_firestore_stand_in() -> InMemoryFirestore:
+    """
+    Put an in-memory firebase_admin in sys.modules, before the app imports the real one
+    """
+    db = InMemoryFirestore()
+    firebase_admin = types.ModuleType("firebase_admin")
+    credentials = types.ModuleType("firebase_admin.credentials")
+    firestore = types.ModuleType("firebase_admin.firestore")
+    firebase_admin._apps = {}
+    firebase_admin.initialize_app = lambda credential=None, options=None, name="[DEFAULT]": \
+        firebase_admin._apps.setdefault(name, credential)
+    credentials.Certificate = lambda cert: cert
+    firestore.client = lambda app=None: db
+    firestore.SERVER_TIMESTAMP = object()
+    firebase_admin.credentials, firebase_admin.firestore = credentials, firestore
+    sys.modules.update({"firebase_admin": firebase_admin, "firebase_admin.credentials": credentials,
+                        "firebase_admin.firestore": firestore})
+    return db
+
+
+@functools.lru_cache(maxsize=None)
+def stand_in_answers():
+    """
+    Answers of the auxiliary calls of the app, in the formats their callers parse
+    """
+    with open(PERSONA_FILENAME, encoding="utf-8") as f:
+        groups = list(dict.fromkeys(row["Group"] for row in csv.DictReader(f)))
+    with open(POSTHOC_SURVEY_FILENAME, encoding="utf-8") as f:
+        phrases = [row["user_mentioned"] for row in csv.DictReader(f)]
+    detections = {
+        str(idx): {"phrase": phrase, "present": "Yes", "evidence": phrase} if idx % 3 == 0
+        else {"phrase": phrase, "present": "No"}
+        for idx, phrase in enumerate(phrases)
+    }
+    return {
+        "persona_search": ["None"] + [f"{first}, {second}" for first, second in zip(groups, groups[1:])],
+        "survey_detection": [json.dumps(detections)],
+    }
+
+
+class StandInLLM(SimAgent):
+    """
+    Simulated engine that also answers the persona search and the survey detection in their formats
+    """
+
+    def __init__(self, engine="sim", **kwargs):
+        answers = stand_in_answers().get(kwargs.get("call_site"))
+        if answers:
+            kwargs.setdefault("templates", answers)
+        super().__init__(engine, **kwargs)
+
+
+def _record_script_runs():
+    """
+    Time every script run of AppTest, internal reruns (st.rerun, st.switch_page) included
+    """
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    started = []
+
+    def on_event(sender, event, **kwargs):
+        now = time.perf_counter()
+        if event == ScriptRunnerEvent.SCRIPT_STARTED:
+            if started:
+                _SCRIPT_RUNS.append(now - started.pop())
+            started.append(now)
+        elif event.name.startswith("SCRIPT_STOPPED") or event == ScriptRunnerEvent.SHUTDOWN:
+            if started:
+                _SCRIPT_RUNS.append(now - started.pop())
+
+    init = LocalScriptRunner.__init__
+
+    def __init__(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self.on_event.connect(on_event, weak=False)
+
+    LocalScriptRunner.__init__ = __init__
+
+
+def _init_worker(engine, memory, verbose):
+    """
+    Set up a worker process: offline engine, in-memory stores, and no output from the app
+    """
+    # The app reads its assets and CSV files relative to the repository root
+    os.chdir(ROOT)
+    os.environ[ENGINE_OVERRIDE_ENV] = engine
+    os.environ.setdefault(SESSION_STORE_ENV, "memory://")
+    # Every simulated engine of the worker answers the auxiliary calls in their formats
+    BACKENDS["sim"] = f"{__name__}:StandInLLM"
+    global _FIRESTORE
+    _FIRESTORE = install_firestore_stand_in()
+    if not verbose:
+        # The app configures INFO logging and prints its phase on every run
+        logging.basicConfig(level=logging.ERROR)
+        sys.stdout = open(os.devnull, "w")
+    _record_script_runs()
+    # Background threads of the app (e.g. the survey preparation) fail without stopping the script
+    threading.excepthook = lambda hook: _THREAD_ERRORS.append(
+        f"{hook.exc_type.__name__} in thread {hook.thread.name if hook.thread else '?'}: {hook.exc_value}")
+    # Import the app modules up front so that the first session of the worker is not charged for them
+    for module in APP_MODULES:
+        importlib.import_module(module)
+    if memory:
+        tracemalloc.start()
+
+
+def _participant_messages(prolific_id, turns):
+    with open(PERSONA_FILENAME, encoding="utf-8") as f:
+        details = [row["Detailed information"] for row in csv.DictReader(f)]
+    rng = random.Random(prolific_id)
+    return [f"Well, {rng.choice(details)} That is what has been on my mind." for _ in range(turns)]
+
+
+def _run(at):
+    """
+    Run the app and fail on an uncaught exception of the script
+    """
+    at.run()
+    if at.exception:
+        raise FlowError(f"App exception: {at.exception[0].message}")
+    return at
+
+
+def _button(at, label=None, key=None):
+    for button in at.button:
+        if (key is None or button.key == key) and (label is None or button.label == label) and not button.disabled:
+            return button
+    raise FlowError(f"No enabled button {key or label!r} on the screen")
+
+
+def _chat(at, prolific_id, messages, turn_latencies, turn_reruns):
+    _button(at, label="Enter")
+    at.text_input[0].input(prolific_id)
+    at.text_input[1].input(PASSWORD)
+    _button(at, label="Enter").click()
+    _run(at)
+    for message in messages:
+        try:
+            at.text_input(key="human_input").input(message)
+        except KeyError:
+            raise FlowError("No chat input on the screen") from None
+        _button(at, label="Send").click()
+        runs, start = len(_SCRIPT_RUNS), time.perf_counter()
+        _run(at)
+        turn_latencies.append(time.perf_counter() - start)
+        turn_reruns.append(len(_SCRIPT_RUNS) - runs)
+    # Ending the chat switches to the survey page in the same run, the browser then stays on it
+    _button(at, key="terminate_button").click()
+    _run(at)
+    at.switch_page(SURVEY_PAGE)
+
+
+def _surveys(at, rng):
+    # Survey 1: every statement on its agreement scale
+    for radio in at.radio:
+        if radio.key and radio.key.startswith("Q"):
+            radio.set_value(rng.choice(radio.options[1:]))
+    _button(at, key="survey_1_submit_button").click()
+    _run(at)
+
+    # Survey 2: select half of the detected details, then give reasons for both halves
+    for _ in range(MAX_SURVEY_STEPS):
+        if "survey_2_completed" in at.session_state:
+            break
+        areas = [area for area in at.text_area if not area.value]
+        if areas:
+            for area in areas:
+                area.input(REASONING)
+            _run(at)
+            continue
+        for idx, checkbox in enumerate(box for box in at.checkbox if box.key.startswith("checkbox_")):
+            checkbox.set_value(idx % 2 == 0)
+        _button(at, label="Next").click()
+        _run(at)
+    else:
+        raise FlowError("Survey 2 was not completed")
+
+    # Survey 3: demographics
+    if len(at.selectbox) < 3:
+        raise FlowError("No demographic questions on the screen")
+    for selectbox in at.selectbox:
+        selectbox.select(rng.choice(selectbox.options[1:]))
+    at.checkbox(key=f"cbox_{rng.randrange(4)}").check()
+    _button(at, label="Submit").click()
+    _run(at)
+    if "survey_3_completed" not in at.session_state:
+        raise FlowError("Survey 3 was not completed")
+
+
+def run_participant(prolific_id, turns, timeout):
+    """
+    Replay the study of one participant, return its timings and the error that stopped it
+    """
+    from streamlit.testing.v1 import AppTest
+
+    result = {"prolific_id": prolific_id, "rerun_latencies": [], "turn_latencies": [], "turn_reruns": [],
+              "error": None, "completed": False, "start": time.time()}
+    memory = tracemalloc.is_tracing()
+    if memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    runs, thread_errors, documents = len(_SCRIPT_RUNS), len(_THREAD_ERRORS), _FIRESTORE.count()
+    at = AppTest.from_file(CHAT_SCRIPT, default_timeout=timeout)
+    at.secrets = dict(SECRETS)
+    try:
+        _run(at)
+        _chat(at, prolific_id, _participant_messages(prolific_id, turns), result["turn_latencies"],
+              result["turn_reruns"])
+        _surveys(at, random.Random(prolific_id))
+        result["completed"] = True
+    except FlowError as e:
+        result["error"] = str(e)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["end"] = time.time()
+    result["rerun_latencies"] = _SCRIPT_RUNS[runs:]
+    result["thread_errors"] = _THREAD_ERRORS[thread_errors:]
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        result["retained_bytes"], result["peak_bytes"] = current - baseline, peak - baseline
+    result["firestore_documents"] = _FIRESTORE.count() - documents
+    return result
+
+
+def percentiles(values, scale=1.0, digits=3):
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    at = lambda q: round(scale * ordered[min(len(ordered) - 1, int(q * len(ordered)))], digits)
+    return {"p50": at(0.5), "p95": at(0.95), "p99": at(0.99), "max": round(scale * ordered[-1], digits),
+            "count": len(ordered)}
+
+
+def report(concurrency, results):
+    errors = Counter(result["error"] for result in results if result["error"])
+    elapsed = max(result["end"] for result in results) - min(result["start"] for result in results)
+    turn_reruns = [runs for result in results for runs in result["turn_reruns"]]
+    summary = {
+        "concurrency": concurrency,
+        "participants": len(results),
+        "completed": sum(result["completed"] for result in results),
+        "errors": sum(errors.values()),
+        "error_kinds": dict(errors.most_common(5)),
+        "thread_errors": dict(Counter(error for result in results for error in result["thread_errors"]).most_common(5)),
+        "elapsed_seconds": round(elapsed, 3),
+        "participants_per_minute": round(60 * len(results) / elapsed, 2) if elapsed else 0.0,
+        "rerun_latency_seconds": percentiles([latency for result in results for latency in result["rerun_latencies"]]),
+        "turn_latency_seconds": percentiles([latency for result in results for latency in result["turn_latencies"]]),
+        "reruns_per_turn": {"mean": round(sum(turn_reruns) / len(turn_reruns), 2) if turn_reruns else 0.0,
+                            "max": max(turn_reruns, default=0)},
+        "firestore_documents": sum(result["firestore_documents"] for result in results),
+    }
+    if any("peak_bytes" in result for result in results):
+        summary["session_memory_mb"] = {
+            "peak": percentiles([result["peak_bytes"] for result in results], scale=1 / 2 ** 20, digits=2),
+            "retained": percentiles([result["retained_bytes"] for result in results], scale=1 / 2 ** 20, digits=2),
+        }
+    return summary
+
+
+def run_level(args, concurrency):
+    """
+    Run `args.participants` participants, `concurrency` of them at a time
+    """
+    prolific_ids = [f"load-{concurrency}-{idx}-{uuid.uuid4().hex[:6]}" for idx in range(args.participants)]
+    with ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(args.engine, args.memory, args.verbose)) as pool:
+        return list(pool.map(run_participant, prolific_ids, [args.turns] * len(prolific_ids),
+                             [args.timeout] * len(prolific_ids)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")],
+                        default=[1, 4, 8], help="comma-separated numbers of participants running at the same time")
+    parser.add_argument("--participants", type=int, default=16, help="participants per concurrency level")
+    parser.add_argument("--turns", type=int, default=20,
+                        help="chat messages of each participant (the app offers to end the chat after 10)")
+    parser.add_argument("--engine", default="sim:fast", help="simulated engine serving every LLM call")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds a single app run may take")
+    parser.add_argument("--memory", action=argparse.BooleanOptionalAction, default=True,
+                        help="trace the memory of each session with tracemalloc")
+    parser.add_argument("--output", help="write the reports and the per-participant results as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the logs and output of the app")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = []
+    for concurrency in args.concurrency:
+        results = run_level(args, concurrency)
+        levels.append({"report": report(concurrency, results), "participants": results})
+        print(json.dumps(levels[-1]["report"], indent=2), flush=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(levels, f, indent=2)
+    if any(level["report"]["errors"] for level in levels):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # AppTest runs the app as __main__ in the workers, so their tasks must refer to this module by name
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import load_test
+    load_test.main()
@@ -0,0 +1,44 @@
+import os
+import json
+import random
+
+import pytest
+
+import survey_two_analysis
+from therapy_system.envs.session_log import render_settings, render_turn
+
+PARTICIPANTS = 10
+TURNS = 40
+
+
+@pytest.fixture
+def exports(tmp_path, monkeypatch):
+    """
+    Synthetic Firestore exports in retrieve_data/data: a chat history and a survey two response per participant
+    """
+    data = tmp_path / "retrieve_data" / "data"
+    data.mkdir(parents=True)
+    rng = random.Random(0)
+    for pid in range(PARTICIPANTS):
+        responses = [f"In Berlin I felt lonely in week {rng.randint(1, 9)} and slept {rng.randint(2, 7)} hours."
+                     for _ in range(TURNS)]
+        chat = render_settings({"player": ["assistant", "user"], "model": ["gpt-4o", "Human"]}) + "".join(
+            render_turn({"current_iteration": turn, "player": ["assistant", "user"][turn % 2],
+                         "response": response, "persuasion_technique": "None"})
+            for turn, response in enumerate(responses))
+        detections = {
+            str(idx): {"better_evidence": f"You: **{responses[2 * idx + 1][:20]}**", "selected": idx % 2 == 0,
+                       "reasoning": "it was needed", "priority": "1", "category": "Recent Relocation",
+                       "survey_display": f"detail {idx}"}
+            for idx in range(10)
+        }
+        (data / f"chat_history_{pid}.json").write_text(json.dumps(chat))
+        (data / f"survey_two_response_{pid}.json").write_text(json.dumps({"all_detections": detections}))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_survey_two_analysis(bench, exports, capsys):
+    bench.pedantic(survey_two_analysis.main, rounds=3, iterations=1)
+    capsys.readouterr()
+    assert os.path.exists(exports / "analysis" / "data" / "data.csv")
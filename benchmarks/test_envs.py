@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import therapy_system
+from therapy_system.envs.session_log import render_session_log
+from conftest import therapy_kwargs
+
+PERSUASION_RESPONSE = ("<technique>Reflective Listening</technique>\n<response>"
+                       + "It sounds like the move has been really hard on you, and that missing the wedding hurt. " * 8
+                       + "</response>")
+STEP_ROUNDS = 200
+
+
+@pytest.fixture
+def env(tmp_path):
+    return therapy_system.make("Therapy", **therapy_kwargs(str(tmp_path), turns=2 * STEP_ROUNDS + 2))
+
+
+def test_extract_persuasion_response(bench, env):
+    technique, response = bench(env.extract_persuasion_response, PERSUASION_RESPONSE)
+    assert technique == "Reflective Listening" and response.startswith("It sounds like")
+
+
+def test_step(bench, env):
+    # One round per turn, the transit of the fixture is long enough for all of them
+    bench.pedantic(lambda: env.step(env.sample_action()), rounds=STEP_ROUNDS, iterations=1)
+    assert env.state == len(env.game_state) - 1
+
+
+def test_log_human_readable_state(bench, session_40):
+    log = bench(session_40.log_human_readable_state)
+    assert log.count("Current Iteration:") == 40
+
+
+def test_render_session_log(bench, session_40):
+    session_40.session_log.flush()
+    log = bench(render_session_log, session_40.session_log.path)
+    assert log == session_40.log_human_readable_state()
+
+
+def test_interaction_log_written_on_close(session_40):
+    interaction_log = os.path.join(session_40.log_path, session_40.INTERACTION_LOG_FILE)
+    session_40.log_state()
+    assert not os.path.exists(interaction_log)
+    session_40.close()
+    with open(interaction_log) as f:
+        assert f.read() == session_40.log_human_readable_state()
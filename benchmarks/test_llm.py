@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+
+from therapy_system.agents.llm import load_llm_agent
+from therapy_system.agents.llm.policy import LLMDeadlineExceeded
+
+MESSAGES = [{"role": "system", "content": "You are a therapist."}, {"role": "user", "content": "Hello"}]
+DEADLINE = 0.3
+# Slack for the scheduler on top of the deadline
+DEADLINE_SLACK = 0.3
+
+
+@pytest.fixture
+def slow_agent():
+    # "sim:slow" takes 1.5s to its first token, well past the deadline
+    return load_llm_agent("sim:slow", dict(policy={"deadline": DEADLINE, "max_retries": 2}))
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["complete", "stream"])
+def test_deadline(slow_agent, stream):
+    start = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        if stream:
+            list(slow_agent.complete_with_stream(MESSAGES))
+        else:
+            slow_agent.complete(MESSAGES)
+    assert time.monotonic() - start < DEADLINE + DEADLINE_SLACK
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["complete", "stream"])
+def test_adeadline(slow_agent, stream):
+    async def call():
+        if stream:
+            return [chunk async for chunk in slow_agent.acomplete_with_stream(MESSAGES)]
+        return await slow_agent.acomplete(MESSAGES)
+
+    start = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(call())
+    assert time.monotonic() - start < DEADLINE + DEADLINE_SLACK
+
+
+def test_first_token_timeout_spares_completions():
+    # The first-token timeout bounds streams only, a non-streamed answer has the whole deadline
+    agent = load_llm_agent("sim:fast", dict(policy={"deadline": 5, "first_token_timeout": 0.1}))
+    assert agent.complete(MESSAGES)
+    with pytest.raises(LLMDeadlineExceeded):
+        list(agent.complete_with_stream(MESSAGES))
+
+
+def test_retry_after_injected_error():
+    # Errors are drawn per attempt, so a retried request can succeed
+    agent = load_llm_agent("sim:instant", dict(error_rate=0.5, policy={"max_retries": 10, "backoff_base": 0.001}))
+    requests = [[{"role": "user", "content": f"Message {idx}"}] for idx in range(20)]
+    assert all(agent.complete(messages) for messages in requests)
+    assert sum(agent._attempts.values()) > len(requests)
@@ -0,0 +1,13 @@
+import pytest
+
+from therapy_system.action.therapy import get_taxonomy, therapy_prompt
+
+USER_INPUT = ("I moved to Berlin a month ago for work and I barely sleep. I keep thinking about my "
+              "friend's wedding in New York that I was not invited to.")
+
+
+@pytest.mark.parametrize("persuasion_flag", [False, True], ids=["therapy", "persuasion"])
+def test_therapy_prompt(bench, persuasion_flag):
+    taxonomy = get_taxonomy()
+    prompt = bench(therapy_prompt, USER_INPUT, taxonomy, persuasion_flag, 100)
+    assert USER_INPUT in prompt
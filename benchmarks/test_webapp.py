@@ -0,0 +1,111 @@
+import os
+import random
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+from feedback_utils import enhance_evidence, get_survey_sample
+from persona_index import PERSONA_MATCH_THRESHOLD, calibrate_threshold, get_persona_index
+from therapy_system.utils import escape_special_characters
+
+CATEGORIES = ["Basic information", "Current Medication", "Recent Relocation", "Friendship Crisis",
+              "Therapy History", "Childhood Bullying", "Story with Emily Johnson"]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DETECTIONS = 500
+MESSAGES = 200
+
+
+@pytest.fixture
+def conversation():
+    rng = random.Random(0)
+    user = [f"Message {idx}: I have been in Berlin for {rng.randint(1, 12)} weeks and sleep badly."
+            for idx in range(MESSAGES)]
+    agent = [f"Question {idx}: How has that been affecting you?" for idx in range(MESSAGES)]
+    return user, agent
+
+
+@pytest.fixture
+def detections(conversation):
+    user, _ = conversation
+    rng = random.Random(0)
+    # Half of the evidence is quoted from the conversation, the rest is not found in it
+    return {
+        str(idx): {
+            "revealation": rng.choice(user)[-40:] if idx % 2 else f"unseen detail {idx}",
+            "category": CATEGORIES[idx % len(CATEGORIES)],
+        }
+        for idx in range(DETECTIONS)
+    }
+
+
+def test_enhance_evidence(bench, conversation):
+    user, agent = conversation
+    evidence = user[-1][-40:]
+    assert bench(enhance_evidence, evidence, user, agent).startswith("AI therapy:")
+
+
+def test_get_survey_sample(bench, conversation, detections):
+    st.session_state.usr_conv_list, st.session_state.agt_conv_list = conversation
+    # Sampling pops from the per-category queues it builds, each round gets a fresh copy
+    sample = bench(lambda: get_survey_sample({key: dict(value) for key, value in detections.items()}))
+    assert len(sample) == 10
+
+
+def test_escape_special_characters_stream(bench):
+    chunks = [f"It costs ${idx} and *really* matters. " for idx in range(2000)]
+    escaped = bench(lambda: "".join(escape_special_characters(chunk for chunk in chunks)))
+    assert "\\$" in escaped
+
+
+@pytest.fixture(scope="module")
+def persona_index():
+    return get_persona_index(pd.read_csv(os.path.join(ROOT, "persona_info_hierarchy.csv")))
+
+
+@pytest.fixture(scope="module")
+def labelled_queries():
+    # Queries of the chat and their relevant persona groups, none for small talk
+    data = pd.read_csv(os.path.join(ROOT, "benchmarks", "persona_queries.csv"), keep_default_na=False)
+    return [(query, groups.split(";") if groups else []) for query, groups in zip(data["query"], data["groups"])]
+
+
+def test_persona_index_search(bench, persona_index):
+    query = "Therapist: How have you been sleeping?\nPatient: Badly, I take Ambien every night since the move."
+    groups = [group for group, _ in bench(persona_index.search, query)]
+    assert groups[0] == "Current Medication"
+
+
+def test_persona_match_threshold(persona_index, labelled_queries):
+    # No labelled query is answered locally with a wrong group, and most relevant ones skip the LLM
+    assert PERSONA_MATCH_THRESHOLD >= calibrate_threshold(persona_index, labelled_queries)
+    relevant = [(query, groups) for query, groups in labelled_queries if groups]
+    local = [persona_index.search(query) for query, _ in relevant]
+    hits = sum(1 for matches, (_, groups) in zip(local, relevant)
+               if matches and matches[0][1] >= PERSONA_MATCH_THRESHOLD and matches[0][0] in groups)
+    assert hits >= 0.75 * len(relevant)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Therapist: Who bullied you?\nPatient: Tommy, a classmate.", ["Childhood Bullying"]),
+    ("Therapist: Who is getting married?\nPatient: Emily, and I wasn't invited.",
+     ["Friendship Crisis", "Story with Emily Johnson"]),
+    ("Therapist: How long have you been in Berlin?\nPatient: A month.", ["Recent Relocation"]),
+    ("Therapist: Have you been in therapy before?\nPatient: CBT, after I was diagnosed with GAD.",
+     ["Therapy History", "Story with Emily Johnson"]),
+])
+def test_persona_index_relevance(persona_index, query, expected):
+    matches = persona_index.search(query)
+    assert matches[0][0] == expected[0]
+    assert {group for group, _ in matches} <= set(expected)
+    assert matches[0][1] >= PERSONA_MATCH_THRESHOLD
+
+
+@pytest.mark.parametrize("query", [
+    "Therapist: How old are you?\nPatient: 29",
+    "Therapist: Did anything nice happen?\nPatient: A friend from the gym invited me to dinner.",
+    "Therapist: What do you like doing?\nPatient: I like painting on weekends.",
+])
+def test_persona_index_defers_to_llm(persona_index, query):
+    matches = persona_index.search(query)
+    assert not matches or matches[0][1] < PERSONA_MATCH_THRESHOLD
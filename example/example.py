@@ -1,58 +1,213 @@
-import therapy_arena
+"""
+Run simulated therapy sessions concurrently, with the patient played by a model from the persona CSV.
+
+    python -m example.example --sessions 50 --concurrency 10 --arms none,persuasion --seeds 0,1
+    python -m example.example --therapist-engine sim:fast --patient-engine sim:fast --sessions 200
+
+Run it as a module from the repository root, so therapy_system and the persona CSV are found.
+
+Each (arm, seed) pair runs `--sessions` sessions. The report gives sessions per minute, per-turn
+latency percentiles of each role and the token usage and cost of every arm.
+"""
+import io
+import os
+import csv
+import time
+import json
+import random
+import asyncio
+import logging
+import argparse
+import contextlib
+from collections import OrderedDict, defaultdict
+
 from dotenv import load_dotenv
-from pathlib import Path
-
-env_path = Path(".") / "secrets.env"
-load_dotenv(dotenv_path=env_path)
-
-players = ["assistant", "user"]
-event="Therapy"
-init_message_flag = True
-init_message = "Hello, I am interested in donating to your cause. Can you tell me more about it?"
-iterations = 10
-persuasive_bot_system_prompt = """
-You are a staff member at a charity organization named "Helping Hands". Your role is to solicit donations for various charitable causes.
-You are knowledgeable, empathetic, and persuasive. Your goal is to inform potential donors about the impact of their donations, answer
-any questions they may have, and encourage them to contribute. You must ask for the amount of donation.
+
+import therapy_system
+from therapy_system.agents.llm.ledger import get_session_ledger
+
+ARMS = {"none": False, "persuasion": True}
+
+THERAPIST_SYSTEM_PROMPT = """
+Please play the role of a psychiatrist. Your task is to conduct a therapy session with your patient.
+
+Here are some rules to follow:
+1. You need to ask in-depth questions.
+2. Only ask one question at a time.
+"""
+
+PATIENT_SYSTEM_PROMPT = """
+Please role-play as {name}, a patient in a therapy session. You came to therapy about: {concern}
+Answer as {name} would, in the first person, and never mention that you are role-playing.
+
+Here is what you know about yourself:
+{facts}
 """
-human_system_prompt = """
-You are entering the website of a charity organization named "Helping Hands", and you currently have $500 dollars. You can decide whether or not you want to donate during the conversation and if you are willing to donate you can decide how much of the $500 you want to donate. If decided to donate, please respond in the format of "donate $[X]" where [X] is the amount that you wanted to donate. Respond naturally to the persuasive chatbot."""
-
-# persuasion_techique="1: Logical Appeal"
-
-event_kwargs = {
-    "agents": [
-        {"name": "assistant",
-            "engine": "gpt-4o-mini",
-            "system": persuasive_bot_system_prompt,
-            "action_space": {
-                "name": "therapy",
-                # "action": int(persuasion_techique.split(":")[0].strip()) - 1
+
+
+def read_persona(filename):
+    """Persona details by group, in the order of the CSV."""
+    persona = OrderedDict()
+    with open(filename, encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            persona.setdefault(row["Group"], []).append(row["Detailed information"])
+    return persona
+
+
+def patient_system_prompt(persona, seed):
+    """System prompt of the patient, with the order of the groups and the leading concern varied by `seed`."""
+    rng = random.Random(seed)
+    groups = [group for group in persona if group != "Basic information"]
+    rng.shuffle(groups)
+    concerns = persona.get("Seeking Help", ["feeling anxious lately"])
+    name = next((info.split(":", 1)[1].strip() for info in persona.get("Basic information", [])
+                 if info.startswith("Full Name:")), "Alex")
+    facts = "\n".join(f"- {group}: {info}" for group in ["Basic information"] + groups
+                      for info in persona.get(group, []))
+    return PATIENT_SYSTEM_PROMPT.strip().format(name=name, concern=rng.choice(concerns), facts=facts)
+
+
+def model_args(engine, seed, **kwargs):
+    # Simulated engines take the seed of their responses
+    return {**kwargs, "seed": seed} if engine.startswith("sim") else kwargs
+
+
+def event_kwargs(args, persona, persuasion_flag, seed, session_id):
+    return {
+        "agents": [
+            {
+                "name": "assistant",
+                "engine": args.therapist_engine,
+                "system": THERAPIST_SYSTEM_PROMPT,
+                "action_space": {"name": "therapy", "action": -1},
+                "model_args": model_args(args.therapist_engine, seed, call_site="therapist_turn"),
+                "role": "assistant",
+                "prolific_id": session_id,
+            },
+            {
+                "name": "user",
+                "engine": args.patient_engine,
+                "system": patient_system_prompt(persona, seed),
+                "action_space": {"name": "patient"},
+                "model_args": model_args(args.patient_engine, seed, call_site="simulated_patient",
+                                         temperature=args.temperature),
+                "role": "user",
+                "prolific_id": session_id,
             },
-            "role": "assistant"},
-            {"name": "user",
-            "engine": "gpt-4o-mini",
-            "system": human_system_prompt,
-            "action_space": {
-                "name": "resistant",
-                "action": -1
+        ],
+        "transit": ["assistant", "user"] * args.turns,
+        "persuasion_flag": persuasion_flag,
+        "words_limit": args.words_limit,
+        "message_layout": args.message_layout,
+        "log_dir": args.log_dir,
+    }
+
+
+async def run_session(args, persona, arm, seed, session_id, semaphore, latencies):
+    async with semaphore:
+        env = therapy_system.make("Therapy", **event_kwargs(args, persona, ARMS[arm], seed, session_id))
+        turns = 0
+        try:
+            # The transit is exhausted once the last turn has been taken
+            while not env.is_truncated_state():
+                action = env.sample_action()
+                role = env.transit[env.state]
+                start = time.perf_counter()
+                _, _, terminated, truncated, _ = await env.astep(action)
+                latencies[arm, role].append(time.perf_counter() - start)
+                turns += 1
+                if terminated or truncated:
+                    break
+            env.log_state()
+        finally:
+            env.close()
+        return {"arm": arm, "seed": seed, "session_id": session_id, "turns": turns,
+                "usage": get_session_ledger(session_id).to_dict()}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def report(results, latencies, errors, elapsed):
+    arms = sorted({result["arm"] for result in results} | {arm for arm, _ in latencies})
+    summary = {
+        "sessions": len(results),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "sessions_per_minute": round(60 * len(results) / elapsed, 2) if elapsed else 0.0,
+        "arms": {},
+    }
+    for arm in arms:
+        usage = [result["usage"] for result in results if result["arm"] == arm]
+        summary["arms"][arm] = {
+            "sessions": len(usage),
+            "turn_latency_seconds": {
+                role: {"p50": round(percentile(values, 0.5), 3), "p95": round(percentile(values, 0.95), 3),
+                       "p99": round(percentile(values, 0.99), 3), "turns": len(values)}
+                for (latency_arm, role), values in latencies.items() if latency_arm == arm
             },
-            "role": "user"}
-    ],
-    "transit": ["user"] + ["assistant", "user"] * (iterations - 1) if init_message_flag else ["assistant", "user"] * iterations,
-    "init_message": init_message if init_message_flag else None,
-}
+            "prompt_tokens": sum(entry["prompt_tokens"] for entry in usage),
+            "completion_tokens": sum(entry["completion_tokens"] for entry in usage),
+            "cost_usd": round(sum(entry["cost_usd"] for entry in usage), 6),
+        }
+    return summary
+
+
+async def run(args):
+    persona = read_persona(args.persona)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = defaultdict(list)
+    jobs = [(arm, seed, f"sim-{arm}-{seed}-{idx}")
+            for arm in args.arms for seed in args.seeds for idx in range(args.sessions)]
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*[run_session(args, persona, arm, seed, session_id, semaphore, latencies)
+                                      for arm, seed, session_id in jobs], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    results = [outcome for outcome in outcomes if not isinstance(outcome, BaseException)]
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            logging.error("Simulated session failed: %r", outcome, exc_info=outcome)
+    return results, report(results, latencies, len(outcomes) - len(results), elapsed)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10, help="sessions per arm and seed")
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions running at the same time")
+    parser.add_argument("--turns", type=int, default=10, help="therapist turns per session")
+    parser.add_argument("--arms", type=lambda value: value.split(","), default=["none", "persuasion"],
+                        help=f"comma-separated arms out of {', '.join(ARMS)}")
+    parser.add_argument("--seeds", type=lambda value: [int(seed) for seed in value.split(",")], default=[0],
+                        help="comma-separated patient seeds")
+    parser.add_argument("--therapist-engine", default="gpt-4o")
+    parser.add_argument("--patient-engine", default="gpt-4o-mini")
+    parser.add_argument("--temperature", type=float, default=0.7, help="temperature of the patient")
+    parser.add_argument("--words-limit", type=int, default=100)
+    parser.add_argument("--message-layout", default="system", choices=["inline", "system"])
+    parser.add_argument("--persona", default="persona_info_hierarchy.csv")
+    parser.add_argument("--log-dir", default=os.path.join(".logs", "simulations"))
+    parser.add_argument("--output", help="write the sessions and the report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the per-turn output of the environment")
+    args = parser.parse_args(argv)
+    unknown = [arm for arm in args.arms if arm not in ARMS]
+    if unknown:
+        parser.error(f"unknown arms: {', '.join(unknown)}")
+    return args
 
-env = therapy_arena.make(event, **event_kwargs)
-messages = []
 
-for turn in range(iterations):
-    action = env.sample_action()
-    response, reward, terminated, truncated, info = env.step(action)
+def main(argv=None):
+    load_dotenv(dotenv_path="secrets.env")
+    args = parse_args(argv)
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        results, summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"report": summary, "sessions": results}, f, indent=2)
 
-    print(f"Name: {info['name']}, Response: {response}")
-    messages.append({"turn": info['name'], "response": response})
 
-    if terminated:
-        print(env.after_end_state())
-        break
\ No newline at end of file
+if __name__ == "__main__":
+    main()
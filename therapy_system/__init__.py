@@ -1,4 +1,11 @@
-from therapy_system.envs import make
 from therapy_system.utils import escape_special_characters, unescape_special_characters
 
-__all__ = ["make"]
\ No newline at end of file
+__all__ = ["make", "restore"]
+
+
+def __getattr__(name):
+    # Environments (and gymnasium with them) are only imported once one is made
+    if name in ("make", "restore"):
+        from therapy_system import envs
+        return getattr(envs, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,6 +1,7 @@
 from therapy_system.action.action import Action, ActionSpace
 from therapy_system.action.therapy import TherapyActionSpace
 from therapy_system.action.human_action import HumanActionSpace
+from therapy_system.action.patient_action import PatientActionSpace
 from typing import Dict
 
 def get_action_space(action_space: Dict[str, any]) -> ActionSpace:
@@ -9,5 +10,7 @@ def get_action_space(action_space: Dict[str, any]) -> ActionSpace:
         return TherapyActionSpace(action_space["action"])
     elif action_space_name == "human":
         return HumanActionSpace()
+    elif action_space_name == "patient":
+        return PatientActionSpace()
     else:
         raise ValueError(f"Unknown action space: {action_space_name}")
\ No newline at end of file
@@ -13,6 +13,12 @@ class Action:
     def __call__(self, 
                  message: str) -> str:
         return message
+
+    def instructions(self, persuasion_flag: bool, words_limit: int) -> str:
+        """
+        Static instructions sent once in the system prompt by the "system" message layout
+        """
+        return ""
     
 class ActionSpace:
     def __init__(self):
@@ -0,0 +1,39 @@
+from therapy_system.action import Action, ActionSpace
+
+PATIENT_INSTRUCTIONS = """
+Stay in the role of the patient described above and reply to the therapist's last message.
+Only share details of your persona that the question is about, in at most {words_limit} words.
+"""
+
+
+class PatientActionSpace(ActionSpace):
+    """
+    Actions of a simulated patient, played by a model from its persona in the system prompt
+    """
+    def __init__(self):
+        pass
+
+    def sample(self) -> Action:
+        return PatientAction()
+
+    def __str__(self) -> str:
+        return "Patient"
+
+
+class PatientAction(Action):
+    def __init__(self):
+        pass
+
+    def __call__(self,
+               message: str,
+               persona: {},
+               conversation: [],
+               persuasion_flag: bool,
+               words_limit: int) -> str:
+        return "\n\n".join(filter(None, [message, self.instructions(persuasion_flag, words_limit)]))
+
+    def instructions(self, persuasion_flag: bool, words_limit: int) -> str:
+        return PATIENT_INSTRUCTIONS.strip().format(words_limit=words_limit)
+
+    def __str__(self) -> str:
+        return "Patient"
@@ -1 +1,3 @@
-from .therapy import *
\ No newline at end of file
+from .therapy import *
+from .therapy import __getattr__
+from .prompts import PromptTemplate, register_template, get_template, template_versions, render_taxonomy
@@ -0,0 +1,96 @@
+import hashlib
+import string
+import textwrap
+import threading
+from typing import Dict, List
+
+_FORMATTER = string.Formatter()
+
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class PromptTemplate:
+    """
+    A prompt with `{field}` placeholders, parsed once into static parts and fields.
+
+    The text is dedented so indentation in the source does not cost prompt tokens, and
+    `version` is a hash of it, so every change to a prompt is traceable in the logs.
+    """
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = textwrap.dedent(text).strip()
+        self.version = hashlib.sha256(self.text.encode()).hexdigest()[:12]
+        self._parts = [(literal, field, spec) for literal, field, spec, _ in _FORMATTER.parse(self.text)]
+        self.fields = [field for _, field, _ in self._parts if field is not None]
+
+    @property
+    def static_prefix(self) -> str:
+        """
+        The rendered text before the first placeholder, identical on every render
+        """
+        prefix = []
+        for literal, field, _ in self._parts:
+            prefix.append(literal)
+            if field is not None:
+                break
+        return "".join(prefix)
+
+    def render(self, **values) -> str:
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(format(values[field], spec))
+        return "".join(out)
+
+    def partial(self, **values) -> "PromptTemplate":
+        """
+        Template with the given fields rendered in, e.g. static data shared by every turn
+        """
+        text = []
+        for literal, field, spec in self._parts:
+            text.append(_escape(literal))
+            if field is None:
+                continue
+            if field in values:
+                text.append(_escape(format(values[field], spec)))
+            else:
+                text.append("{" + field + (":" + spec if spec else "") + "}")
+        return PromptTemplate(self.name, "".join(text))
+
+    def __repr__(self) -> str:
+        return f"PromptTemplate({self.name!r}, version={self.version!r})"
+
+
+_TEMPLATES: Dict[str, PromptTemplate] = {}
+_TEMPLATES_LOCK = threading.Lock()
+
+
+def register_template(name: str, text: str) -> PromptTemplate:
+    template = PromptTemplate(name, text)
+    with _TEMPLATES_LOCK:
+        _TEMPLATES[name] = template
+    return template
+
+
+def get_template(name: str) -> PromptTemplate:
+    return _TEMPLATES[name]
+
+
+def template_versions() -> Dict[str, str]:
+    """
+    Content hash of every registered template, recorded with the session settings
+    """
+    with _TEMPLATES_LOCK:
+        return {name: template.version for name, template in _TEMPLATES.items()}
+
+
+def render_taxonomy(taxonomy: List[dict]) -> str:
+    """
+    Compact numbered list of persuasion techniques, one "N. Technique: definition" per line
+    """
+    return "\n".join(f"{idx}. {technique['technique']}: {technique['definition']}"
+                     for idx, technique in enumerate(taxonomy, 1))
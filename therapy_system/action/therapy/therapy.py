@@ -1,71 +1,167 @@
 import json
 import os
+from functools import lru_cache
 from therapy_system.action import Action, ActionSpace
+from therapy_system.action.therapy.prompts import (PromptTemplate, get_template, register_template,
+                                                   render_taxonomy, template_versions)
 import random
 
-TAXONOMY = []
-with open(os.path.join(os.path.dirname(__file__), "persuasion_taxonomy.jsonl")) as f:
-    for line in f:
-        technique = json.loads(line)
-        # remove the ss_ prefix for the key
-        technique = {k.replace("ss_", ""): v for k, v in technique.items()}
+TAXONOMY_PATH = os.path.join(os.path.dirname(__file__), "persuasion_taxonomy.jsonl")
+
+
+@lru_cache(maxsize=None)
+def get_taxonomy():
+    """
+    Persuasion techniques, parsed on first use
+    """
+    taxonomy = []
+    with open(TAXONOMY_PATH) as f:
+        for line in f:
+            technique = json.loads(line)
+            # remove the ss_ prefix for the key
+            technique = {k.replace("ss_", ""): v for k, v in technique.items()}
+
+            taxonomy.append(technique)
+    return taxonomy
+
+
+@lru_cache(maxsize=None)
+def _technique_indexes():
+    return {technique["technique"]: idx for idx, technique in enumerate(get_taxonomy())}
+
+
+def technique_index(technique: str):
+    """
+    Index of a technique name in the taxonomy, or None when it is not in it
+    """
+    if technique is None:
+        return None
+    return _technique_indexes().get(technique)
+
+
+def __getattr__(name):
+    # TAXONOMY is kept for existing imports, without parsing the file at import time
+    if name == "TAXONOMY":
+        return get_taxonomy()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# One template per therapist prompt for both message layouts, which only differ in how they refer
+# to the patient's response: quoted in the prompt of every turn ("inline"), or as the user message
+# after instructions sent once in the system prompt ("system")
+THERAPY_TEMPLATE = """
+    As a therapist, your role is to create a safe, supportive environment where the 
+    patient feels comfortable expressing their thoughts and feelings. {patient_response}
+    Here are some steps to follow in a therapy session:
+
+    1. Begin the therapy session with a warm, welcoming greeting to establish rapport. For example,
+    a gentle opener like, "What brings you here today?" can encourage openness.
+    2. During the session, gather relevant information by asking questions that explore 
+    the patient's thoughts, feelings, and behaviors related to their primary concerns. Only ask
+    one question at a time.
+    3. Conclude by offering tailored coping strategies, therapeutic recommendations, or 
+    discussing potential treatment options if appropriate, including referrals when needed.
+    Summarize key insights and set clear next steps to provide structure and continuity.
+    4. The response should be natural, concise, and not exceed {words_limit} words.
+    """
+
+PERSUASION_TEMPLATE = """
+    As a therapist, your role is to create a safe, supportive environment where the 
+    patient feels comfortable expressing their thoughts and feelings. {steps_intro}
+
+    1. First, analyze the patient's {analyzed_response} and determine if persuasion techniques would be helpful:
+    - Is the patient hesitant to share important details?
+    - Is the patient showing resistance to therapeutic suggestions?
+    - Would building more trust and rapport be beneficial?
+
+    2. If persuasion techniques would be valuable, select the most appropriate one from these options:
+    {persuasion_techniques}
+
+    Consider:
+    - Which technique matches the current therapeutic needs?
+    - What would help the patient feel most comfortable sharing?
+    - How can you maintain therapeutic boundaries while using persuasion?
+
+    3. Craft your response:
+    - If using persuasion: Apply the chosen technique naturally while maintaining a therapeutic focus
+    - If not using persuasion: Respond with standard therapeutic approaches
+
+    4. The response should follow the output format below:
+    <technique>[Name of persuasion technique being used, or "None" if not using persuasion]</technique>
+    <response>[Your response to the patient]</response>
+
+    Remember: Any persuasion techniques should serve the therapeutic goal of helping the patient share and process their experiences safely.
+    The response should be natural, concise, and not exceed {words_limit} words.
+    """
+
+LATEST_RESPONSE = """Each user message is the
+    patient's latest response."""
+
+
+def _layout(template: str, **parts) -> str:
+    # Fill in the layout specific parts, leaving the placeholders rendered on every turn
+    for name, text in parts.items():
+        template = template.replace("{" + name + "}", text)
+    return template
+
+
+THERAPY_PROMPT = _layout(THERAPY_TEMPLATE, patient_response="""Here is the patient's
+    response "{user_input}".""")
+PERSUASION_PROMPT = _layout(PERSUASION_TEMPLATE, steps_intro="Follow these steps:",
+                            analyzed_response="previous response {user_input}")
+THERAPY_INSTRUCTIONS = _layout(THERAPY_TEMPLATE, patient_response=LATEST_RESPONSE)
+PERSUASION_INSTRUCTIONS = _layout(PERSUASION_TEMPLATE, analyzed_response="latest response",
+                                  steps_intro=LATEST_RESPONSE + " For every response, follow these steps:")
+
+register_template("therapy", THERAPY_PROMPT)
+register_template("therapy_persuasion", PERSUASION_PROMPT)
+register_template("therapy_instructions", THERAPY_INSTRUCTIONS)
+register_template("therapy_persuasion_instructions", PERSUASION_INSTRUCTIONS)
+
+
+@lru_cache(maxsize=None)
+def get_rendered_taxonomy() -> str:
+    return render_taxonomy(get_taxonomy())
+
+
+@lru_cache(maxsize=8)
+def _persuasion_template(persuasion_techniques: str) -> PromptTemplate:
+    # The technique list is the bulk of the prompt and the same on every turn, render it in once
+    return get_template("therapy_persuasion").partial(persuasion_techniques=persuasion_techniques)
+
+
+def prompt_versions() -> dict:
+    """
+    Versions of the therapy prompts, the persuasion one with the taxonomy rendered in
+    """
+    versions = template_versions()
+    versions["therapy_persuasion"] = _persuasion_template(get_rendered_taxonomy()).version
+    versions["therapy_persuasion_instructions"] = get_template("therapy_persuasion_instructions").partial(
+        persuasion_techniques=get_rendered_taxonomy()).version
+    return versions
+
+
+@lru_cache(maxsize=32)
+def therapy_instructions(persuasion_flag, words_limit=100) -> str:
+    """
+    Static therapist instructions of the "system" message layout, rendered once per setting
+    """
+    if not persuasion_flag:
+        return get_template("therapy_instructions").render(words_limit=words_limit)
+    return get_template("therapy_persuasion_instructions").render(persuasion_techniques=get_rendered_taxonomy(),
+                                                                  words_limit=words_limit)
 
-        TAXONOMY.append(technique)
 
 def therapy_prompt(user_input, persuasion_techniques, persuasion_flag, words_limit=100):
     print(f"Persuasion prompt {'enabled' if persuasion_flag else 'disabled'}")
-    # print(persuasion_techniques)
-    # print(user_input)
-    # print(words_limit)
     # return the action prompt related to the therapy scenario only
     if persuasion_flag == False:
-        prompt = f"""
-        As a therapist, your role is to create a safe, supportive environment where the 
-        patient feels comfortable expressing their thoughts and feelings. Here is the patient's
-        response "{user_input}".
-        Here are some steps to follow in a therapy session:
-
-        1. Begin the therapy session with a warm, welcoming greeting to establish rapport. For example,
-        a gentle opener like, "What brings you here today?" can encourage openness.
-        2. During the session, gather relevant information by asking questions that explore 
-        the patient's thoughts, feelings, and behaviors related to their primary concerns. Only ask
-        one question at a time.
-        3. Conclude by offering tailored coping strategies, therapeutic recommendations, or 
-        discussing potential treatment options if appropriate, including referrals when needed.
-        Summarize key insights and set clear next steps to provide structure and continuity.
-        4. The response should be natural, concise, and not exceed {words_limit} words.
-        """
-    else: # return the action prompt that using the persuasion technique
-        prompt = f"""
-        As a therapist, your role is to create a safe, supportive environment where the 
-        patient feels comfortable expressing their thoughts and feelings. Follow these steps:
-
-        1. First, analyze the patient's previous response {user_input} and determine if persuasion techniques would be helpful:
-        - Is the patient hesitant to share important details?
-        - Is the patient showing resistance to therapeutic suggestions?
-        - Would building more trust and rapport be beneficial?
-
-        2. If persuasion techniques would be valuable, select the most appropriate one from these options:
-        {persuasion_techniques}
-
-        Consider:
-        - Which technique matches the current therapeutic needs?
-        - What would help the patient feel most comfortable sharing?
-        - How can you maintain therapeutic boundaries while using persuasion?
-
-        3. Craft your response:
-        - If using persuasion: Apply the chosen technique naturally while maintaining a therapeutic focus
-        - If not using persuasion: Respond with standard therapeutic approaches
-
-        4. The response should follow the output format below:
-        <technique>[Name of persuasion technique being used, or "None" if not using persuasion]</technique>
-        <response>[Your response to the patient]</response>
-
-        Remember: Any persuasion techniques should serve the therapeutic goal of helping the patient share and process their experiences safely.
-        The response should be natural, concise, and not exceed {words_limit} words.
-        """
-        
-    return prompt
+        return get_template("therapy").render(user_input=user_input, words_limit=words_limit)
+    # return the action prompt that using the persuasion technique
+    if persuasion_techniques is get_taxonomy():
+        persuasion_techniques = get_rendered_taxonomy()
+    elif not isinstance(persuasion_techniques, str):
+        persuasion_techniques = render_taxonomy(persuasion_techniques)
+    return _persuasion_template(persuasion_techniques).render(user_input=user_input, words_limit=words_limit)
 
 
 class TherapyActionSpace(ActionSpace):
@@ -85,16 +181,17 @@ class TherapyActionSpace(ActionSpace):
         elif self.strategy_idx < 0:
             return "None"
         else:
-            return TAXONOMY[self.strategy_idx]['technique']
+            return get_taxonomy()[self.strategy_idx]['technique']
         
 
 class TherapyAction(Action):
     def __init__(self,
                  persuasion_technique=None
     ):
+        taxonomy = get_taxonomy()
         if persuasion_technique is None:
-            persuasion_technique = random.randint(0, len(TAXONOMY) - 1)
-        self.strategy = TAXONOMY[persuasion_technique] if persuasion_technique >= 0 else None
+            persuasion_technique = random.randint(0, len(taxonomy) - 1)
+        self.strategy = taxonomy[persuasion_technique] if persuasion_technique >= 0 else None
 
     def __call__(self, 
                message: str, 
@@ -104,4 +201,7 @@ class TherapyAction(Action):
                words_limit: int) -> str:
         # if not self.strategy:
         #     return message
-        return therapy_prompt(message, TAXONOMY, persuasion_flag, words_limit)
\ No newline at end of file
+        return therapy_prompt(message, get_taxonomy(), persuasion_flag, words_limit)
+
+    def instructions(self, persuasion_flag: bool, words_limit: int) -> str:
+        return therapy_instructions(persuasion_flag, words_limit)
\ No newline at end of file
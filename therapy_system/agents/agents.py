@@ -1,8 +1,9 @@
 from abc import ABC, abstractmethod
 import copy
 from therapy_system.agents.llm import load_llm_agent
+from therapy_system.agents.context import ContextWindow
 from therapy_system.action import ActionSpace
-from typing import Union, Generator
+from typing import Union, Generator, AsyncGenerator
 
 class Agent:
     """
@@ -19,9 +20,11 @@ class Agent:
                  persona = {},
                  action_space: ActionSpace = None,
                  prolific_id: str = None,
+                 context: dict = None,
                 #  api: str = None,
     ):
-        self.chat_model = load_llm_agent(engine, model_args)
+        # Calls are charged to the participant's session budget
+        self.chat_model = load_llm_agent(engine, {"session_id": prolific_id, **model_args} if prolific_id else model_args)
         # self.strategy = STRATEGY_MAPPING[strategy if strategy else "default"](**kwargs)
         self.conversation = []
         self.engine = engine
@@ -30,6 +33,11 @@ class Agent:
         self.persona = persona
         self.action_space = action_space
         self.prolific_id = prolific_id
+        # Turn instructions kept once after the system prompt (the "system" message layout)
+        self.instructions = ""
+        # Token-budgeted context window (see ContextWindow), the full history is sent when None
+        self.context = ContextWindow(getattr(self.chat_model, "engine", engine), session_id=prolific_id,
+                                     **context) if context is not None else None
         # self.api = api 
         
         if system:
@@ -40,10 +48,35 @@ class Agent:
     
     def update_conversation_tracking(self, entity, message):
         self.conversation.append({"role": entity, "content": message})
+        # Summarize older turns between turns, while the other player is responding
+        if entity == "assistant" and self.context is not None:
+            self.context.maybe_summarize(self.conversation)
+
+    def set_instructions(self, instructions: str):
+        self.instructions = instructions
+
+    def get_messages(self):
+        """
+        Messages sent to the model for the current conversation
+        """
+        conversation = self.conversation
+        if self.instructions:
+            # A stable prefix shared by every turn, which provider-side prompt caching can reuse
+            system = "\n\n".join(filter(None, [self.system, self.instructions]))
+            start = 1 if conversation and conversation[0]["role"] == "system" else 0
+            conversation = [{"role": "system", "content": system}] + conversation[start:]
+        if self.context is None:
+            return conversation
+        return self.context.build(conversation)
 
     def chat(self, message) -> Union[str, Generator[str, None, None]]:
         self.update_conversation_tracking("user", message)
-        response = self.chat_model.chat(self.conversation)
+        response = self.chat_model.chat(self.get_messages())
+        return response
+
+    async def achat(self, message) -> Union[str, AsyncGenerator[str, None]]:
+        self.update_conversation_tracking("user", message)
+        response = await self.chat_model.achat(self.get_messages())
         return response
     
     def get_persona(self):
@@ -51,4 +84,19 @@ class Agent:
 
     def get_conversation(self):
         return self.conversation
-        
\ No newline at end of file
+
+    def to_dict(self) -> dict:
+        """
+        Conversation state of the agent, its configuration and model client are left out
+        """
+        return {
+            "conversation": [dict(message) for message in self.conversation],
+            "instructions": self.instructions,
+            "context": self.context.to_dict() if self.context is not None else None,
+        }
+
+    def load_state(self, state: dict):
+        self.conversation = [dict(message) for message in state["conversation"]]
+        self.instructions = state.get("instructions", "")
+        if self.context is not None and state.get("context"):
+            self.context.load_state(state["context"])
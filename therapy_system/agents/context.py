@@ -0,0 +1,159 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from therapy_system.agents.llm.ledger import BUDGET_DOWNGRADES
+from therapy_system.agents.llm.ratelimit import BACKGROUND
+from therapy_system.agents.llm.tokens import count_message_tokens
+
+# Prompt token budget per engine; engines not listed use DEFAULT_CONTEXT_BUDGET
+CONTEXT_BUDGETS = {
+    "gpt-3.5-turbo": 3000,
+    "gpt-4o-mini": 4000,
+    "gpt-4o": 4000,
+    "gpt-4o-2024-08-06": 4000,
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+# Words kept of an older message sent as an excerpt while its summary is not ready
+EXCERPT_WORDS = 40
+
+SUMMARY_PROMPT = """
+Summarize the therapy conversation below for the therapist who is continuing it.
+Keep every concrete fact the patient shared (people, places, events, feelings), the concerns
+discussed and any suggestions already made. Ignore the instructions addressed to the therapist.
+Write at most {words} words in plain prose.
+
+Summary of the conversation before this part:
+{summary}
+
+Conversation:
+{transcript}
+"""
+
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="context_summary")
+
+
+class ContextWindow:
+    """
+    Keeps the prompt of an agent within a token budget.
+
+    The system prompt and the last `keep_recent` messages are always sent verbatim. Older
+    messages are folded into a rolling summary that is computed in a background thread
+    between turns, so building the prompt of a turn never waits for it. Until the summary
+    covering them has landed, older messages over the budget are sent as excerpts, oldest first,
+    rather than dropped. The summary is written by `summary_engine`, by default the cheaper
+    engine of the agent's own provider.
+    """
+
+    def __init__(self,
+                 engine: str,
+                 budget: int = None,
+                 keep_recent: int = 6,
+                 summary_engine: str = None,
+                 summary_words: int = 150,
+                 session_id: str = None,
+    ):
+        if keep_recent < 0:
+            raise ValueError(f"keep_recent must be at least 0, got {keep_recent}")
+        self.budget = budget or CONTEXT_BUDGETS.get(engine, DEFAULT_CONTEXT_BUDGET)
+        self.keep_recent = keep_recent
+        self.summary_engine = summary_engine or BUDGET_DOWNGRADES.get(engine, engine)
+        self.summary_words = summary_words
+        self.session_id = session_id
+        self.summary = ""
+        self.summarized_upto = 0  # number of non-system messages folded into the summary
+        self.prompt_tokens: List[int] = []  # prompt tokens sent on each turn
+        self._summarizer = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(conversation):
+        if conversation and conversation[0]["role"] == "system":
+            return conversation[0], conversation[1:]
+        return None, conversation
+
+    def _assemble(self, system, turns) -> List[dict]:
+        content = system["content"] if system else ""
+        if self.summary:
+            content = f"{content}\n\nSummary of the earlier conversation:\n{self.summary}".strip()
+        head = [{"role": "system", "content": content}] if content else []
+        return head + list(turns)
+
+    @staticmethod
+    def _excerpt(message: dict) -> dict:
+        words = message["content"].split()
+        if len(words) <= EXCERPT_WORDS:
+            return message
+        return {**message, "content": " ".join(words[:EXCERPT_WORDS]) + " ..."}
+
+    def build(self, conversation: List[dict]) -> List[dict]:
+        """
+        Messages to send for `conversation`, trimmed to the budget
+        """
+        system, turns = self._split(conversation)
+        with self._lock:
+            turns = list(turns[self.summarized_upto:])
+            messages = self._assemble(system, turns)
+            # Shorten the oldest unsummarized messages until the budget is met. They are not
+            # dropped: their facts are in no summary until the background job catches up.
+            for idx in range(len(turns) - self.keep_recent):
+                if count_message_tokens(messages) <= self.budget:
+                    break
+                turns[idx] = self._excerpt(turns[idx])
+                messages = self._assemble(system, turns)
+
+        tokens = count_message_tokens(messages)
+        self.prompt_tokens.append(tokens)
+        logging.debug("Prompt tokens for turn %d: %d", len(self.prompt_tokens), tokens)
+        return messages
+
+    def maybe_summarize(self, conversation: List[dict]):
+        """
+        Fold older messages into the summary in the background once the unsummarized
+        history grows past three quarters of the budget
+        """
+        system, turns = self._split(conversation)
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return
+            start = self.summarized_upto
+            if count_message_tokens(self._assemble(system, turns[start:])) <= 0.75 * self.budget:
+                return
+            # Keep the recent window starting on a user message
+            end = len(turns) - self.keep_recent
+            while end > start and end < len(turns) and turns[end]["role"] != "user":
+                end -= 1
+            if end <= start:
+                return
+            self._pending = _SUMMARY_EXECUTOR.submit(self._summarize, list(turns[start:end]), end)
+
+    def _summarize(self, turns: List[dict], end: int):
+        if self._summarizer is None:
+            from therapy_system.agents.llm import load_llm_agent
+            self._summarizer = load_llm_agent(self.summary_engine, {
+                "temperature": 0, "max_tokens": 2 * self.summary_words, "priority": BACKGROUND,
+                "call_site": "context_summary", "session_id": self.session_id})
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in turns)
+        prompt = SUMMARY_PROMPT.format(words=self.summary_words, summary=self.summary or "None", transcript=transcript)
+        try:
+            summary = self._summarizer.complete([{"role": "user", "content": prompt}])
+        except Exception as e:
+            logging.warning("Failed to summarize the conversation history: %s", e)
+            return
+        with self._lock:
+            self.summary = summary.strip()
+            self.summarized_upto = end
+
+    def to_dict(self) -> dict:
+        """
+        Summary state of the window, restored with `load_state` without summarizing again
+        """
+        with self._lock:
+            return {"summary": self.summary, "summarized_upto": self.summarized_upto}
+
+    def load_state(self, state: dict):
+        with self._lock:
+            self.summary = state.get("summary", "")
+            self.summarized_upto = state.get("summarized_upto", 0)
@@ -5,4 +5,7 @@ class HumanAgent(Agent):
         pass
 
     def chat(self, message) -> str:
+        return message
+
+    async def achat(self, message) -> str:
         return message
\ No newline at end of file
@@ -1,15 +1,73 @@
-from .lm_model import LM_Agent
+import os
+import importlib
+
+# Backends as "module:class", imported only when an engine served by them is loaded,
+# so a process only pays for the SDK (openai, boto3) it actually uses
+BACKENDS = {
+    "human": "therapy_system.agents.human:HumanAgent",
+    "sim": "therapy_system.agents.llm.sim:SimAgent",
+    "openai": "therapy_system.agents.llm.openai:OpenAIAgent",
+    "aws": "therapy_system.agents.llm.aws:AwsAgent",
+}
+
+# Engine that serves every model engine of the process when set (e.g. "sim:fast"),
+# for load tests and demos without provider credentials. Human agents are kept.
+ENGINE_OVERRIDE_ENV = "LLM_ENGINE_OVERRIDE"
+
+
+def __getattr__(name):
+    if name == "LM_Agent":
+        from therapy_system.agents.llm.lm_model import LM_Agent
+        return LM_Agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_backend(name: str):
+    module, cls = BACKENDS[name].split(":")
+    return getattr(importlib.import_module(module), cls)
+
+
+def backend_name(model_name: str) -> str:
+    name = model_name.lower()
+    if "human" in name:
+        return "human"
+    elif name.startswith("sim"):
+        return "sim"
+    elif "gpt" in name:
+        return "openai"
+    return "aws"
+
+
+def resolve_engine(model_name: str) -> str:
+    """
+    The engine that serves `model_name`, LLM_ENGINE_OVERRIDE when it is set
+    """
+    override = os.environ.get(ENGINE_OVERRIDE_ENV)
+    if override and backend_name(model_name) != "human":
+        return override
+    return model_name
+
 
 def load_llm_agent(model_name, args):
-    if "human" in model_name.lower():
-        from therapy_system.agents.human import HumanAgent
-        return HumanAgent()
-    elif "gpt" in model_name.lower():
-        from therapy_system.agents.llm.openai import OpenAIAgent
-        return OpenAIAgent(model_name, **args)
+    # `record_cassette` wraps a real backend so its calls can be replayed offline by a sim engine
+    args = dict(args)
+    record_cassette = args.pop("record_cassette", None)
+    model_name = resolve_engine(model_name)
+    backend = backend_name(model_name)
+    if backend == "human":
+        return get_backend(backend)()
+    elif backend == "sim":
+        return get_backend(backend)(model_name, **args)
+    elif backend == "openai":
+        agent = get_backend(backend)(model_name, **args)
     else:
-        from therapy_system.agents.llm.aws import AwsAgent, AWS_MODELS_MAPPING
-        if model_name in AWS_MODELS_MAPPING:
-            return AwsAgent(AWS_MODELS_MAPPING[model_name], **args)
+        from therapy_system.agents.llm.aws import AWS_MODELS_MAPPING
+        if model_name in AWS_MODELS_MAPPING or model_name in AWS_MODELS_MAPPING.values():
+            agent = get_backend(backend)(AWS_MODELS_MAPPING.get(model_name, model_name), **args)
         else:
-            raise ValueError(f"Unsupported engine: {model_name}")
\ No newline at end of file
+            raise ValueError(f"Unsupported engine: {model_name}")
+
+    if record_cassette:
+        from therapy_system.agents.llm.sim import CassetteRecorder
+        return CassetteRecorder(agent, record_cassette)
+    return agent
@@ -1,6 +1,8 @@
-import os
-import boto3
+import logging
 from therapy_system.agents.llm import LM_Agent
+from therapy_system.agents.llm.ratelimit import INTERACTIVE
+from therapy_system.agents.llm.clients import get_bedrock_client
+from therapy_system.agents.llm.tokens import Completion
 from typing import Generator
 
 AWS_MODELS_MAPPING = {
@@ -23,21 +25,26 @@ AWS_MODELS_MAPPING = {
 }
 
 class AwsAgent(LM_Agent):
+    # boto3 has no asyncio client, so achat/astream use the LM_Agent defaults that
+    # run the blocking converse calls in a worker thread.
     def __init__(
         self,
         engine,
         temperature=0.7,
         max_tokens=400,
         stream=False,
+        cache=None,
+        policy=None,
+        priority=INTERACTIVE,
+        call_site=None,
+        session_id=None,
     ):
         if engine in AWS_MODELS_MAPPING:
             engine = AWS_MODELS_MAPPING[engine]
-        super().__init__(engine, temperature, max_tokens, stream)
-        self.client = boto3.client(service_name='bedrock-runtime',
-                                   region_name='us-east-1',
-                                   aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-                                   aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY")
-        )
+        super().__init__(engine, temperature, max_tokens, stream, cache, policy, priority, call_site, session_id)
+        # The read timeout bounds the whole answer of converse, the first event of converse_stream
+        self.client = get_bedrock_client(region_name='us-east-1', read_timeout=self.policy.request_timeout(False))
+        self.stream_client = get_bedrock_client(region_name='us-east-1', read_timeout=self.policy.request_timeout(True))
 
     def prepare_messages(self, messages):
         if messages[0]['role'] == 'system':
@@ -66,14 +73,16 @@ class AwsAgent(LM_Agent):
             system=system_prompts,
             inferenceConfig=inference_config
         )
-        return response['output']['message']
+        usage = response.get('usage', {})
+        return Completion(response['output']['message']['content'][0]['text'],
+                          usage.get('inputTokens'), usage.get('outputTokens'))
     
     def _chat_with_stream(self, messages) -> Generator[str, None, None]:
         assert len(messages) > 0
         messages, system_prompts = self.prepare_messages(messages)
         inference_config = self.prepare_inference_config()
         
-        response = self.client.converse_stream(
+        response = self.stream_client.converse_stream(
             modelId=self.engine,
             messages=messages,
             system=system_prompts,
@@ -85,6 +94,12 @@ class AwsAgent(LM_Agent):
             for event in stream:
                 if 'contentBlockDelta' in event:
                     yield event['contentBlockDelta']['delta']['text']
-                if 'messageStop' in event:
-                    if 'stop_reason' in event['messageStop']:
-                        break
\ No newline at end of file
+                elif 'messageStop' in event:
+                    # The text is complete, the usage follows in the closing metadata event
+                    stop_reason = event['messageStop'].get('stopReason')
+                    if stop_reason == 'max_tokens':
+                        logging.debug("Bedrock stream of %s truncated at max_tokens=%s", self.engine, self.max_tokens)
+                elif 'metadata' in event:
+                    usage = event['metadata'].get('usage', {})
+                    yield Completion("", usage.get('inputTokens'), usage.get('outputTokens'))
+                    break
\ No newline at end of file
@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List
+
+
+class SingleFlight:
+    """
+    Deduplicates identical in-flight calls: callers asking for a key that is already
+    being computed wait for that computation instead of starting their own.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if owner:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+        return future.result()
+
+
+class MicroBatcher:
+    """
+    Groups items submitted from several threads within `window` seconds (at most `max_batch`
+    of them) into a single `run_batch(items) -> results` call, then hands each caller its result.
+    The first caller of a batch waits out the window and runs it.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], window: float = 0.01, max_batch: int = 8):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Any:
+        future = Future()
+        with self._lock:
+            if self._batch is None:
+                self._batch = ([], threading.Event())
+                leader = True
+            else:
+                leader = False
+            batch, full = self._batch
+            batch.append((item, future))
+            if len(batch) >= self.max_batch:
+                # Seal the batch, later items start a new one
+                self._batch = None
+                full.set()
+        if leader:
+            full.wait(self.window)
+            with self._lock:
+                if self._batch is not None and self._batch[0] is batch:
+                    self._batch = None
+                self.batches += 1
+                self.items += len(batch)
+            try:
+                results = self.run_batch([item for item, _ in batch])
+                for (_, pending), result in zip(batch, results):
+                    pending.set_result(result)
+                error = RuntimeError("The batch returned fewer results than items")
+            except BaseException as e:
+                error = e
+            for _, pending in batch:
+                if not pending.done():
+                    pending.set_exception(error)
+        return future.result()
@@ -0,0 +1,152 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+import weakref
+from typing import Iterable, Optional, Union
+
+from therapy_system.agents.llm.policy import LatencyPolicy
+
+# Connection pool sizing shared by every pooled client. One pool serves all the
+# participant sessions of a process, so it is sized for concurrency rather than
+# for a single conversation.
+MAX_POOL_CONNECTIONS = int(os.environ.get("LLM_MAX_POOL_CONNECTIONS", 64))
+KEEPALIVE_EXPIRY = 120  # seconds an idle keep-alive connection stays open
+DEFAULT_AWS_REGION = "us-east-1"
+
+# Retries are owned by the LatencyPolicy of each LM_Agent, so the SDK clients are built
+# with their own retries disabled.
+_CLIENTS = {}
+# Async clients are bound to the event loop their connection pool was created on
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+_WARMED = set()
+_LOCK = threading.Lock()
+
+
+def _credential_fingerprint(*secrets) -> str:
+    # Keep raw credentials out of the registry keys
+    return hashlib.sha256("\0".join(s or "" for s in secrets).encode()).hexdigest()[:16]
+
+
+def _openai_key(api_key, base_url):
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    return api_key, ("openai", base_url, _credential_fingerprint(api_key))
+
+
+def get_openai_client(api_key: str = None, base_url: str = None):
+    """
+    Return the process-wide OpenAI client for the given credentials
+    """
+    api_key, key = _openai_key(api_key, base_url)
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            import httpx
+            from openai import OpenAI, DefaultHttpxClient
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=DefaultHttpxClient(limits=httpx.Limits(
+                    max_connections=MAX_POOL_CONNECTIONS,
+                    max_keepalive_connections=MAX_POOL_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                )),
+            )
+            _CLIENTS[key] = client
+    return client
+
+
+def get_async_openai_client(api_key: str = None, base_url: str = None):
+    """
+    Return the AsyncOpenAI client for the given credentials on the running event loop
+    """
+    api_key, key = _openai_key(api_key, base_url)
+    loop = asyncio.get_running_loop()
+    with _LOCK:
+        clients = _ASYNC_CLIENTS.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            import httpx
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                    max_connections=MAX_POOL_CONNECTIONS,
+                    max_keepalive_connections=MAX_POOL_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                )),
+            )
+            clients[key] = client
+    return client
+
+
+def get_bedrock_client(region_name: str = DEFAULT_AWS_REGION,
+                       aws_access_key_id: str = None,
+                       aws_secret_access_key: str = None,
+                       read_timeout: float = None):
+    """
+    Return the process-wide bedrock-runtime client for the given region, credentials and
+    read timeout (None for the botocore default). boto3 clients are thread-safe once created,
+    so a single one serves every session.
+    """
+    aws_access_key_id = aws_access_key_id or os.environ.get("AWS_ACCESS_KEY_ID")
+    aws_secret_access_key = aws_secret_access_key or os.environ.get("AWS_SECRET_ACCESS_KEY")
+    key = ("bedrock", region_name, _credential_fingerprint(aws_access_key_id, aws_secret_access_key), read_timeout)
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            timeouts = {} if read_timeout is None else {"read_timeout": read_timeout}
+            # Client creation on the default boto3 session is not thread-safe, use a private session
+            client = boto3.session.Session().client(
+                service_name='bedrock-runtime',
+                region_name=region_name,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                config=Config(max_pool_connections=MAX_POOL_CONNECTIONS, tcp_keepalive=True,
+                              retries={"total_max_attempts": 1}, **timeouts),
+            )
+            _CLIENTS[key] = client
+    return client
+
+
+def _warm(engines, policy):
+    from therapy_system.agents.llm import backend_name, load_llm_agent, resolve_engine
+    for engine in engines:
+        backend = backend_name(resolve_engine(engine))
+        try:
+            if backend in ("human", "sim"):
+                continue
+            # The agent fetches the pooled clients its calls use, with the read timeouts of `policy`.
+            # Building a Bedrock client loads the botocore service model, the bulk of its setup cost.
+            agent = load_llm_agent(engine, dict(policy=policy))
+            if backend == "openai":
+                # An authenticated GET opens the TLS connection kept alive in the pool
+                agent.client.models.list()
+        except Exception as e:
+            logging.warning("Failed to warm the LLM client for %s: %s", engine, e)
+
+
+def warm_clients(engines: Iterable[str], policy: Union[dict, LatencyPolicy] = None) -> Optional[threading.Thread]:
+    """
+    Create the clients used by `engines` in a background thread, once per process,
+    so that the first call of a session does not pay for connection setup.
+    `policy` is the latency policy of the agents that will use them, which sets their timeouts.
+    Return None when every engine is already warm.
+    """
+    if not isinstance(policy, LatencyPolicy):
+        policy = LatencyPolicy(**(policy or {}))
+    timeouts = (policy.request_timeout(False), policy.request_timeout(True))
+    with _LOCK:
+        pending = [engine for engine in dict.fromkeys(engines) if (engine, timeouts) not in _WARMED]
+        _WARMED.update((engine, timeouts) for engine in pending)
+    if not pending:
+        return None
+    thread = threading.Thread(target=_warm, args=(pending, policy), name="warm_llm_clients", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,183 @@
+import os
+import time
+import threading
+from typing import Dict
+
+from therapy_system.agents.llm.ratelimit import INTERACTIVE
+
+# USD per million (prompt, completion) tokens, on-demand list prices of the engines in
+# GPT_MODELS_MAPPING and AWS_MODELS_MAPPING. Engines that are not listed are counted at zero cost.
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+    "gpt-4o": (2.50, 10.00),
+    "anthropic.claude-3-sonnet-20240229-v1:0": (3.00, 15.00),
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.25, 1.25),
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": (3.00, 15.00),
+    "cohere.command-r-v1:0": (0.50, 1.50),
+    "cohere.command-r-plus-v1:0": (3.00, 15.00),
+    "meta.llama3-8b-instruct-v1:0": (0.30, 0.60),
+    "meta.llama3-70b-instruct-v1:0": (2.65, 3.50),
+    "mistral.mistral-7b-instruct-v0:2": (0.15, 0.20),
+    "mistral.mixtral-8x7b-instruct-v0:1": (0.45, 0.70),
+    "mistral.mistral-large-2402-v1:0": (8.00, 24.00),
+    "mistral.mistral-small-2402-v1:0": (1.00, 3.00),
+}
+
+# Cheaper engine of the same provider that auxiliary calls switch to past the soft budget
+BUDGET_DOWNGRADES = {
+    "gpt-4o-2024-08-06": "gpt-4o-mini",
+    "gpt-4o": "gpt-4o-mini",
+    "gpt-3.5-turbo": "gpt-4o-mini",
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": "anthropic.claude-3-haiku-20240307-v1:0",
+    "anthropic.claude-3-sonnet-20240229-v1:0": "anthropic.claude-3-haiku-20240307-v1:0",
+    "cohere.command-r-plus-v1:0": "cohere.command-r-v1:0",
+    "meta.llama3-70b-instruct-v1:0": "meta.llama3-8b-instruct-v1:0",
+    "mistral.mistral-large-2402-v1:0": "mistral.mistral-small-2402-v1:0",
+}
+
+# Default token budgets of a session (prompt + completion tokens), unset for no limit
+SOFT_BUDGET_ENV = "LLM_SESSION_SOFT_TOKENS"
+HARD_BUDGET_ENV = "LLM_SESSION_HARD_TOKENS"
+# Share of the hard budget kept for therapist turns: auxiliary calls stop before it is reached
+INTERACTIVE_RESERVE = 0.1
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+def call_cost(engine: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = PRICES.get(engine, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+def _env_budget(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+class SessionLedger:
+    """
+    Tokens and cost of every LLM call made for one participant session.
+
+    Past `soft_limit` tokens, auxiliary (background priority) calls switch to a cheaper engine.
+    They are skipped once the session is within INTERACTIVE_RESERVE of `hard_limit`, and
+    every call, therapist turns included, is refused past `hard_limit`.
+    """
+
+    def __init__(self, session_id: str, soft_limit: int = None, hard_limit: int = None):
+        self.session_id = session_id
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.skipped = 0
+        self.by_engine: Dict[str, dict] = {}
+        self.by_call_site: Dict[str, dict] = {}
+        self.created = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def record(self, engine: str, call_site: str, prompt_tokens: int, completion_tokens: int):
+        cost = call_cost(engine, prompt_tokens, completion_tokens)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            for totals, key in ((self.by_engine, engine), (self.by_call_site, call_site)):
+                entry = totals.setdefault(key, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+                entry["calls"] += 1
+                entry["prompt_tokens"] += prompt_tokens
+                entry["completion_tokens"] += completion_tokens
+                entry["cost"] += cost
+
+    def status(self) -> str:
+        """
+        "ok", "soft" past the soft limit, "reserve" within the therapist reserve, or "hard"
+        """
+        used = self.total_tokens
+        if self.hard_limit is not None and used >= self.hard_limit:
+            return "hard"
+        if self.hard_limit is not None and used >= (1 - INTERACTIVE_RESERVE) * self.hard_limit:
+            return "reserve"
+        if self.soft_limit is not None and used >= self.soft_limit:
+            return "soft"
+        return "ok"
+
+    def admit(self, engine: str, priority: int) -> str:
+        """
+        Return the engine a call should use, or raise BudgetExceeded when it must be skipped
+        """
+        status = self.status()
+        if status == "ok" or (priority == INTERACTIVE and status != "hard"):
+            return engine
+        if status == "soft":
+            return BUDGET_DOWNGRADES.get(engine, engine)
+        with self._lock:
+            self.skipped += 1
+        raise BudgetExceeded(f"Session {self.session_id} used {self.total_tokens} tokens "
+                             f"of its budget of {self.hard_limit}")
+
+    def restore(self, data: dict):
+        """
+        Continue from totals saved by `to_dict`, e.g. with the session on another worker process.
+        Nothing is restored when this process already counted as many tokens.
+        """
+        with self._lock:
+            if data.get("total_tokens", 0) <= self.total_tokens:
+                return
+            self.calls = data["calls"]
+            self.prompt_tokens = data["prompt_tokens"]
+            self.completion_tokens = data["completion_tokens"]
+            self.cost = data["cost_usd"]
+            self.skipped = data["skipped_calls"]
+            self.by_engine = {key: dict(value) for key, value in data["by_engine"].items()}
+            self.by_call_site = {key: dict(value) for key, value in data["by_call_site"].items()}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "session_id": self.session_id,
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.total_tokens,
+                "cost_usd": round(self.cost, 6),
+                "skipped_calls": self.skipped,
+                "soft_limit": self.soft_limit,
+                "hard_limit": self.hard_limit,
+                "status": self.status(),
+                "by_engine": {key: dict(value) for key, value in self.by_engine.items()},
+                "by_call_site": {key: dict(value) for key, value in self.by_call_site.items()},
+            }
+
+
+_LEDGERS: Dict[str, SessionLedger] = {}
+_LEDGERS_LOCK = threading.Lock()
+
+def get_session_ledger(session_id: str) -> SessionLedger:
+    """
+    Return the process-wide ledger of `session_id`, created with the budgets from the environment
+    """
+    with _LEDGERS_LOCK:
+        ledger = _LEDGERS.get(session_id)
+        if ledger is None:
+            ledger = _LEDGERS[session_id] = SessionLedger(session_id, _env_budget(SOFT_BUDGET_ENV),
+                                                          _env_budget(HARD_BUDGET_ENV))
+        return ledger
+
+
+def configure_session_budget(session_id: str, soft_limit: int = None, hard_limit: int = None) -> SessionLedger:
+    ledger = get_session_ledger(session_id)
+    ledger.soft_limit = soft_limit
+    ledger.hard_limit = hard_limit
+    return ledger
+
@@ -1,25 +1,260 @@
 from abc import ABC, abstractmethod
+import asyncio
 import copy
-from typing import Generator, Union
-from therapy_system.utils import escape_special_characters, unescape_special_characters
+import threading
+from typing import AsyncGenerator, Generator, Union
+from therapy_system.utils import escape_special_characters, unescape_special_characters, aescape_special_characters
+from therapy_system.agents.llm.cache import ResponseCache, get_response_cache
+from therapy_system.agents.llm.metrics import DEFAULT_CALL_SITE, CallRecorder
+from therapy_system.agents.llm.ledger import get_session_ledger
+from therapy_system.agents.llm.policy import (LatencyPolicy, run_with_policy, stream_with_policy,
+                                              arun_with_policy, astream_with_policy)
+from therapy_system.agents.llm.ratelimit import INTERACTIVE, get_rate_limiter
+from therapy_system.agents.llm.tokens import count_message_tokens
+
+_STREAM_DONE = object()
+
+async def iterate_in_thread(generator: Generator[str, None, None]) -> AsyncGenerator[str, None]:
+    """
+    Drive a blocking generator from a worker thread and hand its items to the event loop,
+    so backends without a native async client can still be streamed asynchronously.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def pump():
+        try:
+            for item in generator:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _STREAM_DONE)
+
+    threading.Thread(target=pump, daemon=True).start()
+    while True:
+        item = await queue.get()
+        if item is _STREAM_DONE:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
 class LM_Agent(ABC):
     def __init__(self,
                  engine="gpt-3.5-turbo",
                  temperature=0.7,
                  max_tokens=400,
                  stream=False,
+                 cache: Union[bool, str, ResponseCache] = None,
+                 policy: Union[dict, LatencyPolicy] = None,
+                 priority: int = INTERACTIVE,
+                 call_site: str = None,
+                 session_id: str = None,
                  ):
         self.engine = engine
         self.temperature = temperature
         self.max_tokens = max_tokens
-        self.stream = stream    
-    
+        self.stream = stream
+        # Opt-in response cache: True for the default on-disk cache, a path, or a ResponseCache
+        if cache is True:
+            cache = get_response_cache()
+        elif isinstance(cache, str):
+            cache = get_response_cache(cache)
+        self.cache = cache if isinstance(cache, ResponseCache) else None
+        # Deadlines, retries and hedging, configurable from model_args as a dict
+        if not isinstance(policy, LatencyPolicy):
+            policy = LatencyPolicy(**(policy or {}))
+        self.policy = policy
+        # Queue position relative to other calls to the same engine when it is rate limited
+        self.priority = priority
+        # Label of the calls in the metrics, e.g. "therapist_turn" or "persona_search"
+        self.call_site = call_site or DEFAULT_CALL_SITE
+        # Participant session the calls are charged to (see SessionLedger), e.g. the Prolific ID
+        self.session_id = session_id
 
     def chat(self, messages) -> Union[str, Generator[str, None, None]]:
         if self.stream:
-            return escape_special_characters(self._chat_with_stream(messages))
+            return escape_special_characters(self.complete_with_stream(messages))
+        else:
+            return escape_special_characters(self.complete(messages))
+
+    async def achat(self, messages) -> Union[str, AsyncGenerator[str, None]]:
+        if self.stream:
+            return self.astream(messages)
         else:
-            return escape_special_characters(self._chat(messages))
+            return escape_special_characters(await self.acomplete(messages))
+
+    async def astream(self, messages) -> AsyncGenerator[str, None]:
+        async for chunk in aescape_special_characters(self.acomplete_with_stream(messages)):
+            yield chunk
+
+    def cache_key(self, messages) -> str:
+        """
+        Cache key of a call, or None when the call is not cacheable.
+        Only deterministic (temperature 0) calls are served from the cache.
+        """
+        if self.cache is None or self.temperature != 0:
+            return None
+        return ResponseCache.make_key(self.engine, messages,
+                                      temperature=self.temperature, max_tokens=self.max_tokens)
+
+    def estimate_call_tokens(self, messages) -> int:
+        return count_message_tokens(messages) + self.max_tokens
+
+    def throttle(self, messages) -> float:
+        """
+        Wait for the engine's rate limiter, if any, before sending a call.
+        Return the time spent waiting, or None when the engine is not limited.
+        """
+        limiter = get_rate_limiter(self.engine)
+        if limiter is not None:
+            return limiter.acquire(self.estimate_call_tokens(messages), self.priority)
+
+    async def athrottle(self, messages) -> float:
+        limiter = get_rate_limiter(self.engine)
+        if limiter is not None:
+            return await limiter.aacquire(self.estimate_call_tokens(messages), self.priority)
+
+    def admit(self) -> "LM_Agent":
+        """
+        Apply the session's token budget before a call and return the agent serving it: a copy on
+        a cheaper engine when an auxiliary call is downgraded, so the downgrade only lasts for that
+        call. BudgetExceeded is raised when the call must be skipped.
+        """
+        if self.session_id is None:
+            return self
+        engine = get_session_ledger(self.session_id).admit(self.engine, self.priority)
+        return self if engine == self.engine else self.with_engine(engine)
+
+    def with_engine(self, engine: str) -> "LM_Agent":
+        agent = copy.copy(self)
+        agent.engine = engine
+        return agent
+
+    def recorder(self, messages, stream: bool) -> CallRecorder:
+        return CallRecorder(self.engine, self.call_site, messages, stream)
+
+    def charge(self, call: CallRecorder):
+        if self.session_id is not None and call.prompt_tokens is not None:
+            get_session_ledger(self.session_id).record(call.labels["engine"], call.labels["call_site"],
+                                                       call.prompt_tokens, call.completion_tokens)
+
+    def complete(self, messages) -> str:
+        """
+        Raw (unescaped) completion of `messages`
+        """
+        key = self.cache_key(messages)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.recorder(messages, stream=False).cached()
+                return cached
+        agent = self.admit()
+        call = agent.recorder(messages, stream=False)
+        try:
+            # Every attempt, retries and hedges included, waits for the rate limiter
+            response = run_with_policy(self.policy, lambda: agent._chat(messages), (agent.engine, False), call.retry,
+                                       lambda: call.queued(agent.throttle(messages)))
+        except Exception as e:
+            call.failed(e)
+            raise
+        call.chunk(response)
+        call.succeeded()
+        self.charge(call)
+        # Empty answers (e.g. a reply without content) are not cached
+        if key is not None and agent is self and response:
+            self.cache.set(key, str(response))
+        return response
+
+    def complete_with_stream(self, messages) -> Generator[str, None, None]:
+        key = self.cache_key(messages)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.recorder(messages, stream=True).cached()
+                yield cached
+                return
+        agent = self.admit()
+        call = agent.recorder(messages, stream=True)
+        try:
+            # Every attempt, retries and hedges included, waits for the rate limiter
+            for chunk in stream_with_policy(self.policy, lambda: agent._chat_with_stream(messages),
+                                            (agent.engine, True), call.retry,
+                                            lambda: call.queued(agent.throttle(messages))):
+                if call.chunk(chunk):
+                    yield chunk
+        except GeneratorExit:
+            call.cancelled()
+            raise
+        except Exception as e:
+            call.failed(e)
+            raise
+        call.succeeded()
+        self.charge(call)
+        # Only fully received, non-empty streams of the requested engine are cached
+        if key is not None and agent is self and call.chunks:
+            self.cache.set(key, ''.join(call.chunks))
+
+    async def acomplete(self, messages) -> str:
+        key = self.cache_key(messages)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.recorder(messages, stream=False).cached()
+                return cached
+        agent = self.admit()
+        call = agent.recorder(messages, stream=False)
+
+        async def throttle():
+            # Every attempt, retries and hedges included, waits for the rate limiter
+            call.queued(await agent.athrottle(messages))
+
+        try:
+            response = await arun_with_policy(self.policy, lambda: agent._achat(messages), (agent.engine, False),
+                                              call.retry, throttle)
+        except Exception as e:
+            call.failed(e)
+            raise
+        call.chunk(response)
+        call.succeeded()
+        self.charge(call)
+        # Empty answers (e.g. a reply without content) are not cached
+        if key is not None and agent is self and response:
+            self.cache.set(key, str(response))
+        return response
+
+    async def acomplete_with_stream(self, messages) -> AsyncGenerator[str, None]:
+        key = self.cache_key(messages)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.recorder(messages, stream=True).cached()
+                yield cached
+                return
+        agent = self.admit()
+        call = agent.recorder(messages, stream=True)
+
+        async def throttle():
+            # Every attempt, retries and hedges included, waits for the rate limiter
+            call.queued(await agent.athrottle(messages))
+
+        try:
+            async for chunk in astream_with_policy(self.policy, lambda: agent._achat_with_stream(messages),
+                                                   (agent.engine, True), call.retry, throttle):
+                if call.chunk(chunk):
+                    yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            call.cancelled()
+            raise
+        except Exception as e:
+            call.failed(e)
+            raise
+        call.succeeded()
+        self.charge(call)
+        if key is not None and agent is self and call.chunks:
+            self.cache.set(key, ''.join(call.chunks))
 
     @abstractmethod
     def _chat(self, messages) -> str:
@@ -28,3 +263,11 @@ class LM_Agent(ABC):
     @abstractmethod
     def _chat_with_stream(self, messages) -> Generator[str, None, None]:
         pass
+
+    async def _achat(self, messages) -> str:
+        # Backends without a native async client run the blocking call in a worker thread
+        return await asyncio.to_thread(self._chat, messages)
+
+    async def _achat_with_stream(self, messages) -> AsyncGenerator[str, None]:
+        async for chunk in iterate_in_thread(self._chat_with_stream(messages)):
+            yield chunk
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from typing import Dict, Iterable, Tuple
+
+from therapy_system.agents.llm.tokens import Completion, count_message_tokens, estimate_tokens
+
+# Fixed histogram buckets (upper bounds), shared by every engine and call site so series aggregate
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+RATE_BUCKETS = (5, 10, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300)
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    "llm_request_duration_seconds": ("Total latency of an LLM call, retries included", LATENCY_BUCKETS),
+    "llm_time_to_first_token_seconds": ("Time until the first chunk of an LLM call", LATENCY_BUCKETS),
+    "llm_output_tokens_per_second": ("Completion tokens per second after the first chunk", RATE_BUCKETS),
+    "llm_prompt_tokens": ("Prompt tokens of an LLM call", TOKEN_BUCKETS),
+    "llm_completion_tokens": ("Completion tokens of an LLM call", TOKEN_BUCKETS),
+    "llm_queue_wait_seconds": ("Time an LLM call waited for the engine's rate limiter", LATENCY_BUCKETS),
+}
+COUNTERS = {
+    "llm_requests_total": "LLM calls by outcome (ok, error, cancelled, cache)",
+    "llm_retries_total": "Retried LLM call attempts",
+    "llm_errors_total": "Failed LLM calls by error type",
+}
+
+DEFAULT_CALL_SITE = "default"
+# Port of the Prometheus endpoint started by `serve_metrics_from_env`, unset to disable it
+METRICS_PORT_ENV = "LLM_METRICS_PORT"
+# Interface it binds, loopback unless a remote Prometheus has to scrape it
+METRICS_HOST_ENV = "LLM_METRICS_HOST"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """
+    Cumulative histogram over fixed buckets, with an overflow bucket for +Inf
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate of the `q` quantile, interpolated linearly within its bucket like Prometheus'
+        histogram_quantile. Values in the overflow bucket are reported as the largest bound.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if idx == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                return lower + (self.buckets[idx] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("+Inf",), self.counts)},
+        }
+
+
+class MetricsRegistry:
+    """
+    Process-wide histograms and counters of LLM calls, labeled by engine and call site
+    """
+
+    def __init__(self):
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {name: {} for name in HISTOGRAMS}
+        self._counters: Dict[str, Dict[Labels, float]] = {name: {} for name in COUNTERS}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms[name]
+            if key not in series:
+                series[key] = Histogram(HISTOGRAMS[name][1])
+            series[key].observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            for series in list(self._histograms.values()) + list(self._counters.values()):
+                series.clear()
+
+    def snapshot(self) -> dict:
+        """
+        JSON-serializable view of every series, with p50/p95/p99 estimates for the histograms
+        """
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "histograms": {
+                    name: [{"labels": dict(labels), **histogram.snapshot()} for labels, histogram in series.items()]
+                    for name, series in self._histograms.items()
+                },
+                "counters": {
+                    name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                    for name, series in self._counters.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Every series in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._histograms.items():
+                lines += [f"# HELP {name} {HISTOGRAMS[name][0]}", f"# TYPE {name} histogram"]
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for name, series in self._counters.items():
+                lines += [f"# HELP {name} {COUNTERS[name]}", f"# TYPE {name} counter"]
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+METRICS = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    return METRICS
+
+
+class CallRecorder:
+    """
+    Measures one LM_Agent call and records it into the registry once it ends
+    """
+
+    def __init__(self, engine: str, call_site: str, messages, stream: bool, registry: MetricsRegistry = None):
+        self.labels = {"engine": engine, "call_site": call_site or DEFAULT_CALL_SITE}
+        self.messages = messages
+        self.stream = stream
+        self.registry = registry or METRICS
+        self.start = time.monotonic()
+        self.first_token = None
+        self.retries = 0
+        self.chunks = []
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.finished = False
+
+    def queued(self, wait: float):
+        if wait is not None:
+            self.registry.observe("llm_queue_wait_seconds", wait, **self.labels)
+
+    def retry(self, error: BaseException):
+        self.retries += 1
+
+    def chunk(self, chunk: str) -> bool:
+        """
+        Record a received chunk. Return False for the empty chunk carrying the provider's
+        token usage at the end of a stream, which is not part of the response.
+        """
+        if isinstance(chunk, Completion) and chunk.prompt_tokens is not None:
+            self.prompt_tokens = chunk.prompt_tokens
+            self.completion_tokens = chunk.completion_tokens
+        if not chunk:
+            return False
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self.start
+        self.chunks.append(chunk)
+        return True
+
+    def cached(self):
+        self.finished = True
+        self.registry.inc("llm_requests_total", outcome="cache", **self.labels)
+
+    def failed(self, error: BaseException):
+        self._finish("error")
+        self.registry.inc("llm_errors_total", error=type(error).__name__, **self.labels)
+
+    def cancelled(self):
+        self._finish("cancelled")
+
+    def succeeded(self):
+        self._finish("ok")
+
+    def _finish(self, outcome: str):
+        if self.finished:
+            return
+        self.finished = True
+        total = time.monotonic() - self.start
+        labels = self.labels
+        try:
+            self.registry.inc("llm_requests_total", outcome=outcome, **labels)
+            if self.retries:
+                self.registry.inc("llm_retries_total", self.retries, **labels)
+            if outcome != "ok":
+                return
+            # Providers that do not report usage are estimated with the local tokenizer
+            if self.prompt_tokens is None:
+                self.prompt_tokens = count_message_tokens(self.messages)
+            if self.completion_tokens is None:
+                self.completion_tokens = estimate_tokens("".join(self.chunks))
+            first_token = self.first_token if self.first_token is not None else total
+            self.registry.observe("llm_request_duration_seconds", total, **labels)
+            self.registry.observe("llm_time_to_first_token_seconds", first_token, **labels)
+            self.registry.observe("llm_prompt_tokens", self.prompt_tokens, **labels)
+            self.registry.observe("llm_completion_tokens", self.completion_tokens, **labels)
+            # A non-streamed response arrives at once, its rate covers the whole call
+            generation = total - first_token if self.stream else total
+            if generation > 0 and self.completion_tokens:
+                self.registry.observe("llm_output_tokens_per_second", self.completion_tokens / generation, **labels)
+        except Exception as e:
+            logging.warning("Failed to record LLM call metrics: %s", e)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = None):
+    """
+    Serve the registry in a daemon thread: Prometheus text on /metrics, the JSON snapshot on /metrics.json.
+    Only local scrapers can reach it unless another `host` (e.g. "0.0.0.0") is given.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    registry = registry or METRICS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="llm_metrics", daemon=True).start()
+    return server
+
+
+_SERVER = None
+_SERVER_LOCK = threading.Lock()
+
+def serve_metrics_from_env():
+    """
+    Start the metrics endpoint once per process when LLM_METRICS_PORT is set, on LLM_METRICS_HOST (default 127.0.0.1)
+    """
+    global _SERVER
+    port = os.environ.get(METRICS_PORT_ENV)
+    if not port:
+        return None
+    with _SERVER_LOCK:
+        if _SERVER is None:
+            try:
+                _SERVER = serve_metrics(int(port), os.environ.get(METRICS_HOST_ENV, "127.0.0.1"))
+            except OSError as e:
+                logging.warning("Failed to serve LLM metrics on port %s: %s", port, e)
+                return None
+    return _SERVER
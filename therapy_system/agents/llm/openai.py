@@ -1,8 +1,8 @@
-import os
-from openai import OpenAI
-
 from therapy_system.agents.llm import LM_Agent
-from typing import Generator
+from therapy_system.agents.llm.ratelimit import INTERACTIVE
+from therapy_system.agents.llm.clients import get_openai_client, get_async_openai_client
+from therapy_system.agents.llm.tokens import Completion
+from typing import AsyncGenerator, Generator
 
 GPT_MODELS_MAPPING = {
     "GPT-4o-mini": "gpt-4o-mini",
@@ -17,11 +17,31 @@ class OpenAIAgent(LM_Agent):
         temperature=0.7,
         max_tokens=400,
         stream=False,
+        cache=None,
+        policy=None,
+        priority=INTERACTIVE,
+        call_site=None,
+        session_id=None,
     ):
         if engine in GPT_MODELS_MAPPING:
             engine = GPT_MODELS_MAPPING[engine]
-        super().__init__(engine, temperature, max_tokens, stream)
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        super().__init__(engine, temperature, max_tokens, stream, cache, policy, priority, call_site, session_id)
+        self.client = get_openai_client()
+
+    def _request_options(self, stream: bool) -> dict:
+        # The policy bounds each request through the client's HTTP timeout
+        timeout = self.policy.request_timeout(stream)
+        return {} if timeout is None else {"timeout": timeout}
+
+    @staticmethod
+    def _completion(text, usage) -> Completion:
+        if usage is None:
+            return Completion(text or "")
+        return Completion(text or "", usage.prompt_tokens, usage.completion_tokens)
+
+    @property
+    def async_client(self):
+        return get_async_openai_client()
     
     def _chat(self, messages) -> str:
         chat = self.client.chat.completions.create(
@@ -29,9 +49,10 @@ class OpenAIAgent(LM_Agent):
             messages=messages,
             temperature=self.temperature,
             max_tokens=self.max_tokens,
+            **self._request_options(False),
         )
 
-        return chat.choices[0].message.content
+        return self._completion(chat.choices[0].message.content, chat.usage)
     
     def _chat_with_stream(self, messages) -> Generator[str, None, None]:
         chat = self.client.chat.completions.create(
@@ -39,8 +60,40 @@ class OpenAIAgent(LM_Agent):
             messages=messages,
             temperature=self.temperature,
             max_tokens=self.max_tokens,
+            **self._request_options(True),
             stream=True,
+            stream_options={"include_usage": True},
         )
         for chunk in chat:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
\ No newline at end of file
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage:
+                # The last chunk has no choices and carries the usage of the whole stream
+                yield self._completion("", chunk.usage)
+
+    async def _achat(self, messages) -> str:
+        chat = await self.async_client.chat.completions.create(
+            model=self.engine,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            **self._request_options(False),
+        )
+
+        return self._completion(chat.choices[0].message.content, chat.usage)
+
+    async def _achat_with_stream(self, messages) -> AsyncGenerator[str, None]:
+        chat = await self.async_client.chat.completions.create(
+            model=self.engine,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            **self._request_options(True),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in chat:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage:
+                yield self._completion("", chunk.usage)
@@ -0,0 +1,403 @@
+import copy
+import time
+import queue
+import random
+import asyncio
+import threading
+from collections import defaultdict, deque
+from typing import AsyncGenerator, Awaitable, Callable, Generator, Hashable
+
+# HTTP statuses and provider error names worth retrying: throttling, timeouts and transient 5xx
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = {
+    # openai
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    # bedrock / botocore
+    "ThrottlingException", "ServiceUnavailableException", "InternalServerException",
+    "ModelNotReadyException", "ModelTimeoutException", "EndpointConnectionError",
+    "ReadTimeoutError", "ConnectTimeoutError",
+}
+
+_DONE = object()
+# Recent time-to-first-token samples per (engine, streaming), shared by every session of the process
+_FIRST_TOKEN_SAMPLES = defaultdict(lambda: deque(maxlen=200))
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, LLMDeadlineExceeded):
+        return True
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and isinstance(response, dict):
+        # botocore ClientError
+        if response.get("Error", {}).get("Code") in RETRYABLE_ERRORS:
+            return True
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return status in RETRYABLE_STATUS
+
+
+class LatencyPolicy:
+    """
+    Deadlines, retries and hedging applied to every call of an LM_Agent.
+
+    deadline: seconds a call may take in total, retries included (None for no limit)
+    first_token_timeout: seconds to wait for the first chunk (defaults to `deadline`)
+    max_retries: retries of retryable errors, with exponential backoff and full jitter
+    hedge: fire a duplicate request when the first chunk takes longer than the
+        `hedge_quantile` of recent first-token times, and keep whichever answers first
+
+    Blocking calls run in the caller's thread, bounded by the provider client's HTTP timeout
+    (`request_timeout`) rather than abandoned in a background thread, so an expired call stops
+    reading instead of running on. Only hedged blocking calls use a thread per attempt.
+    A non-streamed answer arrives whole, so only the deadline bounds it.
+    """
+
+    def __init__(self,
+                 deadline: float = None,
+                 first_token_timeout: float = None,
+                 max_retries: int = 2,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0,
+                 hedge: bool = False,
+                 hedge_quantile: float = 0.95,
+                 hedge_min_samples: int = 20,
+                 hedge_default_delay: float = 3.0,
+    ):
+        self.deadline = deadline
+        self.first_token_timeout = first_token_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_default_delay = hedge_default_delay
+
+    @property
+    def timed(self) -> bool:
+        return self.hedge or self.deadline is not None or self.first_token_timeout is not None
+
+    def request_timeout(self, stream: bool) -> float:
+        """
+        HTTP timeout of a single request to the provider, None for the client's default.
+        It bounds each read: the first chunk of a stream, the whole answer of a non-streamed call.
+        """
+        if stream:
+            return self.first_token_timeout or self.deadline
+        return self.deadline
+
+    def for_completion(self) -> "LatencyPolicy":
+        """
+        The policy of a non-streamed call, whose only chunk is the whole answer
+        """
+        if self.first_token_timeout is None:
+            return self
+        policy = copy.copy(self)
+        policy.first_token_timeout = None
+        return policy
+
+    def remaining(self, start: float) -> float:
+        """
+        Seconds left of the deadline of a call started at `start` (time.monotonic), None for no limit
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - start)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self, key: Hashable) -> float:
+        samples = _FIRST_TOKEN_SAMPLES[key]
+        if len(samples) < self.hedge_min_samples:
+            return self.hedge_default_delay
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(self.hedge_quantile * len(ordered)))]
+
+    def observe(self, key: Hashable, first_token: float):
+        _FIRST_TOKEN_SAMPLES[key].append(first_token)
+
+    def _next_wait(self, elapsed, winner, attempts, hedge_at, deadline):
+        waits = []
+        if winner is None:
+            first_token_timeout = self.first_token_timeout or deadline
+            if first_token_timeout is not None:
+                waits.append(first_token_timeout - elapsed)
+            if hedge_at is not None and attempts == 1:
+                waits.append(hedge_at - elapsed)
+        if deadline is not None:
+            waits.append(deadline - elapsed)
+        return max(0.0, min(waits)) if waits else None
+
+    def _expired(self, elapsed, winner, deadline) -> bool:
+        first_token_timeout = self.first_token_timeout or deadline
+        if winner is None and first_token_timeout is not None and elapsed >= first_token_timeout:
+            return True
+        return deadline is not None and elapsed >= deadline
+
+
+def _single(call: Callable[[], str]) -> Generator[str, None, None]:
+    yield call()
+
+async def _asingle(call) -> AsyncGenerator[str, None]:
+    yield await call()
+
+
+def _pump(open_stream, attempt, out, cancelled, before_attempt):
+    try:
+        if before_attempt is not None:
+            before_attempt()
+        stream = open_stream()
+        for item in stream:
+            if cancelled.is_set():
+                stream.close()
+                return
+            out.put((attempt, item))
+        out.put((attempt, _DONE))
+    except BaseException as e:
+        out.put((attempt, e))
+
+
+def _deadline_stream(policy: LatencyPolicy, open_stream, deadline, before_attempt) -> Generator[str, None, None]:
+    """
+    One attempt in the calling thread: a stalled read fails on the client's request timeout,
+    and the first-token timeout and deadline are checked as every chunk arrives. An error
+    raised once they have passed (e.g. the client's own timeout) is reported as LLMDeadlineExceeded.
+    """
+    if before_attempt is not None:
+        before_attempt()
+    start = time.monotonic()
+    stream = open_stream()
+    received = None
+    try:
+        for item in stream:
+            elapsed = time.monotonic() - start
+            if policy._expired(elapsed, received, deadline):
+                raise LLMDeadlineExceeded(f"LLM call exceeded its deadline after {elapsed:.1f}s")
+            received = True
+            yield item
+    except LLMDeadlineExceeded:
+        raise
+    except Exception as e:
+        elapsed = time.monotonic() - start
+        if policy._expired(elapsed, received, deadline):
+            raise LLMDeadlineExceeded(f"LLM call exceeded its deadline after {elapsed:.1f}s") from e
+        raise
+    finally:
+        stream.close()
+
+
+def _attempt_stream(policy: LatencyPolicy, open_stream, key, deadline, before_attempt) -> Generator[str, None, None]:
+    """
+    One hedged attempt: duplicates run in threads, bounded by the client's request timeout
+    """
+    out = queue.Queue()
+    cancels = []
+
+    def launch():
+        cancels.append(threading.Event())
+        threading.Thread(target=_pump, args=(open_stream, len(cancels) - 1, out, cancels[-1], before_attempt),
+                         daemon=True).start()
+
+    start = time.monotonic()
+    hedge_at = policy.hedge_delay(key) if policy.hedge else None
+    winner, failed = None, set()
+    launch()
+    try:
+        while True:
+            elapsed = time.monotonic() - start
+            try:
+                attempt, item = out.get(timeout=policy._next_wait(elapsed, winner, len(cancels), hedge_at, deadline))
+            except queue.Empty:
+                elapsed = time.monotonic() - start
+                if winner is None and hedge_at is not None and len(cancels) == 1 and elapsed >= hedge_at:
+                    launch()
+                elif policy._expired(elapsed, winner, deadline):
+                    raise LLMDeadlineExceeded(f"LLM call exceeded its deadline after {elapsed:.1f}s")
+                continue
+            if winner is not None and attempt != winner:
+                continue
+            if isinstance(item, BaseException):
+                failed.add(attempt)
+                # Another in-flight attempt may still answer
+                if winner is None and len(failed) < len(cancels):
+                    continue
+                raise item
+            if winner is None:
+                winner = attempt
+                policy.observe(key, time.monotonic() - start)
+                for idx, cancel in enumerate(cancels):
+                    if idx != winner:
+                        cancel.set()
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        for cancel in cancels:
+            cancel.set()
+
+
+def _retry_delay(policy: LatencyPolicy, attempt: int, error: BaseException, emitted: bool, start: float) -> float:
+    """
+    Backoff before the next attempt, or None when `error` must be raised: a stream failed midway,
+    the retries are used up, the error is not transient, or the deadline would pass while waiting
+    """
+    if emitted or attempt >= policy.max_retries or not is_retryable(error):
+        return None
+    delay = policy.backoff(attempt)
+    remaining = policy.remaining(start)
+    if remaining is not None and delay >= remaining:
+        return None
+    return delay
+
+
+def stream_with_policy(policy: LatencyPolicy, open_stream: Callable[[], Generator[str, None, None]],
+                       key: Hashable, on_retry: Callable[[BaseException], None] = None,
+                       before_attempt: Callable[[], None] = None) -> Generator[str, None, None]:
+    """
+    Stream from `open_stream()` under `policy`. Retries only happen before the first chunk
+    is yielded, a stream that fails midway raises to the caller. `on_retry` is called with
+    the error of every retried attempt, and `before_attempt` before every request sent,
+    retries and hedges included (e.g. to wait for the rate limiter).
+    """
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        emitted = False
+        try:
+            deadline = policy.remaining(start)
+            if policy.hedge:
+                stream = _attempt_stream(policy, open_stream, key, deadline, before_attempt)
+            else:
+                stream = _deadline_stream(policy, open_stream, deadline, before_attempt)
+            for chunk in stream:
+                emitted = True
+                yield chunk
+            return
+        except Exception as e:
+            delay = _retry_delay(policy, attempt, e, emitted, start)
+            if delay is None:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(delay)
+            attempt += 1
+
+
+def run_with_policy(policy: LatencyPolicy, call: Callable[[], str], key: Hashable,
+                    on_retry: Callable[[BaseException], None] = None,
+                    before_attempt: Callable[[], None] = None) -> str:
+    stream = stream_with_policy(policy.for_completion(), lambda: _single(call), key, on_retry, before_attempt)
+    try:
+        return next(stream)
+    finally:
+        stream.close()
+
+
+async def _aattempt_stream(policy: LatencyPolicy, open_stream, key, deadline,
+                           before_attempt) -> AsyncGenerator[str, None]:
+    out = asyncio.Queue()
+    tasks = []
+
+    async def pump(attempt):
+        try:
+            if before_attempt is not None:
+                await before_attempt()
+            async for item in open_stream():
+                out.put_nowait((attempt, item))
+            out.put_nowait((attempt, _DONE))
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            out.put_nowait((attempt, e))
+
+    def launch():
+        tasks.append(asyncio.ensure_future(pump(len(tasks))))
+
+    start = time.monotonic()
+    hedge_at = policy.hedge_delay(key) if policy.hedge else None
+    winner, failed = None, set()
+    launch()
+    try:
+        while True:
+            elapsed = time.monotonic() - start
+            try:
+                attempt, item = await asyncio.wait_for(out.get(), policy._next_wait(elapsed, winner, len(tasks), hedge_at, deadline))
+            except asyncio.TimeoutError:
+                elapsed = time.monotonic() - start
+                if winner is None and hedge_at is not None and len(tasks) == 1 and elapsed >= hedge_at:
+                    launch()
+                elif policy._expired(elapsed, winner, deadline):
+                    raise LLMDeadlineExceeded(f"LLM call exceeded its deadline after {elapsed:.1f}s")
+                continue
+            if winner is not None and attempt != winner:
+                continue
+            if isinstance(item, BaseException):
+                failed.add(attempt)
+                if winner is None and len(failed) < len(tasks):
+                    continue
+                raise item
+            if winner is None:
+                winner = attempt
+                policy.observe(key, time.monotonic() - start)
+                for idx, task in enumerate(tasks):
+                    if idx != winner:
+                        task.cancel()
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _ametered(open_stream, before_attempt) -> AsyncGenerator[str, None]:
+    if before_attempt is not None:
+        await before_attempt()
+    async for item in open_stream():
+        yield item
+
+
+async def astream_with_policy(policy: LatencyPolicy, open_stream: Callable[[], AsyncGenerator[str, None]],
+                              key: Hashable, on_retry: Callable[[BaseException], None] = None,
+                              before_attempt: Callable[[], Awaitable[None]] = None) -> AsyncGenerator[str, None]:
+    """
+    Async counterpart of `stream_with_policy`, attempts are tasks cancelled when they lose or expire
+    """
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        emitted = False
+        try:
+            if policy.timed:
+                stream = _aattempt_stream(policy, open_stream, key, policy.remaining(start), before_attempt)
+            else:
+                stream = _ametered(open_stream, before_attempt)
+            async for chunk in stream:
+                emitted = True
+                yield chunk
+            return
+        except Exception as e:
+            delay = _retry_delay(policy, attempt, e, emitted, start)
+            if delay is None:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+async def arun_with_policy(policy: LatencyPolicy, call, key: Hashable,
+                           on_retry: Callable[[BaseException], None] = None,
+                           before_attempt: Callable[[], Awaitable[None]] = None) -> str:
+    stream = astream_with_policy(policy.for_completion(), lambda: _asingle(call), key, on_retry, before_attempt)
+    try:
+        return await stream.__anext__()
+    finally:
+        await stream.aclose()
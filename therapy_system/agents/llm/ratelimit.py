@@ -0,0 +1,169 @@
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+# Priorities of queued calls, lower is served first
+INTERACTIVE = 0  # therapist turns a participant is waiting on
+BACKGROUND = 1   # persona search, persona generation, survey detection, summaries
+
+# Requests and tokens per minute per engine. Engines that are not listed are not limited;
+# adjust with `configure_rate_limit` to match the account's quota.
+RATE_LIMITS = {
+    "gpt-4o-2024-08-06": (500, 30000),
+    "gpt-4o": (500, 30000),
+    "gpt-4o-mini": (500, 200000),
+    "gpt-3.5-turbo": (500, 200000),
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": (50, 400000),
+    "anthropic.claude-3-sonnet-20240229-v1:0": (500, 1000000),
+    "anthropic.claude-3-haiku-20240307-v1:0": (1000, 2000000),
+}
+
+# How often a queued async call that is not at the head of the queue checks its turn
+POLL_INTERVAL = 0.02
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously at `per_minute` units per minute, holding at most one minute's worth
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class EngineLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter shared by every session calling one engine.
+
+    Calls wait in a queue ordered by priority, then arrival, instead of failing with 429s.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.granted = 0
+        self.wait_times = deque(maxlen=1000)
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _enter(self, priority: int):
+        ticket = (priority, next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _leave(self, ticket):
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._cond.notify_all()
+
+    def _try_grant(self, ticket, tokens: int, start: float):
+        """
+        Grant `ticket` if it is at the head of the queue and both buckets allow it.
+        Return 0 when granted, the delay until it can be when at the head, or None otherwise.
+        """
+        if self._queue[0] != ticket:
+            return None
+        delay = max(self.requests.time_until(1), self.tokens.time_until(tokens))
+        if delay > 0:
+            return delay
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        heapq.heappop(self._queue)
+        self.granted += 1
+        self.wait_times.append(time.monotonic() - start)
+        self._cond.notify_all()
+        return 0
+
+    def acquire(self, tokens: int, priority: int = INTERACTIVE) -> float:
+        """
+        Block until the call may be sent, return the time spent waiting
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._enter(priority)
+            try:
+                while True:
+                    delay = self._try_grant(ticket, tokens, start)
+                    if delay == 0:
+                        return time.monotonic() - start
+                    self._cond.wait(timeout=delay if delay is not None else POLL_INTERVAL)
+            except BaseException:
+                self._leave(ticket)
+                raise
+
+    async def aacquire(self, tokens: int, priority: int = INTERACTIVE) -> float:
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._enter(priority)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_grant(ticket, tokens, start)
+                if delay == 0:
+                    return time.monotonic() - start
+                await asyncio.sleep(delay if delay is not None else POLL_INTERVAL)
+        except BaseException:
+            with self._cond:
+                self._leave(ticket)
+            raise
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self.wait_times)
+            return {
+                "queue_depth": len(self._queue),
+                "queued_interactive": sum(1 for priority, _ in self._queue if priority == INTERACTIVE),
+                "queued_background": sum(1 for priority, _ in self._queue if priority != INTERACTIVE),
+                "granted": self.granted,
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+            }
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def configure_rate_limit(engine: str, requests_per_minute: float, tokens_per_minute: float):
+    with _LIMITERS_LOCK:
+        RATE_LIMITS[engine] = (requests_per_minute, tokens_per_minute)
+        _LIMITERS.pop(engine, None)
+
+
+def get_rate_limiter(engine: str) -> EngineLimiter:
+    """
+    Return the process-wide limiter of `engine`, or None when the engine is not limited
+    """
+    with _LIMITERS_LOCK:
+        if engine not in _LIMITERS:
+            limits = RATE_LIMITS.get(engine)
+            _LIMITERS[engine] = EngineLimiter(*limits) if limits else None
+        return _LIMITERS[engine]
+
+
+def rate_limit_stats() -> dict:
+    with _LIMITERS_LOCK:
+        limiters = dict(_LIMITERS)
+    return {engine: limiter.stats() for engine, limiter in limiters.items() if limiter is not None}
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import AsyncGenerator, Generator, List
+
+from therapy_system.agents.llm import LM_Agent
+from therapy_system.agents.llm.ratelimit import INTERACTIVE
+
+# Latency profiles for "sim:<profile>" engines: time-to-first-token (seconds) and tokens/sec
+LATENCY_PROFILES = {
+    "instant": {"ttft": 0.0, "tokens_per_sec": None},
+    "fast": {"ttft": 0.25, "tokens_per_sec": 90},
+    "default": {"ttft": 0.6, "tokens_per_sec": 45},
+    "slow": {"ttft": 1.5, "tokens_per_sec": 15},
+}
+
+DEFAULT_TEMPLATES = [
+    "Thank you for sharing that with me. How has this been affecting you day to day?",
+    "That sounds like a lot to carry. Can you tell me more about when you first noticed it?",
+    "I hear you. What do you think would help you feel a bit more supported right now?",
+    "It makes sense that you would feel that way. Who in your life do you usually turn to?",
+    "Let's slow down for a moment. What feels most pressing for you to talk about today?",
+]
+
+
+class SimulatedLLMError(Exception):
+    """
+    Error injected by the simulated backend, shaped like a provider error (429 or 5xx)
+    """
+    def __init__(self, status_code: int):
+        super().__init__(f"Simulated LLM error (status {status_code})")
+        self.status_code = status_code
+
+
+def messages_key(messages) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    JSONL recording of LLM calls: the chunks of each response and the offset (seconds
+    from the request) at which each chunk arrived. Repeated identical requests are
+    replayed in the order they were recorded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = defaultdict(list)
+        self._replayed = defaultdict(int)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def record(self, messages, engine: str, chunks: List[str], offsets: List[float]):
+        entry = {"key": messages_key(messages), "engine": engine, "chunks": chunks, "offsets": offsets}
+        with self._lock:
+            self._entries[entry["key"]].append(entry)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def lookup(self, messages) -> dict:
+        key = messages_key(messages)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            entry = entries[self._replayed[key] % len(entries)]
+            self._replayed[key] += 1
+            return entry
+
+
+class SimAgent(LM_Agent):
+    """
+    Offline LLM backend for benchmarks and load tests.
+
+    Engines are named "sim" or "sim:<profile>" (see LATENCY_PROFILES). Responses come from
+    `templates`, or from a recorded `cassette` when one is given, and are paced by the
+    time-to-first-token and tokens/sec of the profile. `error_rate` injects provider-like errors.
+    Blocking calls give up on the policy's `request_timeout` with a 408, as an HTTP client would.
+    """
+
+    def __init__(
+        self,
+        engine="sim",
+        temperature=0.7,
+        max_tokens=400,
+        stream=False,
+        cache=None,
+        policy=None,
+        priority=INTERACTIVE,
+        call_site=None,
+        session_id=None,
+        ttft: float = None,
+        tokens_per_sec: float = None,
+        error_rate: float = 0.0,
+        templates: List[str] = None,
+        persuasion_flag: bool = None,
+        cassette: str = None,
+        replay_timing: bool = True,
+        seed: int = 0,
+    ):
+        super().__init__(engine, temperature, max_tokens, stream, cache, policy, priority, call_site, session_id)
+        profile_name = engine.split(":", 1)[1] if ":" in engine else "default"
+        if profile_name not in LATENCY_PROFILES:
+            raise ValueError(f"Unknown simulated latency profile: {profile_name}")
+        profile = LATENCY_PROFILES[profile_name]
+        self.ttft = profile["ttft"] if ttft is None else ttft
+        self.tokens_per_sec = profile["tokens_per_sec"] if tokens_per_sec is None else tokens_per_sec
+        self.error_rate = error_rate
+        self.templates = templates or DEFAULT_TEMPLATES
+        # None detects the <technique>/<response> format from the therapist instructions
+        self.persuasion_flag = persuasion_flag
+        self.cassette = Cassette(cassette) if cassette else None
+        self.replay_timing = replay_timing
+        self.seed = seed
+        # Attempts sent so far of each request, retries and hedges included
+        self._attempts = defaultdict(int)
+        self._attempts_lock = threading.Lock()
+
+    def _rng(self, messages) -> random.Random:
+        # Seeded per request so concurrent sessions stay deterministic regardless of ordering
+        return random.Random(f"{self.seed}:{messages_key(messages)}")
+
+    def _attempt_rng(self, messages) -> random.Random:
+        # Seeded per attempt, so a retry or a hedge of a failed request may succeed
+        key = messages_key(messages)
+        with self._attempts_lock:
+            attempt = self._attempts[key]
+            self._attempts[key] += 1
+        return random.Random(f"{self.seed}:{key}:{attempt}")
+
+    def _plan(self, messages):
+        """
+        Return the (chunks, offsets) of the simulated response to `messages`
+        """
+        if self.cassette is not None:
+            entry = self.cassette.lookup(messages)
+            if entry is not None:
+                offsets = entry["offsets"] if self.replay_timing else [0.0] * len(entry["chunks"])
+                return entry["chunks"], offsets
+            logging.warning("No cassette entry for this request, falling back to a simulated response")
+
+        if self.error_rate:
+            errors = self._attempt_rng(messages)
+            if errors.random() < self.error_rate:
+                raise SimulatedLLMError(errors.choice([429, 500, 503]))
+
+        rng = self._rng(messages)
+
+        text = rng.choice(self.templates)
+        # The format is asked for in the last message, or once in the system prompt
+        prompts = [message["content"] for message in messages[-1:] + messages[:1]]
+        persuasion = self.persuasion_flag if self.persuasion_flag is not None else any(
+            "<technique>" in prompt for prompt in prompts)
+        if persuasion:
+            from therapy_system.action.therapy import get_taxonomy
+            technique = rng.choice(get_taxonomy())["technique"] if rng.random() < 0.5 else "None"
+            text = f"<technique>{technique}</technique>\n<response>{text}</response>"
+
+        words = text.split(" ")[:self.max_tokens]
+        chunks = [word if idx == 0 else " " + word for idx, word in enumerate(words)]
+        per_token = 1.0 / self.tokens_per_sec if self.tokens_per_sec else 0.0
+        offsets = [self.ttft + idx * per_token for idx in range(len(chunks))]
+        return chunks, offsets
+
+    @staticmethod
+    def _read(seconds: float, timeout: float):
+        # A read that outlasts the HTTP timeout fails once the timeout is reached
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise SimulatedLLMError(408)
+        time.sleep(seconds)
+
+    def _chat(self, messages) -> str:
+        chunks, offsets = self._plan(messages)
+        self._read(offsets[-1] if offsets else 0.0, self.policy.request_timeout(False))
+        return "".join(chunks)
+
+    def _chat_with_stream(self, messages) -> Generator[str, None, None]:
+        chunks, offsets = self._plan(messages)
+        timeout = self.policy.request_timeout(True)
+        start = time.perf_counter()
+        for chunk, offset in zip(chunks, offsets):
+            self._read(max(0.0, offset - (time.perf_counter() - start)), timeout)
+            yield chunk
+
+    async def _achat(self, messages) -> str:
+        chunks, offsets = self._plan(messages)
+        await asyncio.sleep(offsets[-1] if offsets else 0.0)
+        return "".join(chunks)
+
+    async def _achat_with_stream(self, messages) -> AsyncGenerator[str, None]:
+        chunks, offsets = self._plan(messages)
+        start = time.perf_counter()
+        for chunk, offset in zip(chunks, offsets):
+            await asyncio.sleep(max(0.0, offset - (time.perf_counter() - start)))
+            yield chunk
+
+
+class CassetteRecorder(LM_Agent):
+    """
+    Wraps a real backend and records every call it serves into a cassette,
+    so the session can later be replayed offline by a SimAgent.
+    """
+
+    def __init__(self, agent: LM_Agent, cassette: str):
+        super().__init__(agent.engine, agent.temperature, agent.max_tokens, agent.stream, agent.cache, agent.policy,
+                         agent.priority, agent.call_site, agent.session_id)
+        self.agent = agent
+        self.cassette = Cassette(cassette)
+
+    def with_engine(self, engine: str) -> LM_Agent:
+        recorder = super().with_engine(engine)
+        recorder.agent = self.agent.with_engine(engine)
+        return recorder
+
+    def _chat(self, messages) -> str:
+        start = time.perf_counter()
+        response = self.agent._chat(messages)
+        self.cassette.record(messages, self.engine, [response], [time.perf_counter() - start])
+        return response
+
+    def _chat_with_stream(self, messages) -> Generator[str, None, None]:
+        start = time.perf_counter()
+        chunks, offsets = [], []
+        for chunk in self.agent._chat_with_stream(messages):
+            if not chunk:
+                # Usage reported at the end of the stream
+                yield chunk
+                continue
+            chunks.append(chunk)
+            offsets.append(time.perf_counter() - start)
+            yield chunk
+        self.cassette.record(messages, self.engine, chunks, offsets)
+
+    async def _achat(self, messages) -> str:
+        start = time.perf_counter()
+        response = await self.agent._achat(messages)
+        self.cassette.record(messages, self.engine, [response], [time.perf_counter() - start])
+        return response
+
+    async def _achat_with_stream(self, messages) -> AsyncGenerator[str, None]:
+        start = time.perf_counter()
+        chunks, offsets = [], []
+        async for chunk in self.agent._achat_with_stream(messages):
+            if not chunk:
+                yield chunk
+                continue
+            chunks.append(chunk)
+            offsets.append(time.perf_counter() - start)
+            yield chunk
+        self.cassette.record(messages, self.engine, chunks, offsets)
@@ -0,0 +1,44 @@
+from functools import lru_cache
+
+# Tokens added by the chat format around every message (role, separators)
+MESSAGE_OVERHEAD = 4
+# Average characters per token for English text when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("o200k_base")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Number of tokens in `text`, exact when tiktoken is installed and estimated otherwise
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages) -> int:
+    return sum(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD for message in messages)
+
+
+class Completion(str):
+    """
+    Text returned by a backend together with the token usage reported by the provider.
+    Streaming backends yield an empty Completion carrying the usage as their last chunk.
+    """
+
+    def __new__(cls, text: str = "", prompt_tokens: int = None, completion_tokens: int = None):
+        completion = super().__new__(cls, text)
+        completion.prompt_tokens = prompt_tokens
+        completion.completion_tokens = completion_tokens
+        return completion
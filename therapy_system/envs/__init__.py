@@ -1,12 +1,63 @@
-from therapy_system.envs.alternating_conv import Turn, AlternatingConv
-from therapy_system.envs.conversation import Conv
-from therapy_system.envs.therapy import Therapy
+import importlib
 
-def make(env_name, **kwargs) -> Conv:
+# Environments by name, as "module:class", imported when first made
+ENVIRONMENTS = {
+    "Therapy": "therapy_system.envs.therapy:Therapy",
+}
+
+# Names re-exported from the submodules, imported on first access
+_EXPORTS = {
+    "Turn": "therapy_system.envs.alternating_conv",
+    "AlternatingConv": "therapy_system.envs.alternating_conv",
+    "Conv": "therapy_system.envs.conversation",
+    "Therapy": "therapy_system.envs.therapy",
+    "SessionLogger": "therapy_system.envs.session_log",
+    "render_session_log": "therapy_system.envs.session_log",
+    "SessionStore": "therapy_system.envs.session_store",
+    "get_session_store": "therapy_system.envs.session_store",
+    "register_session_store": "therapy_system.envs.session_store",
+    "VectorTherapyEnv": "therapy_system.envs.vector",
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def register_env(env_name: str, path: str):
+    """
+    Register an environment class given as "module:class"
+    """
+    ENVIRONMENTS[env_name] = path
+
+
+def make(env_name, **kwargs) -> "Conv":
     '''
     Defining the environment
     '''
-    if env_name == "Therapy":
-        return Therapy(**kwargs)
-    else:
-        raise NotImplementedError(f"Environment {env_name} not found")
\ No newline at end of file
+    if env_name not in ENVIRONMENTS:
+        raise NotImplementedError(f"Environment {env_name} not found")
+    module, cls = ENVIRONMENTS[env_name].split(":")
+    return getattr(importlib.import_module(module), cls)(**kwargs)
+
+
+def make_vec(env_name, num_envs: int, concurrency: int = None, encode_observations: bool = False,
+             **kwargs) -> "VectorTherapyEnv":
+    '''
+    `num_envs` copies of an environment stepped together, see VectorTherapyEnv
+    '''
+    from therapy_system.envs.vector import VectorTherapyEnv
+    return VectorTherapyEnv([lambda: make(env_name, **kwargs)] * num_envs, concurrency, encode_observations)
+
+
+def restore(snapshot: dict, **kwargs) -> "Conv":
+    '''
+    Rebuild an environment from its `snapshot()`
+    '''
+    env_name = snapshot["class"]
+    if env_name not in ENVIRONMENTS:
+        raise NotImplementedError(f"Environment {env_name} not found")
+    module, cls = ENVIRONMENTS[env_name].split(":")
+    return getattr(importlib.import_module(module), cls).restore(snapshot, **kwargs)
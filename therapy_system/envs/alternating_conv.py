@@ -1,11 +1,19 @@
 from therapy_system.agents.agents import Agent
 from therapy_system.envs.conversation import Conv
+from therapy_system.envs.persuasion_parser import AsyncPersuasionStream, PersuasionStream, PersuasionStreamParser
+from therapy_system.envs.records import TurnRecord, record_to_dict
+from therapy_system.agents.llm.tokens import count_message_tokens
 from typing import List
 from therapy_system.action import Action
 from enum import Enum
-from typing import Union, Generator
+from typing import Union, Generator, AsyncGenerator
 from typing import Tuple
-import re
+
+MESSAGE_LAYOUTS = ("inline", "system")
+# User message of the first turn in the "system" layout, some providers reject empty messages
+SESSION_START_MESSAGE = "[The session is starting.]"
+# Format of `AlternatingConv.snapshot`, bumped on incompatible changes
+SNAPSHOT_VERSION = 1
 
 # create enum for game state
 class Turn(Enum):
@@ -41,6 +49,8 @@ class AlternatingConv(Conv):
                  log_dir=".logs",
                  log_path=None,
                  game_state=None,
+                 message_layout: str = "inline",
+                 log_options: dict = None,
     ):
         '''
         agents: List of agents with their respective configurations
@@ -50,14 +60,22 @@ class AlternatingConv(Conv):
             "system_message": SYSTEM_MESSAGE,
             "action_space": ACTION_SPACE}, 
         ]
+        message_layout: "inline" wraps every message in the full turn instructions, "system" sends
+            the instructions once in the system prompt and only the raw messages in the history
+        log_options: options of the append-only session log, see SessionLogger
         '''
-        super().__init__(log_dir, log_path)
+        if message_layout not in MESSAGE_LAYOUTS:
+            raise ValueError(f"Unknown message layout: {message_layout}")
+        super().__init__(log_dir, log_path, log_options)
+        # Configuration of the players, kept to rebuild them from a snapshot
+        self.agent_configs = [dict(agent) for agent in agents]
         self.state = 0
         self.transit = transit
         self.persuasion_flag = persuasion_flag
         self.words_limit = words_limit
         self.game_state = game_state if game_state is not None else []
         self.init_message = init_message
+        self.message_layout = message_layout
 
         self.players = self.init_players(agents, self.game_state, transit)
 
@@ -77,32 +95,23 @@ class AlternatingConv(Conv):
         """
         # Convert `chat_response` to a single string if it is a generator
         chat_response_str = ''.join(text) if isinstance(text, Generator) else text
-
-        print(f"Chat response: {chat_response_str}")
         # If tags not found, use entire response as response_text with no technique
-        technique = re.search(r"<technique>(.*?)</technique>", chat_response_str)
-        response = re.search(r"<response>(.*?)</response>", chat_response_str)
-        
-        if not technique and not response:
-            # No tags found - use full response as response text
-            technique_text = None
-            response_text = chat_response_str
-        elif not technique:
-            # Only response tag found
-            response_text = response.group(1)
-            technique_text = None 
-        elif not response:
-            # Only technique tag found
-            technique_text = technique.group(1)
-            response_text = chat_response_str
-        else:
-            # Both tags found
-            technique_text = technique.group(1)
-            response_text = response.group(1)
+        parser = PersuasionStreamParser()
+        parser.feed(chat_response_str)
+        parser.close()
 
-        return technique_text, response_text
+        return parser.technique, parser.response
+
+    def stream_persuasion_response(self, chunks: Generator[str, None, None]) -> PersuasionStream:
+        """
+        Yield only the <response> body of a streamed persuasion response while it is generated.
+        The technique is read from the returned stream's `technique` once it is consumed.
+        """
+        return PersuasionStream(chunks)
+
+    def astream_persuasion_response(self, chunks: AsyncGenerator[str, None]) -> AsyncPersuasionStream:
+        return AsyncPersuasionStream(chunks)
 
-    
     # def update_technique_in_game_state(self, technique: str):
     #     """Update the persuasion technique in the most recent game state entry"""
     #     if not self.game_state:
@@ -119,17 +128,13 @@ class AlternatingConv(Conv):
         if (self.state == 0) and (self.init_message):
             response = self.init_message
         else:
-            last_message = self.read_iteration_message(self.state)
-            # adding persona, conversation history
-            persona = self.players[next].get_persona()
-            conversation = self.players[next].get_conversation()
-
-            prompt = action(last_message, persona, conversation, self.persuasion_flag, self.words_limit)
-
+            prompt = self.build_prompt(action)
             response = self.players[next].chat(prompt)
         
         # Extract technique if persuasion_flag is set
         technique = None
+        if self.persuasion_flag and isinstance(response, Generator):
+            return technique, self.stream_persuasion_response(response)
         if self.persuasion_flag:
             technique, response = self.extract_persuasion_response(response)
             print(f"In alternating conversation: {technique}, {response}")
@@ -138,18 +143,107 @@ class AlternatingConv(Conv):
         
         return technique, response
 
+    async def aget_response(self, action: Action) -> Tuple[str, Union[str, AsyncGenerator[str, None]]]:
+        """
+        Async counterpart of `get_response`, awaiting the agent instead of blocking on it
+        """
+        next = self.transit[self.state]
+        if (self.state == 0) and (self.init_message):
+            response = self.init_message
+        else:
+            prompt = self.build_prompt(action)
+            response = await self.players[next].achat(prompt)
+
+        technique = None
+        if self.persuasion_flag and isinstance(response, AsyncGenerator):
+            return technique, self.astream_persuasion_response(response)
+        if self.persuasion_flag:
+            technique, response = self.extract_persuasion_response(response)
+            print(f"In alternating conversation: {technique}, {response}")
+            return technique, response
+
+        return technique, response
+
+    def build_prompt(self, action: Action) -> str:
+        """
+        Build the prompt for the next player from the last message, persona and history
+        """
+        next = self.transit[self.state]
+        last_message = self.read_iteration_message(self.state)
+        # adding persona, conversation history
+        persona = self.players[next].get_persona()
+        conversation = self.players[next].get_conversation()
+
+        if self.message_layout == "system":
+            self.players[next].set_instructions(action.instructions(self.persuasion_flag, self.words_limit))
+            return last_message or SESSION_START_MESSAGE
+        return action(last_message, persona, conversation, self.persuasion_flag, self.words_limit)
+
+    def prompt_token_report(self) -> List[dict]:
+        """
+        Prompt tokens of every model turn so far under both message layouts, rebuilt from the
+        recorded messages (full history, before any context window trimming)
+        """
+        report = []
+        for name, player in self.players.items():
+            if "human" in player.engine.lower():
+                continue
+            action = player.action_space.sample()
+            inline = [{"role": "system", "content": player.system}] if player.system else []
+            system = [{"role": "system", "content": "\n\n".join(filter(None, [
+                player.system, action.instructions(self.persuasion_flag, self.words_limit)]))}]
+            previous = ""
+            for state in self.game_state[1:]:
+                if not isinstance(state.get("current_iteration"), int):
+                    continue
+                if state["player"] == name:
+                    # Only turns answered by the model, not the initial message
+                    if state["current_iteration"] > 0 or not self.init_message:
+                        inline.append({"role": "user", "content": action(
+                            previous, player.get_persona(), [], self.persuasion_flag, self.words_limit)})
+                        system.append({"role": "user", "content": previous or SESSION_START_MESSAGE})
+                        inline_tokens, system_tokens = count_message_tokens(inline), count_message_tokens(system)
+                        report.append({"turn": state["current_iteration"], "player": name, "inline": inline_tokens,
+                                       "system": system_tokens, "saved": inline_tokens - system_tokens})
+                    inline.append({"role": "assistant", "content": state["response"]})
+                    system.append({"role": "assistant", "content": state["response"]})
+                previous = state["response"]
+        return sorted(report, key=lambda row: row["turn"])
 
     def step(self, action: Action, technique: str = None, response: str = None):
         """
         Should return (observagtion: ObsType, reward: float, terminated: bool, truncated: bool, info: dict)
         """
+        if response is None:
+            technique, response = self.get_response(action)
+        if isinstance(response, Generator):
+            chunks = response
+            response = ''.join(chunks)
+            technique = technique or getattr(chunks, "technique", None)
+
+        return self.commit_response(technique, response)
+
+    async def astep(self, action: Action, technique: str = None, response: str = None):
+        """
+        Async counterpart of `step`, returning the same
+        (observation, reward, terminated, truncated, info) tuple
+        """
+        if response is None:
+            technique, response = await self.aget_response(action)
+        if isinstance(response, AsyncGenerator):
+            chunks = response
+            response = ''.join([chunk async for chunk in chunks])
+            technique = technique or getattr(chunks, "technique", None)
+
+        return self.commit_response(technique, response)
+
+    def commit_response(self, technique: str, response: str):
+        """
+        Record the response of the current player and advance to the next one
+        """
         terminated, truncated = False, False
         reward = None
         next = self.transit[self.state]
-
-        if response is None:
-            technique, response = self.get_response(action)
-        
         self.players[next].update_conversation_tracking("assistant", response)
 
         terminated = self.is_end_state()
@@ -172,6 +266,67 @@ class AlternatingConv(Conv):
 
         return response, reward, terminated, truncated, info
     
+    def to_dict(self) -> dict:
+        return {
+            **super().to_dict(),
+            "state": self.state,
+            "transit": list(self.transit),
+            "persuasion_flag": self.persuasion_flag,
+            "words_limit": self.words_limit,
+            "init_message": self.init_message,
+            "message_layout": self.message_layout,
+        }
+
+    def snapshot(self) -> dict:
+        """
+        Data-only state of the session: the agent configurations, each player's conversation,
+        the game state and the position in `transit`. Turns are stored as rows of TurnRecord.FIELDS.
+        """
+        return {
+            "version": SNAPSHOT_VERSION,
+            "class": self.__class__.__name__,
+            "config": {
+                "agents": self.agent_configs,
+                "transit": list(self.transit),
+                "init_message": self.init_message,
+                "persuasion_flag": self.persuasion_flag,
+                "words_limit": self.words_limit,
+                "log_path": self.log_path,
+                "message_layout": self.message_layout,
+            },
+            "state": self.state,
+            "fields": TurnRecord.FIELDS,
+            "game_state": [
+                [getattr(record, key) for key in TurnRecord.FIELDS] if isinstance(record, TurnRecord) else dict(record)
+                for record in self.game_state
+            ],
+            "players": {name: player.to_dict() for name, player in self.players.items()},
+        }
+
+    @classmethod
+    def restore(cls, snapshot: dict, **kwargs) -> "AlternatingConv":
+        """
+        Rebuild a session from `snapshot` in O(turns), without calling any model.
+        `kwargs` override the saved constructor arguments, e.g. `log_options`.
+        """
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {snapshot.get('version')}")
+        if snapshot["class"] != cls.__name__:
+            raise ValueError(f"Snapshot of {snapshot['class']} cannot be restored as {cls.__name__}")
+        env = cls(**{**snapshot["config"], **kwargs})
+        env.state = snapshot["state"]
+        fields = snapshot["fields"]
+        env.game_state = [
+            TurnRecord(**dict(zip(fields, record))) if isinstance(record, list) else record
+            for record in snapshot["game_state"]
+        ]
+        for name, player in snapshot["players"].items():
+            env.players[name].load_state(player)
+        settings = env.game_state[0].get("settings", {}) if env.game_state else {}
+        env.session_log.resume(settings, [record_to_dict(record) for record in env.game_state
+                                          if isinstance(record, TurnRecord)])
+        return env
+
     def get_info(self) -> dict:
         return {
             "name": self.players[self.transit[self.state]].name
@@ -188,17 +343,18 @@ class AlternatingConv(Conv):
                          truncated: bool, 
                          persuasion_technique: str = None):
             
-        curr_state = dict(
+        curr_state = TurnRecord(
             current_iteration=self.state,
             response=response,
             player=player.name,
             reward=reward,
             terminated=terminated,
             truncated=truncated,
-            action=player.action_space,
+            action=str(player.action_space),
             persuasion_technique=persuasion_technique
         )
         self.game_state.append(curr_state)
+        self.log_turn(curr_state)
     
     def update_game_state(self,
                          response: str,
@@ -213,6 +369,7 @@ class AlternatingConv(Conv):
         last_entry['reward'] = reward
         last_entry['terminated'] = terminated
         last_entry['truncated'] = truncated
+        self.session_log.update_turn(response=response, reward=reward, terminated=terminated, truncated=truncated)
 
     def get_next_player(self):
         self.state += 1
\ No newline at end of file
@@ -1,13 +1,13 @@
 import os
 import time
 import json
-import copy
-from pathlib import Path
+import uuid
 from typing import List
 from abc import ABC, abstractmethod
 from therapy_system.agents import Agent
 from therapy_system.action import Action, ActionSpace
-from therapy_system.action.therapy import TAXONOMY
+from therapy_system.envs.records import record_to_dict
+from therapy_system.envs.session_log import SessionLogger
 from gymnasium import Env
 from gymnasium.core import ObsType, ActType
 from typing import Union, Generator
@@ -23,15 +23,24 @@ class Conv(Env, ABC):
     (3) init_message: initial message to start the conversation
     """
 
-    def __init__(self, log_dir=".logs", log_path=None):
-        # logging
-        timestamp = str(round(time.time() * 1000))
+    SESSION_LOG_FILE = "session.jsonl"
+    INTERACTION_LOG_FILE = "interaction.log"
+
+    def __init__(self, log_dir=".logs", log_path=None, log_options=None):
+        """
+        log_options: SessionLogger options of the session log (flush_every, fsync, max_bytes,
+            rotate_interval, backup_count)
+        """
+        # logging, suffixed so sessions created in the same millisecond do not share a directory
+        timestamp = f"{round(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
         self.log_dir = os.path.abspath(log_dir)
         self.log_path = (
             os.path.join(self.log_dir, timestamp)
             if log_path is None
             else log_path
         )
+        # Turns are appended as they happen, the directory is only created by the first write
+        self.session_log = SessionLogger(os.path.join(self.log_path, self.SESSION_LOG_FILE), **(log_options or {}))
 
     @abstractmethod
     def init_players(self, agents, game_state, transit):
@@ -91,69 +100,52 @@ class Conv(Env, ABC):
 
     def to_dict(self):
         """
-        Utility function to convert game state into a dictionary
+        Utility function to convert game state into a dictionary.
+        Only data is serialized, agents and their clients are left out.
         """
         return {
             "class": self.__class__.__name__,
-            **copy.deepcopy(self.__dict__),
+            "log_path": self.log_path,
+            "game_state": [record_to_dict(record) for record in getattr(self, "game_state", [])],
         }
 
+    def log_turn(self, record):
+        """
+        Append one turn to the session log, preceded by the settings on the first turn
+        """
+        if self.session_log.settings is None:
+            self._log_settings()
+        self.session_log.write_turn(record_to_dict(record))
+
+    def _log_settings(self):
+        game_state = getattr(self, "game_state", [])
+        settings = game_state[0].get("settings") if game_state else None
+        self.session_log.write_settings(settings or {})
+
+    def close(self):
+        """
+        Close the session log once the session is over and write the human-readable transcript
+        next to it. A later write opens the log again.
+        """
+        if self.session_log.settings is not None:
+            os.makedirs(self.log_path, exist_ok=True)
+            with open(os.path.join(self.log_path, self.INTERACTION_LOG_FILE), "w") as f:
+                f.write(self.session_log.render())
+        self.session_log.close()
+
     def log_state(self):
         """
         logging full state
         """
-        Path(self.log_path).mkdir(parents=True, exist_ok=True)
+        if self.session_log.settings is None:
+            self._log_settings()
+        self.session_log.flush()
         chat_history = self.log_human_readable_state() # log human readable state (for debugging)
         return chat_history
 
-        # log full state for resuming the game
-        # with open(os.path.join(self.log_path, "game_state.json"), "w") as f:
-        #     json.dump(self.to_dict(), f, cls=GameEncoder, indent=2)
-
     def log_human_readable_state(self): 
         """
-        easy to inspect log file
-        """
-        settings = self.game_state[0]["settings"]
-        # print(self.game_state[0])
-
-        # # log meta information
-        log_str = ""
-        log_str = "Game Settings\n\n"
-        for idx, player_settings in enumerate(
-            zip(
-                *[
-                    [(k, str(p)) for p in v]
-                    for k, v in settings.items()
-                    if isinstance(v, list)
-                ]
-            )
-        ):
-            log_str += "Player {} Settings:\n".format(idx + 1)
-            log_str += "\n".join(
-                ["\t{}: {}".format(_[0], _[1]) for _ in player_settings]
-            )
-            log_str += "\n\n"
-        log_str += "------------------ \n"
-
-        for state in self.game_state[1:]:
-            if state["current_iteration"] == "END":
-                continue
-            data = [
-                "Current Iteration: {}".format(state["current_iteration"]),
-                # "Turn: {}".format(state["turn"]),
-                "Player: {}".format(state["player"]),
-                "Response: {}".format(state["response"]),
-                "Persuasion Technique: {}".format(state["persuasion_technique"]),
-                # "Reward: {}".format(state["reward"]),
-                # "Terminated: {}".format(state["terminated"]),
-            ]
-            log_str += "\n".join(data)
-            log_str += "\n\n"
-
-        # write to log-file
-        with open(os.path.join(self.log_path, "interaction.log"), "w") as f:
-            f.write(log_str)
-        
-        # print(log_str)
-        return log_str
\ No newline at end of file
+        easy to inspect transcript, kept up to date by the session log as turns are written.
+        It is written to the interaction log file once, when the session is closed.
+        """
+        return self.session_log.render()
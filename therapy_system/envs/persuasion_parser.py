@@ -0,0 +1,153 @@
+from collections.abc import AsyncGenerator, Generator
+
+TECHNIQUE_OPEN, TECHNIQUE_CLOSE = "<technique>", "</technique>"
+RESPONSE_OPEN, RESPONSE_CLOSE = "<response>", "</response>"
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """
+    Length of the longest suffix of `text` that is a proper prefix of `tag`
+    """
+    for length in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-length:]):
+            return length
+    return 0
+
+
+class PersuasionStreamParser:
+    """
+    Incremental parser of the <technique>...</technique><response>...</response> format.
+
+    `feed` consumes chunks as they arrive and returns the part of the response body that can
+    already be shown, holding back anything that may be the start of a tag split across chunks.
+    Text before the first tag is held back; if no tag ever arrives, `close` passes the whole text
+    through as the response. After `close`, `technique` and `response` hold the parsed values.
+    """
+
+    def __init__(self):
+        self.technique = None
+        self.response = ""
+        self.raw = ""
+        self._state = "prefix"
+        self._buffer = ""
+
+    def _emit(self, text: str) -> str:
+        self.response += text
+        return text
+
+    def feed(self, chunk: str) -> str:
+        self.raw += chunk
+        self._buffer += chunk
+        out = ""
+        while True:
+            if self._state == "prefix" or self._state == "between":
+                # Before the response body: wait for an opening tag, anywhere in the text as the model
+                # may write something before it
+                tags = [RESPONSE_OPEN] if self._state == "between" else [TECHNIQUE_OPEN, RESPONSE_OPEN]
+                found = [(self._buffer.find(tag), tag) for tag in tags if tag in self._buffer]
+                if not found:
+                    return out
+                start, tag = min(found)
+                self._buffer = self._buffer[start + len(tag):]
+                self._state = "technique" if tag == TECHNIQUE_OPEN else "response"
+            elif self._state == "technique":
+                end = self._buffer.find(TECHNIQUE_CLOSE)
+                if end < 0:
+                    return out
+                self.technique = self._buffer[:end].strip()
+                self._buffer = self._buffer[end + len(TECHNIQUE_CLOSE):]
+                self._state = "between"
+            elif self._state == "response":
+                end = self._buffer.find(RESPONSE_CLOSE)
+                if end >= 0:
+                    out += self._emit(self._buffer[:end])
+                    self._buffer = ""
+                    self._state = "done"
+                    return out
+                keep = _partial_tag(self._buffer, RESPONSE_CLOSE)
+                out += self._emit(self._buffer[:len(self._buffer) - keep])
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                return out
+            else:  # done, text after </response> is dropped
+                self._buffer = ""
+                return out
+
+    def close(self) -> str:
+        """
+        Flush what is left once the stream has ended
+        """
+        out = ""
+        if self._state == "technique":
+            # Unterminated technique tag, show the raw text rather than nothing
+            self.technique = None
+            out = self._emit(self.raw)
+        elif self._state in ("prefix", "between", "response"):
+            # No tag at all is plain text, a technique without a response keeps the text after it
+            out = self._emit(self._buffer)
+        self._buffer = ""
+        self.response = self.response.strip()
+        return out
+
+
+class PersuasionStream(Generator):
+    """
+    Response body of a streamed persuasion response, `technique` is known once it is consumed
+    """
+
+    def __init__(self, chunks):
+        self.parser = PersuasionStreamParser()
+        self._body = self._parse(chunks)
+
+    @property
+    def technique(self):
+        return self.parser.technique
+
+    def _parse(self, chunks):
+        for chunk in chunks:
+            text = self.parser.feed(chunk)
+            if text:
+                yield text
+        text = self.parser.close()
+        if text:
+            yield text
+
+    def send(self, value):
+        return self._body.send(value)
+
+    def throw(self, *args):
+        return self._body.throw(*args)
+
+    def close(self):
+        self._body.close()
+
+
+class AsyncPersuasionStream(AsyncGenerator):
+    """
+    Async counterpart of `PersuasionStream`
+    """
+
+    def __init__(self, chunks):
+        self.parser = PersuasionStreamParser()
+        self._body = self._parse(chunks)
+
+    @property
+    def technique(self):
+        return self.parser.technique
+
+    async def _parse(self, chunks):
+        async for chunk in chunks:
+            text = self.parser.feed(chunk)
+            if text:
+                yield text
+        text = self.parser.close()
+        if text:
+            yield text
+
+    async def asend(self, value):
+        return await self._body.asend(value)
+
+    async def athrow(self, *args):
+        return await self._body.athrow(*args)
+
+    async def aclose(self):
+        await self._body.aclose()
@@ -0,0 +1,91 @@
+import sys
+from typing import Union
+
+from therapy_system.action.therapy import technique_index, get_taxonomy
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class TurnRecord:
+    """
+    One turn of a conversation, the compact replacement of the per-turn game_state dict.
+
+    Player and action names are interned so thousands of turns share one copy of each, and a
+    persuasion technique from the taxonomy is stored as its index. Item access (`record["response"]`,
+    `record.get(...)`) is kept for code written against the dicts.
+    """
+
+    __slots__ = ("current_iteration", "response", "player", "reward", "terminated", "truncated", "action",
+                 "technique")
+
+    FIELDS = ("current_iteration", "response", "player", "reward", "terminated", "truncated", "action",
+              "persuasion_technique")
+
+    def __init__(self,
+                 current_iteration: int,
+                 response: str,
+                 player: str,
+                 reward=None,
+                 terminated: bool = False,
+                 truncated: bool = False,
+                 action: str = None,
+                 persuasion_technique: str = None,
+    ):
+        self.current_iteration = current_iteration
+        self.response = response
+        self.player = _intern(player)
+        self.reward = reward
+        self.terminated = terminated
+        self.truncated = truncated
+        self.action = _intern(action)
+        self.persuasion_technique = persuasion_technique
+
+    @property
+    def persuasion_technique(self) -> str:
+        if isinstance(self.technique, int):
+            return get_taxonomy()[self.technique]["technique"]
+        return self.technique
+
+    @persuasion_technique.setter
+    def persuasion_technique(self, technique: str):
+        # Names outside the taxonomy ("None", typos of the model) are kept as text
+        index = technique_index(technique)
+        self.technique = index if index is not None else _intern(technique)
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TurnRecord":
+        return cls(**{key: data.get(key) for key in cls.FIELDS})
+
+    def __repr__(self) -> str:
+        return f"TurnRecord({self.to_dict()!r})"
+
+
+def record_to_dict(record: Union[TurnRecord, dict]) -> dict:
+    """
+    Data-only dict of a game_state entry, the START and END entries being plain dicts
+    """
+    return record.to_dict() if isinstance(record, TurnRecord) else dict(record)
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import threading
+from typing import Iterator, List
+
+
+def render_settings(settings: dict) -> str:
+    """
+    Human-readable header of a session: the settings of every player, then session-wide settings
+    """
+    log_str = "Game Settings\n\n"
+    for idx, player_settings in enumerate(
+        zip(
+            *[
+                [(k, str(p)) for p in v]
+                for k, v in settings.items()
+                if isinstance(v, list)
+            ]
+        )
+    ):
+        log_str += "Player {} Settings:\n".format(idx + 1)
+        log_str += "\n".join(
+            ["\t{}: {}".format(_[0], _[1]) for _ in player_settings]
+        )
+        log_str += "\n\n"
+    # Session-wide settings, e.g. the prompt template versions
+    for k, v in settings.items():
+        if not isinstance(v, list):
+            log_str += "{}: {}\n".format(k, v)
+    log_str += "------------------ \n"
+    return log_str
+
+
+def render_turn(state: dict) -> str:
+    if state["current_iteration"] == "END":
+        return ""
+    data = [
+        "Current Iteration: {}".format(state["current_iteration"]),
+        "Player: {}".format(state["player"]),
+        "Response: {}".format(state["response"]),
+        "Persuasion Technique: {}".format(state["persuasion_technique"]),
+    ]
+    return "\n".join(data) + "\n\n"
+
+
+class SessionLogger:
+    """
+    Append-only JSONL log of a session: a "settings" record, then one "turn" record per step
+    and an "update" record whenever the last turn is amended.
+
+    Every write is a single appended line. `flush_every` records are buffered between flushes
+    (0 leaves flushing to the OS buffer) and `fsync` forces each flush to disk. The file rolls
+    over to `<path>.1`, `<path>.2`, ... once it exceeds `max_bytes` or is older than
+    `rotate_interval` seconds, keeping at most `backup_count` old segments (None keeps all);
+    every segment starts with the settings record so it can be rendered on its own.
+
+    The human-readable transcript is kept up to date as records are written, so rendering it
+    at the end of a session does not rebuild it from the game state.
+    """
+
+    def __init__(self,
+                 path: str,
+                 flush_every: int = 1,
+                 fsync: bool = False,
+                 max_bytes: int = None,
+                 rotate_interval: float = None,
+                 backup_count: int = None,
+    ):
+        self.path = path
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.settings = None
+        self._file = None
+        self._opened = None
+        self._size = 0
+        self._pending = 0
+        self._header = ""
+        self._turns: List[str] = []
+        self._last = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        self._opened = time.time()
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes is not None and self._size >= self.max_bytes:
+            return True
+        return self.rotate_interval is not None and time.time() - self._opened >= self.rotate_interval
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        segments = sorted(self.segments()[:-1], key=self._segment_index, reverse=True)
+        for segment in segments:
+            index = self._segment_index(segment)
+            if self.backup_count is not None and index >= self.backup_count:
+                os.remove(segment)
+            else:
+                os.replace(segment, f"{self.path}.{index + 1}")
+        if self.backup_count is None or self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+        if self.settings is not None:
+            self._append({"type": "settings", "settings": self.settings})
+
+    def _segment_index(self, segment: str) -> int:
+        return int(segment[len(self.path) + 1:]) if segment != self.path else 0
+
+    def segments(self) -> List[str]:
+        """
+        Files of the log from the oldest to the current one
+        """
+        directory, base = os.path.split(self.path)
+        rotated = [os.path.join(directory, name) for name in os.listdir(directory or ".")
+                   if name.startswith(base + ".") and name[len(base) + 1:].isdigit()] \
+            if os.path.isdir(directory or ".") else []
+        segments = sorted(rotated, key=self._segment_index, reverse=True)
+        return segments + ([self.path] if os.path.exists(self.path) else [])
+
+    def _append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self._file.write(line)
+        self._size += len(line.encode("utf-8"))
+        self._pending += 1
+        if self.flush_every and self._pending >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def write(self, record: dict):
+        with self._lock:
+            if self._file is None:
+                self._open()
+            elif self._should_rotate():
+                self._rotate()
+            self._append(record)
+
+    def write_settings(self, settings: dict):
+        self.settings = settings
+        self._header = render_settings(settings)
+        self.write({"type": "settings", "settings": settings})
+
+    def write_turn(self, turn: dict):
+        self._last = dict(turn)
+        self._turns.append(render_turn(self._last))
+        self.write({"type": "turn", "time": time.time(), **turn})
+
+    def resume(self, settings: dict, turns: List[dict]):
+        """
+        Continue the log of a restored session. The earlier records are written again only
+        when the log file is missing, e.g. on another machine.
+        """
+        exists = os.path.exists(self.path)
+        self.settings = settings
+        self._header = render_settings(settings)
+        self._turns = [render_turn(turn) for turn in turns]
+        self._last = dict(turns[-1]) if turns else None
+        if not exists:
+            self.write({"type": "settings", "settings": settings})
+            for turn in turns:
+                self.write({"type": "turn", **turn})
+
+    def update_turn(self, **fields):
+        """
+        Record a change of the last turn
+        """
+        if self._last is not None:
+            self._last.update(fields)
+            self._turns[-1] = render_turn(self._last)
+        self.write({"type": "update", **fields})
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+                self._file.close()
+                self._file = None
+
+    def render(self) -> str:
+        """
+        Human-readable transcript of the records written by this logger
+        """
+        return self._header + "".join(self._turns)
+
+
+def read_session_log(path: str) -> Iterator[dict]:
+    """
+    Records of a session log, its rotated segments included, oldest first
+    """
+    logger = SessionLogger(path)
+    for segment in logger.segments():
+        with open(segment, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def render_session_log(path: str) -> str:
+    """
+    Human-readable transcript of a session log file
+    """
+    header, turns = "", []
+    for record in read_session_log(path):
+        if record["type"] == "settings":
+            header = render_settings(record["settings"])
+        elif record["type"] == "turn":
+            turns.append(record)
+        elif record["type"] == "update" and turns:
+            turns[-1].update({k: v for k, v in record.items() if k != "type"})
+    return header + "".join(render_turn(turn) for turn in turns)
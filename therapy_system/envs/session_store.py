@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import sqlite3
+import importlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+# Store used by `get_session_store` when no URL is given, "<scheme>://<location>"
+SESSION_STORE_ENV = "SESSION_STORE_URL"
+DEFAULT_SESSION_STORE = "sqlite://" + os.path.join(".sessions", "sessions.sqlite")
+
+# Session stores by URL scheme, as "module:class" taking the location of the URL
+SESSION_STORES = {
+    "sqlite": "therapy_system.envs.session_store:SQLiteSessionStore",
+    "memory": "therapy_system.envs.session_store:MemorySessionStore",
+}
+
+
+class SessionStore(ABC):
+    """
+    Conversation state of participant sessions keyed by their Prolific ID, shared by every
+    worker process of a study so any of them can continue a session.
+    """
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[dict]:
+        """
+        Last saved state of the session, None when it was never saved
+        """
+        pass
+
+    @abstractmethod
+    def save(self, session_id: str, state: dict):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Store of the current process only, for local runs and simulations
+    """
+
+    def __init__(self, location: str = ""):
+        self._sessions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            data = self._sessions.get(session_id)
+        return json.loads(data) if data is not None else None
+
+    def save(self, session_id: str, state: dict):
+        data = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            self._sessions[session_id] = data
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in one SQLite file, which the worker processes of a single host can share.
+    The state is saved as JSON with the time of the save.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def save(self, session_id: str, state: dict):
+        data = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, updated) VALUES (?, ?, ?)",
+                (session_id, data, time.time()),
+            )
+            self._db.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+
+def register_session_store(scheme: str, path: str):
+    """
+    Register a store class given as "module:class" for URLs of `scheme`
+    """
+    SESSION_STORES[scheme] = path
+
+
+_STORES: Dict[str, SessionStore] = {}
+_STORES_LOCK = threading.Lock()
+
+def get_session_store(url: str = None) -> SessionStore:
+    """
+    Process-wide store of `url`, by default SESSION_STORE_URL or a SQLite file under .sessions
+    """
+    url = url or os.environ.get(SESSION_STORE_ENV) or DEFAULT_SESSION_STORE
+    with _STORES_LOCK:
+        store = _STORES.get(url)
+        if store is None:
+            scheme, _, location = url.partition("://")
+            if scheme not in SESSION_STORES:
+                raise NotImplementedError(f"Session store {scheme} not found")
+            module, cls = SESSION_STORES[scheme].split(":")
+            store = _STORES[url] = getattr(importlib.import_module(module), cls)(location)
+        return store
@@ -1,9 +1,9 @@
 from therapy_system.agents import Agent
 from therapy_system.envs import AlternatingConv, Turn
 from therapy_system.action import get_action_space
+from therapy_system.action.therapy import prompt_versions
 from typing import List, Dict
 import re
-from therapy_system.action.therapy import TAXONOMY
 
 
 class Therapy(AlternatingConv):
@@ -17,8 +17,11 @@ class Therapy(AlternatingConv):
         log_dir=".logs",
         log_path=None,
         game_state=None,
+        message_layout: str = "inline",
+        log_options: dict = None,
     ):
-        super().__init__(agents, transit, init_message, persuasion_flag, words_limit, log_dir, log_path, game_state)
+        super().__init__(agents, transit, init_message, persuasion_flag, words_limit, log_dir, log_path, game_state,
+                         message_layout, log_options)
         self.game_state : List[dict] = [
             {
                 "current_iteration": "START",
@@ -26,8 +29,11 @@ class Therapy(AlternatingConv):
                 "settings": {
                     "player": [player for player in self.players],
                     "model": [agent.engine for _, agent in self.players.items()],
-                    "action": [agent.action_space for _, agent in self.players.items()],
+                    "action": [str(agent.action_space) for _, agent in self.players.items()],
                     "prolific_id": [agent.prolific_id for _, agent in self.players.items()],
+                    # Content hashes of the prompt templates this session was run with
+                    "prompt_versions": prompt_versions(),
+                    "message_layout": message_layout,
                     # "api": [agent.api for _, agent in self.players.items()]
                 }
             }
@@ -46,6 +52,7 @@ class Therapy(AlternatingConv):
                 model_args=p['model_args'] if 'model_args' in p else {},
                 action_space=get_action_space(p['action_space']),
                 prolific_id=p['prolific_id'] if 'prolific_id' in p else None,
+                context=p['context'] if 'context' in p else None,
                 # api=p['api'] if 'api' in p else None,
             )
             for p in agents
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+
+from therapy_system.action import Action
+from therapy_system.action.therapy import technique_index
+from therapy_system.envs.alternating_conv import AlternatingConv
+
+# Columns of the numeric observation of a conversation
+OBSERVATION_FEATURES = ("turn", "technique", "response_length", "conversation_length")
+MAX_RESPONSE_LENGTH = 10000
+
+
+class VectorTherapyEnv(VectorEnv):
+    """
+    Steps many conversations together, following the gymnasium VectorEnv interface.
+
+    The model calls of every sub-environment in a step are sent as one concurrent batch (at most
+    `concurrency` at a time), so throughput scales with the provider's concurrency rather than
+    with the number of environments. Finished environments are rebuilt from their `env_fns` in
+    the same step, their last observation and info are kept in `infos["final_obs"]` and
+    `infos["final_info"]`. A sub-environment whose call fails is truncated, with the error in its
+    final info, instead of failing the whole batch.
+
+    Observations are the last response of each conversation, or with `encode_observations` a
+    float32 array of OBSERVATION_FEATURES: the turn index, the persuasion technique id (-1 for
+    none), and the character lengths of the last response and of the whole conversation.
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(self,
+                 env_fns: Sequence[Callable[[], AlternatingConv]],
+                 concurrency: int = None,
+                 encode_observations: bool = False,
+    ):
+        self.env_fns = list(env_fns)
+        self.num_envs = len(self.env_fns)
+        self.concurrency = concurrency
+        self.encode_observations = encode_observations
+        self.envs: List[Optional[AlternatingConv]] = [None] * self.num_envs
+        if encode_observations:
+            self.single_observation_space = spaces.Box(-1.0, np.inf, shape=(len(OBSERVATION_FEATURES),),
+                                                       dtype=np.float32)
+            self.observation_space = spaces.Box(-1.0, np.inf, shape=(self.num_envs, len(OBSERVATION_FEATURES)),
+                                                dtype=np.float32)
+        else:
+            self.single_observation_space = spaces.Text(MAX_RESPONSE_LENGTH)
+            self.observation_space = spaces.Tuple([self.single_observation_space] * self.num_envs)
+        self._loop = asyncio.new_event_loop()
+
+    def _observe(self, env: AlternatingConv):
+        last = env.game_state[-1] if len(env.game_state) > 1 else {}
+        response = last.get("response") or ""
+        if not self.encode_observations:
+            return response
+        technique = technique_index(last.get("persuasion_technique"))
+        return np.array([
+            env.state,
+            technique if technique is not None else -1,
+            len(response),
+            sum(len(record["response"] or "") for record in env.game_state[1:]),
+        ], dtype=np.float32)
+
+    def _batch(self, observations):
+        if self.encode_observations:
+            return np.stack(observations)
+        return tuple(observations)
+
+    def reset(self, *, seed=None, options=None):
+        """
+        Rebuild every environment from its `env_fns`. Seeding is not supported: `seed` is accepted
+        for the VectorEnv interface but ignored, the responses come from the model providers and the
+        sampled persuasion techniques from the global `random` module.
+        """
+        for env in self.envs:
+            if env is not None:
+                env.close()
+        self.envs = [env_fn() for env_fn in self.env_fns]
+        infos = {"name": np.array([env.get_info()["name"] for env in self.envs], dtype=object)}
+        return self._batch([self._observe(env) for env in self.envs]), infos
+
+    async def _astep_env(self, idx: int, action: Optional[Action], semaphore: asyncio.Semaphore):
+        env = self.envs[idx]
+        async with semaphore:
+            try:
+                return await env.astep(action if action is not None else env.sample_action())
+            except Exception as e:
+                logging.warning("Sub-environment %d failed: %s", idx, e)
+                return None, 0, False, True, {"error": repr(e)}
+
+    async def astep(self, actions: Sequence[Optional[Action]] = None):
+        """
+        Step every environment with its action, or an action sampled from its next player when None
+        """
+        if self.envs[0] is None:
+            raise RuntimeError("Call reset() before step()")
+        actions = actions if actions is not None else [None] * self.num_envs
+        semaphore = asyncio.Semaphore(self.concurrency or self.num_envs)
+        results = await asyncio.gather(*[self._astep_env(idx, action, semaphore)
+                                         for idx, action in enumerate(actions)])
+
+        observations, final_obs, final_info = [], [None] * self.num_envs, [None] * self.num_envs
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        terminations = np.zeros(self.num_envs, dtype=bool)
+        truncations = np.zeros(self.num_envs, dtype=bool)
+        for idx, (_, reward, terminated, truncated, info) in enumerate(results):
+            env = self.envs[idx]
+            rewards[idx] = float(reward or 0)
+            terminations[idx] = terminated
+            # Conversations also end once their transit is exhausted
+            truncations[idx] = truncated or env.is_truncated_state()
+            observation = self._observe(env)
+            if terminations[idx] or truncations[idx]:
+                final_obs[idx], final_info[idx] = observation, info
+                env.close()
+                self.envs[idx] = self.env_fns[idx]()
+                observation = self._observe(self.envs[idx])
+            observations.append(observation)
+
+        infos = {}
+        done = terminations | truncations
+        if done.any():
+            # Filled by index: np.array would build a 2-D array from encoded observations
+            infos["final_obs"] = np.empty(self.num_envs, dtype=object)
+            infos["final_info"] = np.empty(self.num_envs, dtype=object)
+            for idx in np.flatnonzero(done):
+                infos["final_obs"][idx], infos["final_info"][idx] = final_obs[idx], final_info[idx]
+            infos["_final_obs"] = infos["_final_info"] = done
+        return self._batch(observations), rewards, terminations, truncations, infos
+
+    def step(self, actions: Sequence[Optional[Action]] = None):
+        return self._loop.run_until_complete(self.astep(actions))
+
+    def close_extras(self, **kwargs):
+        for env in self.envs:
+            if env is not None:
+                env.close()
+        self._loop.close()
@@ -1,12 +1,17 @@
-from typing import Generator, Union
+from typing import AsyncGenerator, Generator, Union
+
+def _escape_rules(text : str) -> str:
+    return text.replace("$", "\$").replace("*", "\*")
 
 def escape_special_characters(text : Union[str, Generator[str, None, None]]) -> Union[str, Generator[str, None, None]]:
-    rules = lambda x: x.replace("$", "\$").replace("*", "\*")
     if isinstance(text, Generator):
-        for chunk in text:
-            yield rules(chunk)
+        return (_escape_rules(chunk) for chunk in text)
     else:
-        return rules(text)
+        return _escape_rules(text)
+
+async def aescape_special_characters(text : AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    async for chunk in text:
+        yield _escape_rules(chunk)
 
 def unescape_special_characters(text : str) -> str:
     rules = lambda x: x.replace("\$", "$").replace("\*", "*")
@@ -20,12 +20,16 @@ import therapy_system
 from therapy_system.utils import unescape_special_characters
 from therapy_system.agents.llm.aws import AWS_MODELS_MAPPING
 from therapy_system.agents.llm.openai import GPT_MODELS_MAPPING
+from therapy_system.agents.llm.clients import warm_clients
+from therapy_system.agents.llm.metrics import serve_metrics_from_env
+from therapy_system.agents.llm.ledger import BudgetExceeded, get_session_ledger
+from therapy_system.envs.session_store import get_session_store
 
 # Import functions from therapy_utils and feedback_utils
 from therapy_utils import (
-    secure_log_api_key, clean_chat, stream_data, generate_response,
+    secure_log_api_key, clean_chat, generate_response,
     gpt4_search_persona, read_persona_csv,
-    read_unnecessary_info_csv
+    read_unnecessary_info_csv, PERSONA_LOOKUP_EXECUTOR, AUX_LATENCY_POLICY
 )
 from feedback_utils import (
     disable_copy_paste)
@@ -112,6 +116,64 @@ def initialize_session_state():
         st.session_state.start_button_clicked = False
 
 
+# Changes to what the therapist model is sent are opt-in, so a running study keeps its prompts:
+# the "system" message layout (instructions once in the system prompt, raw utterances in the
+# history) and the token-budgeted context window of late-session prompts
+MESSAGE_LAYOUT = os.environ.get("THERAPY_MESSAGE_LAYOUT", "inline")
+CONTEXT_WINDOW = os.environ.get("THERAPY_CONTEXT_WINDOW", "") == "1"
+# Retry transient errors and never leave the participant waiting on a stalled request
+THERAPIST_POLICY = {"deadline": 60, "first_token_timeout": 15, "max_retries": 2}
+
+# Conversation state saved after every turn, so any worker process can continue the session
+PERSISTED_KEYS = ("messages", "event", "current_iteration", "start_time", "iterations", "turn", "temp_response",
+                  "turn_latencies", "phase", "chat_finished")
+
+
+def persist_session():
+    """Save the conversation state of the participant to the session store (SESSION_STORE_URL)."""
+    prolific_id = st.session_state.get("prolific_id")
+    env = st.session_state.get("env")
+    if not prolific_id or env is None:
+        return
+    state = {key: st.session_state[key] for key in PERSISTED_KEYS if key in st.session_state}
+    state["env"] = env.snapshot()
+    # Token budgets are enforced per process, the usage so far goes along with the session
+    state["llm_usage"] = get_session_ledger(prolific_id).to_dict()
+    try:
+        get_session_store().save(prolific_id, state)
+    except Exception as e:
+        logging.error(f"Failed to persist the session of {prolific_id}: {e}")
+
+
+def rehydrate_session(prolific_id):
+    """Restore the saved conversation of the participant, e.g. after a refresh or on another worker."""
+    try:
+        state = get_session_store().load(prolific_id)
+    except Exception as e:
+        logging.error(f"Failed to load the session of {prolific_id}: {e}")
+        return False
+    if not state:
+        return False
+    st.session_state.env = therapy_system.restore(state.pop("env"))
+    if "llm_usage" in state:
+        get_session_ledger(prolific_id).restore(state.pop("llm_usage"))
+    for key, value in state.items():
+        st.session_state[key] = value
+    logging.info("Resumed the session of %s at turn %s", prolific_id, st.session_state.turn)
+    return True
+
+
+def delete_session():
+    """Remove the saved conversation of the participant once the chat is over, so the store does not grow."""
+    prolific_id = st.session_state.get("prolific_id")
+    if not prolific_id:
+        return
+    try:
+        get_session_store().delete(prolific_id)
+    except Exception as e:
+        logging.error(f"Failed to delete the session of {prolific_id}: {e}")
+
+
 def start_conversation(agent_1, agent_2, therapist_system_prompt, persuasion_techique, init_message_flag,
                        is_stream, event, min_interactions, max_iteractions, words_limit, persuasion_flag, prolific_id):
     """Initialize the conversation settings and environment."""
@@ -135,8 +197,12 @@ def start_conversation(agent_1, agent_2, therapist_system_prompt, persuasion_tec
             "action": int(persuasion_techique.split(":")[0].strip()) - 1
         },
         "model_args": {
-            "stream": is_stream
+            "stream": is_stream,
+            "policy": THERAPIST_POLICY,
+            "call_site": "therapist_turn",
         },
+        # Keep late-session prompts within the engine's token budget, when the study opts in
+        "context": {} if CONTEXT_WINDOW else None,
         "role": "assistant",
         "prolific_id": prolific_id
     }
@@ -154,6 +220,7 @@ def start_conversation(agent_1, agent_2, therapist_system_prompt, persuasion_tec
         "transit": ["assistant", "user"] * max_iteractions,
         "persuasion_flag": persuasion_flag,
         "words_limit": words_limit,
+        "message_layout": MESSAGE_LAYOUT,
     }
     st.session_state.messages = []
     st.session_state.event = event
@@ -163,8 +230,10 @@ def start_conversation(agent_1, agent_2, therapist_system_prompt, persuasion_tec
     st.session_state.event_kwargs = event_kwargs
     st.session_state.turn = 1 if init_message_flag else 0
     st.session_state.temp_response = ""
+    st.session_state.turn_latencies = []
     env = therapy_system.make(event, **event_kwargs)
     st.session_state.env = env
+    persist_session()
 
 
 def display_messages():
@@ -187,28 +256,17 @@ def display_persona_info(persona_category_info, main_categories):
                     for info in persona_category_info[category]:
                         st.write(info)
 
-def retrieve_persona_details(formatted_query, persona_hierarchy_info, main_categories, persona_category_info):
-    """Retrieve and display persona details based on the conversation."""
-    detected_groups = gpt4_search_persona(formatted_query, persona_hierarchy_info)
-
-    # Display relevant persona details or newly generated persona information in the sidebar
-    st.session_state.sidebar_container = st.sidebar.container()
+def lookup_persona_details(formatted_query, persona_hierarchy_info, prolific_id):
+    """
+    Find the persona groups related to the conversation, or generate persona information when none is.
+    Runs outside the script thread, so it must not use streamlit.
+    """
+    detected_groups = gpt4_search_persona(formatted_query, persona_hierarchy_info, prolific_id)
+    if detected_groups and detected_groups != 'None':
+        return detected_groups, None
 
-    with st.session_state.sidebar_container:
-        st.markdown("#### Possible Related Information")
-        if detected_groups and detected_groups != 'None':
-            # st.write(f"**Detected Groups:** {detected_groups}")
-            category_map = {cat.lower(): cat for cat in persona_category_info.keys()}
-            for group in detected_groups.split(', '):
-                proper_group = category_map.get(group.lower().strip())
-                if proper_group and proper_group in persona_category_info:
-                    st.markdown(f"**{proper_group}**:")
-                    for item in persona_category_info[proper_group]:
-                        st.markdown(f"- {item}")
-                # if proper_group and proper_group in persona_category_info:
-                #     st.markdown(f"- **{proper_group}**: {'<br>'.join(persona_category_info[proper_group])}")
-        else:
-            example_system_prompt = f"""
+    # The prompt keeps its original indentation, which is part of the request and of its cache key
+    example_system_prompt = f"""
                 Here is the recent chat history: "{formatted_query}"
                 You can intelligently complement the persona information. First understand what this query is about, 
                 and then generate simple and concrete persona information to the query.
@@ -224,18 +282,65 @@ def retrieve_persona_details(formatted_query, persona_hierarchy_info, main_categ
                 Now, generate a relevant persona information for the {formatted_query} based on the examples above.
                 Return only the response content without any prefixes or labels.
             """
-            generated_info = generate_response(
-                system_prompt=example_system_prompt,
-                user_prompt="Generate relevant persona information for the recent chat history",
-                model="gpt-4o-mini",
-                max_tokens=100,
-                temperature=0
-            )
+    generated_info = generate_response(
+        system_prompt=example_system_prompt,
+        user_prompt="Generate relevant persona information for the recent chat history",
+        model="gpt-4o-mini",
+        max_tokens=100,
+        temperature=0,
+        use_cache=True,
+        call_site="persona_generation",
+        session_id=prolific_id
+    )
+    return detected_groups, generated_info
+
+
+def render_persona_details(detected_groups, generated_info, main_categories, persona_category_info):
+    """Display the persona details found for the conversation in the sidebar."""
+    with st.session_state.sidebar_container:
+        st.markdown("#### Possible Related Information")
+        if detected_groups and detected_groups != 'None':
+            # st.write(f"**Detected Groups:** {detected_groups}")
+            category_map = {cat.lower(): cat for cat in persona_category_info.keys()}
+            for group in detected_groups.split(', '):
+                proper_group = category_map.get(group.lower().strip())
+                if proper_group and proper_group in persona_category_info:
+                    st.markdown(f"**{proper_group}**:")
+                    for item in persona_category_info[proper_group]:
+                        st.markdown(f"- {item}")
+                # if proper_group and proper_group in persona_category_info:
+                #     st.markdown(f"- **{proper_group}**: {'<br>'.join(persona_category_info[proper_group])}")
+        # None when the call failed or the session is out of budget
+        elif generated_info:
             st.write("No relevant persona information found. Here is the **newly generated persona information**: ", generated_info)
 
         display_persona_info(persona_category_info, main_categories)
 
 
+def start_persona_lookup(formatted_query, persona_hierarchy_info):
+    """
+    Look up the persona details in the background, so that it overlaps the therapist's next turn.
+    The sidebar container is placed now and filled by show_persona_lookup.
+    """
+    st.session_state.sidebar_container = st.sidebar.container()
+    st.session_state.persona_lookup = PERSONA_LOOKUP_EXECUTOR.submit(
+        lookup_persona_details, formatted_query, persona_hierarchy_info, st.session_state.prolific_id)
+
+
+def show_persona_lookup(main_categories, persona_category_info, wait=False):
+    """Render the background persona lookup in the sidebar once it is done, or wait for it with `wait`."""
+    lookup = st.session_state.get("persona_lookup")
+    if lookup is None or not (wait or lookup.done()):
+        return
+    del st.session_state.persona_lookup
+    try:
+        detected_groups, generated_info = lookup.result()
+    except Exception as e:
+        logging.error(f"Persona lookup failed: {e}")
+        detected_groups, generated_info = None, None
+    render_persona_details(detected_groups, generated_info, main_categories, persona_category_info)
+
+
 def run_conversation(env, players, is_stream, persona_hierarchy_info, main_categories, persona_category_info
                      , min_interaction_time, elapsed_time):
     """Handle the main conversation loop."""
@@ -259,45 +364,67 @@ def run_conversation(env, players, is_stream, persona_hierarchy_info, main_categ
                 st.write(response)
             st.session_state.temp_response = response
             st.session_state.messages.append({"turn": players[st.session_state.turn % 2], "response": response})
+            persist_session()
             st.rerun()
         else:
             st.stop()
     elif (str(action) == "Human-input") and (st.session_state.temp_response != ""):
         response = st.session_state.temp_response
     else:
-        technique, response = env.get_response(action)
-        with st.chat_message(players[st.session_state.turn % 2]):
-            if is_stream:
-                if isinstance(response, Generator):
-                    response = ''.join(response)
+        request_start = time.perf_counter()
+        try:
+            technique, response = env.get_response(action)
+            with st.chat_message(players[st.session_state.turn % 2]):
+                if is_stream and isinstance(response, Generator):
+                    # Render the model's chunks as they arrive, the full text is assembled once for env.step
+                    response_placeholder = st.empty()
+                    full_response = ""
+                    time_to_first_token = None
+                    for chunk in response:
+                        if time_to_first_token is None:
+                            time_to_first_token = time.perf_counter() - request_start
+                        full_response += chunk
+                        response_placeholder.markdown(full_response + "▌")
+                        # The persona sidebar shows up as soon as its lookup is done
+                        show_persona_lookup(main_categories, persona_category_info)
+                    response_placeholder.markdown(full_response)
+                    # The technique of a persuasion response is parsed out of the stream
+                    technique = technique or getattr(response, "technique", None)
+                    response = full_response
                 else:
-                    response = response
-                    response = unescape_special_characters(response)
-
-                response_placeholder = st.empty()
-                full_response = ""
-                for chunk in stream_data(response):
-                    full_response += chunk
-                    response_placeholder.markdown(full_response + "▌")
-                response_placeholder.markdown(full_response)
-                response = full_response
-            else:
-                st.write(response)
+                    time_to_first_token = time.perf_counter() - request_start
+                    st.write(response)
+        except BudgetExceeded as e:
+            # The session used up its token budget, end the chat and move on to the survey
+            logging.warning("%s", e)
+            st.info("This session has reached its usage limit. Please proceed to the survey.")
+            st.session_state.chat_finished = True
+            show_persona_lookup(main_categories, persona_category_info, wait=True)
+            return
+        total_time = time.perf_counter() - request_start
+        st.session_state.turn_latencies.append({"turn": st.session_state.turn, "ttft": time_to_first_token,
+                                                "total": total_time})
+        logging.info("Therapist turn %d: time to first token %.3fs, total %.3fs",
+                     st.session_state.turn, time_to_first_token or total_time, total_time)
+        # The participant waits for the slower of the therapist's turn and the persona lookup
+        show_persona_lookup(main_categories, persona_category_info, wait=True)
         st.session_state.messages.append({"turn": players[st.session_state.turn % 2], "response": response})
     response = unescape_special_characters(response)
 
-    # Retrieve persona details based on the human response and assistant's previous response
+    # Retrieve persona details based on the human response and assistant's previous response,
+    # in the background while the therapist's next turn is generated
     if (st.session_state.turn >= 0) and (str(action) == "Human-input"):
         previous_response = st.session_state.messages[-2]["response"] if len(st.session_state.messages) > 1 else ""
         human_response = response
         formatted_query = f"Therapist: {previous_response}\nPatient: {human_response}"
-        retrieve_persona_details(formatted_query, persona_hierarchy_info, main_categories, persona_category_info)
+        start_persona_lookup(formatted_query, persona_hierarchy_info)
     if "sidebar_container" not in st.session_state:
         display_persona_info(persona_category_info, main_categories)
     _, reward, terminated, truncated, info = env.step(action, technique, response)
     st.session_state.turn += 1
     st.session_state.temp_response = ""
     st.session_state.current_iteration += 1
+    persist_session()
     # if terminated:
     #     st.write("Manually terminated.")
     #     logging.info("Manually terminated.")
@@ -330,6 +457,7 @@ def save_chat_history_to_firebase(prolific_id, chat_history):
     chat_document = {
         "prolific_id": prolific_id,
         "chat_history": chat_history,
+        "llm_usage": get_session_ledger(prolific_id).to_dict(),
         "timestamp": firestore.SERVER_TIMESTAMP,  # Automatically set the timestamp in Firestore
     }
 
@@ -383,6 +511,12 @@ def main():
 
     # Control flow based on the phase
     if st.session_state.phase == "initial":
+        # Warm the pooled LLM clients while the participant types their Prolific ID
+        warm_clients([agent_1], THERAPIST_POLICY)
+        warm_clients(["gpt-4o-mini"], AUX_LATENCY_POLICY)
+        # Prometheus endpoint for watching latencies during a study run, when LLM_METRICS_PORT is set
+        serve_metrics_from_env()
+
         # Display "Enter Prolific ID" and related UI elements
         ask_prolific_id()
 
@@ -403,16 +537,17 @@ def main():
         st.sidebar.title("Your Related Information")
         # sidebar_seeking_help(persona_category_info)
 
-        # Start the conversation if not already started
-        if "conversation_initialized" not in st.session_state:
+        # Resume the saved conversation whenever this run has lost it (a refresh, another worker),
+        # or start one if there is none yet
+        if st.session_state.get("env") is None:
             # st.write("Please role-play as Alex and chat with the AI therapist.")
-            start_conversation(
-                agent_1, agent_2, therapist_system_prompt,
-                persuasion_techique, init_message_flag,
-                is_stream, event, min_interactions, max_iteractions,
-                words_limit, persuasion_flag, st.session_state.prolific_id
-            )
-            st.session_state.conversation_initialized = True
+            if not rehydrate_session(st.session_state.prolific_id) and st.session_state.phase == "chat":
+                start_conversation(
+                    agent_1, agent_2, therapist_system_prompt,
+                    persuasion_techique, init_message_flag,
+                    is_stream, event, min_interactions, max_iteractions,
+                    words_limit, persuasion_flag, st.session_state.prolific_id
+                )
 
         players = ["assistant", "user"]
 
@@ -434,7 +569,13 @@ def main():
 
                     if st.session_state.chat_finished:
                         st.session_state.phase = "post_survey"
+                        # The finished conversation is not resumed, it is saved to Firebase below
+                        delete_session()
                         chat_history = env.log_state()
+                        # Both ways of finishing (the end button or the usage limit) close the session log
+                        env.close()
+                        logging.info("Prompt tokens per turn (inline vs system layout): %s",
+                                     env.prompt_token_report())
                         save_chat_history_to_firebase(st.session_state.prolific_id, chat_history) # Debug
                         target_page = "pages/Survey.py"
                         st.switch_page(target_page)
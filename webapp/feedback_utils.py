@@ -10,6 +10,7 @@ from collections import defaultdict
 from typing import List
 import pandas as pd
 from therapy_utils import generate_response, clean_chat
+from therapy_system.agents.llm.ledger import get_session_ledger
 
 MIN_WORDS = 10
 
@@ -244,10 +245,17 @@ def get_survey_info():
         user_prompt=user_prompt,
         model="gpt-4o-mini",
         max_tokens=2000,
-        temperature=0
+        temperature=0,
+        use_cache=True,
+        call_site="survey_detection",
+        session_id=st.session_state.get('prolific_id')
     )
 
     logging.info("Detection GPT-4 responses : %s", gpt_response)
+    if gpt_response is None:
+        # The call failed or the session ran out of budget, show no detections
+        st.session_state.complete_detections = {}
+        return {}
 
     # Process to get rid of code and other unwanted characters
     gpt_response = gpt_response.replace('```json', '').replace('```', '').strip()
@@ -581,6 +589,7 @@ def store_feedback():
     # Prolific ID
     prolific_id = st.session_state.get('prolific_id', 'unknown')
     feedback["prolific_id"] = prolific_id
+    feedback["llm_usage"] = get_session_ledger(prolific_id).to_dict()
 
     # Log the user feedback
     logging.info("=" * 50)
@@ -0,0 +1,175 @@
+import os
+import re
+import functools
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Minimum BM25 score of the best group for a local match to be trusted, below it the
+# LLM classifies the query (0 always uses the local match). The default is calibrate_threshold
+# on benchmarks/persona_queries.csv for persona_info_hierarchy.csv, rounded up; recalibrate it
+# for another persona table.
+PERSONA_MATCH_THRESHOLD = float(os.environ.get("PERSONA_MATCH_THRESHOLD", 5.5))
+# A second group is returned when it scores at least this fraction of the best one
+SECOND_GROUP_RATIO = 0.6
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = set("""
+a about after again all also am an and any are as at be been before being but by can could did do does doing
+don down during each even ever feel feeling felt for from get got had has have having he her here hers him his how
+i if im in into is it its just know like little lot make me more most much my myself new no not now of on one or
+other our out over own really so some still such than that the their them then there these they thing things think
+this those through to too up us very was way we well were what when where which while who why will with would yeah
+yes you your yours
+""".split())
+
+_WORD = re.compile(r"[a-z0-9]+")
+_SENTENCE = re.compile(r"[.;!?\n]")
+# Words, and the punctuation that ends a run of capitalized words
+_TOKEN = re.compile(r"[A-Za-z][A-Za-z-]*|[,:()’'\"“”]")
+# Speaker labels of the formatted query ("Therapist: ...\nPatient: ...")
+_SPEAKER = re.compile(r"^\s*(therapist|patient)\s*:", re.IGNORECASE | re.MULTILINE)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower().replace("’", "'").replace("'", ""))
+
+
+def _entities(text: str) -> List[str]:
+    """
+    Names and places in `text`: runs of capitalized words, leaving out the first word of a sentence
+    """
+    entities = []
+    for sentence in _SENTENCE.split(text):
+        current = []
+        for token in _TOKEN.findall(sentence)[1:] + [""]:
+            if token[:1].isupper() and len(token) > 1:
+                current.append(token)
+            elif current:
+                entities.append(" ".join(current))
+                current = []
+    return entities
+
+
+def _stem(word: str) -> str:
+    # Truncation stemming: relocate, relocated and relocation share "reloc"
+    return word[:5]
+
+
+class PersonaIndex:
+    """
+    BM25 index of the persona details, ranking their groups for a query.
+
+    Every detail is a document (with its group name). The BM25 weights are kept as a sparse
+    term-document matrix in CSC form, so a query only touches the columns of its terms.
+    Names and places of the persona are indexed as entities, matched from any part of the name
+    ("Emily" finds "Emily Johnson"). Everything is derived from the table itself, paraphrases the
+    table does not share a word with are left to the LLM.
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        groups = data["Group"].tolist()
+        details = data["Detailed information"].tolist()
+        self.groups = list(dict.fromkeys(groups))
+        self.doc_group = np.array([self.groups.index(group) for group in groups])
+        self.entities = defaultdict(set)
+        for detail in details:
+            for entity in _entities(detail):
+                for word in _words(entity):
+                    if word not in STOPWORDS and len(word) > 2:
+                        self.entities[word].add("@" + " ".join(_words(entity)))
+        documents = [self._terms(f"{group}. {detail}") for group, detail in zip(groups, details)]
+        self._build(documents)
+
+    def _terms(self, text: str) -> Counter:
+        words = [word for word in _words(text) if word not in STOPWORDS]
+        terms = Counter(_stem(word) for word in words)
+        terms.update({entity for word in words for entity in self.entities.get(word, ())})
+        return terms
+
+    def _build(self, documents: List[Counter]):
+        n_docs = len(documents)
+        lengths = np.array([sum(terms.values()) for terms in documents], dtype=float)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1.0))
+        postings = defaultdict(list)
+        for doc, terms in enumerate(documents):
+            for term, tf in terms.items():
+                postings[term].append((doc, tf))
+        self.vocabulary = {}
+        indptr, indices, weights = [0], [], []
+        for column, (term, entries) in enumerate(sorted(postings.items())):
+            self.vocabulary[term] = column
+            docs = np.array([doc for doc, _ in entries])
+            tf = np.array([tf for _, tf in entries], dtype=float)
+            idf = np.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            indices.append(docs)
+            weights.append(idf * tf * (BM25_K1 + 1) / (tf + norm[docs]))
+            indptr.append(indptr[-1] + len(docs))
+        self.indptr = np.array(indptr)
+        self.indices = np.concatenate(indices) if indices else np.zeros(0, dtype=int)
+        self.weights = np.concatenate(weights) if weights else np.zeros(0)
+        self.n_docs = n_docs
+
+    def _query(self, query: str) -> Dict[str, float]:
+        return {term: 1.0 for term in self._terms(_SPEAKER.sub(" ", query))}
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        BM25 score of every group for `query`
+        """
+        columns, factors = [], []
+        for term, weight in self._query(query).items():
+            column = self.vocabulary.get(term)
+            if column is not None:
+                columns.append(column)
+                factors.append(weight)
+        group_scores = np.zeros(len(self.groups))
+        if not columns:
+            return group_scores
+        starts, ends = self.indptr[columns], self.indptr[np.array(columns) + 1]
+        slices = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        factor = np.repeat(factors, ends - starts)
+        doc_scores = np.bincount(self.indices[slices], weights=self.weights[slices] * factor, minlength=self.n_docs)
+        # A group is as relevant as its best matching detail
+        np.maximum.at(group_scores, self.doc_group, doc_scores)
+        return group_scores
+
+    def search(self, query: str, k: int = 2) -> List[Tuple[str, float]]:
+        """
+        Up to `k` (group, score) pairs, best first, keeping the groups close to the best one
+        """
+        scores = self.scores(query)
+        order = np.argsort(-scores, kind="stable")[:k]
+        if not len(order) or scores[order[0]] <= 0:
+            return []
+        best = scores[order[0]]
+        return [(self.groups[idx], float(scores[idx])) for idx in order
+                if scores[idx] > 0 and scores[idx] >= SECOND_GROUP_RATIO * best]
+
+
+@functools.lru_cache(maxsize=8)
+def _index(rows: Tuple[Tuple[str, str], ...]) -> PersonaIndex:
+    return PersonaIndex(pd.DataFrame(rows, columns=["Group", "Detailed information"]))
+
+
+def get_persona_index(data: pd.DataFrame) -> PersonaIndex:
+    """
+    Index of the persona table, built once per process for each distinct table
+    """
+    return _index(tuple(zip(data["Group"].astype(str), data["Detailed information"].astype(str))))
+
+
+def calibrate_threshold(index: PersonaIndex, labelled: Iterable[Tuple[str, List[str]]]) -> float:
+    """
+    Lowest PERSONA_MATCH_THRESHOLD at which no labelled query gets a wrong best group locally.
+    `labelled` holds (query, relevant groups) pairs, with no groups for queries the persona has nothing on.
+    """
+    wrong = [0.0]
+    for query, groups in labelled:
+        matches = index.search(query)
+        if matches and matches[0][0] not in groups:
+            wrong.append(matches[0][1])
+    return float(np.nextafter(max(wrong), np.inf))
@@ -1,10 +1,30 @@
 import os
+import json
 import time
 import logging
 import pandas as pd
 import streamlit as st
 from typing import Generator, List
-import openai
+from concurrent.futures import ThreadPoolExecutor
+from therapy_system.agents.llm import backend_name, load_llm_agent, resolve_engine
+from therapy_system.agents.llm.policy import LatencyPolicy
+from therapy_system.agents.llm.ratelimit import BACKGROUND
+from therapy_system.agents.llm.batching import SingleFlight, MicroBatcher
+from persona_index import PERSONA_MATCH_THRESHOLD, get_persona_index
+
+# Latency policies of the auxiliary calls. They are shared so that hedging learns its
+# first-token threshold from every session of the process.
+AUX_LATENCY_POLICY = LatencyPolicy(deadline=60, max_retries=2)
+PERSONA_SEARCH_POLICY = LatencyPolicy(deadline=20, max_retries=2, hedge=True)
+
+PERSONA_SEARCH_SYSTEM_PROMPT = "You are a smart assistant that can match user queries to relevant persona details."
+# Persona searches of concurrent sessions arriving within this many seconds are classified
+# in one request (0 disables micro-batching)
+PERSONA_BATCH_WINDOW = float(os.environ.get("PERSONA_BATCH_WINDOW", 0))
+PERSONA_BATCH_SIZE = 8
+# Sidebar persona lookups run next to the therapist's turn, on threads shared by every session of the process
+PERSONA_LOOKUP_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("PERSONA_LOOKUP_WORKERS", 16)),
+                                             thread_name_prefix="persona_lookup")
 
 
 def secure_log_api_key(api_key: str):
@@ -20,6 +40,8 @@ def secure_log_api_key(api_key: str):
 
 def clean_chat():
     st.session_state.messages = []
+    if st.session_state.get("env") is not None:
+        st.session_state.env.close()
     st.session_state.env = None
 
 
@@ -31,44 +53,42 @@ def stream_data(msg):
         time.sleep(0.02)
 
 
-def generate_response(system_prompt, user_prompt, model="gpt-4o-mini", max_tokens=100, temperature=0.7):
+def generate_response(system_prompt, user_prompt, model="gpt-4o-mini", max_tokens=100, temperature=0.7,
+                      use_cache=False, policy=AUX_LATENCY_POLICY, priority=BACKGROUND, call_site="auxiliary",
+                      session_id=None):
     """
     Generates a response using the GPT-4 model with system and user prompts.
+    With `use_cache`, deterministic (temperature 0) calls are served from the on-disk response cache.
+    Deadlines, retries and hedging follow `policy`. These auxiliary calls queue behind
+    therapist turns when the engine is rate limited. `call_site` labels the call in the LLM metrics,
+    and its tokens are charged to the budget of `session_id`, which may skip it (None is returned).
     """
-    client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    if not client.api_key:
-        raise ValueError("OpenAI API key not found in environment variables. Please set the OPENAI_API_KEY environment variable.")
-
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-        return response.choices[0].message.content.strip()
+        # Checked before the client is built, which would fail with a less specific error
+        if backend_name(resolve_engine(model)) == "openai" and not os.environ.get("OPENAI_API_KEY"):
+            raise ValueError("OpenAI API key not found in environment variables. Please set the OPENAI_API_KEY environment variable.")
+        agent = load_llm_agent(model, dict(temperature=temperature, max_tokens=max_tokens, cache=use_cache, policy=policy,
+                                           priority=priority, call_site=call_site, session_id=session_id))
+        response = agent.complete([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ])
+        # stats() counts the cache entries, only worth it when the debug log is shown
+        if agent.cache is not None and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("LLM response cache: %s", agent.cache.stats())
+        return response.strip()
 
     except Exception as e:
         print(f"Error in chat message: {str(e)}")
         return None
 
 
-def gpt4_search_persona(query, persona_data):
-    """
-    Use GPT-4 to determine which groups or information from the persona
-    relate to the query. Return multiple relevant groups if detected.
-    """
-    # Convert persona data to string format
-    persona_data_string = persona_data.to_string(index=False)
-    
+def _persona_search_single(query, persona_data_string, session_id=None):
     # GPT-4 prompt to determine relevant groups
     prompt = f"""
     Here is a persona dataset with various categories and details:
 
-    {persona_data_string.lower()}
+    {persona_data_string}
 
     Based on this data, which groups or details relate most to the following query:
     "{query}"
@@ -82,16 +102,96 @@ def gpt4_search_persona(query, persona_data):
     """
     
     detected_groups = generate_response(
-        system_prompt="You are a smart assistant that can match user queries to relevant persona details.",
+        system_prompt=PERSONA_SEARCH_SYSTEM_PROMPT,
         user_prompt=prompt,
         model="gpt-4o-mini",
         max_tokens=150,
-        temperature=0
+        temperature=0,
+        use_cache=True,
+        policy=PERSONA_SEARCH_POLICY,
+        call_site="persona_search",
+        session_id=session_id
     )
     
     return detected_groups
 
 
+def _persona_search_batch(items):
+    """
+    Classify the (query, persona table, session id) items of several sessions with a single request,
+    charged to the session of the first item.
+    Falls back to one request per item if the tables differ or the answer cannot be parsed.
+    """
+    if len(items) == 1 or len({table for _, table, _ in items}) > 1:
+        return [_persona_search_single(query, table, session_id) for query, table, session_id in items]
+
+    numbered_queries = "\n".join(f'{idx + 1}. "{query}"' for idx, (query, _, _) in enumerate(items))
+    prompt = f"""
+    Here is a persona dataset with various categories and details:
+
+    {items[0][1]}
+
+    Based on this data, which groups or details relate most to each of the following numbered queries:
+    {numbered_queries}
+
+    Please return a JSON object that maps each query number to its answer (e.g. {{"1": "Your basic info, Recent Relocation", "2": "None"}}), where each answer is:
+    - If there are relevant groups: only the group names separated by commas
+    - If no groups are relevant: exactly "None"
+
+    If there are more than two relevant groups for a query, only include the two most relevant groups that have a direct and explicit connection to the query content.
+    Do not include explanations or other text.
+    """
+    response = generate_response(
+        system_prompt=PERSONA_SEARCH_SYSTEM_PROMPT,
+        user_prompt=prompt,
+        model="gpt-4o-mini",
+        max_tokens=50 + 60 * len(items),
+        temperature=0,
+        use_cache=True,
+        policy=PERSONA_SEARCH_POLICY,
+        call_site="persona_search",
+        session_id=items[0][2]
+    )
+    try:
+        answers = json.loads(response.replace('```json', '').replace('```', '').strip())
+        return [str(answers[str(idx + 1)]) for idx in range(len(items))]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        logging.warning("Could not split the batched persona search answer, searching one by one: %s", response)
+        return [_persona_search_single(query, table, session_id) for query, table, session_id in items]
+
+
+_PERSONA_SEARCH_FLIGHT = SingleFlight()
+_PERSONA_SEARCH_BATCHER = MicroBatcher(_persona_search_batch, window=PERSONA_BATCH_WINDOW,
+                                       max_batch=PERSONA_BATCH_SIZE)
+
+
+def gpt4_search_persona(query, persona_data, session_id=None):
+    """
+    Determine which groups or information from the persona relate to the query.
+    Return multiple relevant groups if detected.
+
+    The groups come from the local persona index when its best match scores at least
+    PERSONA_MATCH_THRESHOLD, otherwise GPT-4 classifies the query.
+    Identical queries already in flight share one request, and with PERSONA_BATCH_WINDOW
+    set, queries from concurrent sessions are classified together in one request.
+    A shared request is charged to the budget of the session that sent it.
+    """
+    matches = get_persona_index(persona_data).search(query)
+    if matches and matches[0][1] >= PERSONA_MATCH_THRESHOLD:
+        logging.debug("Persona index matched %s", matches)
+        return ", ".join(group for group, _ in matches)
+
+    # Convert persona data to string format
+    persona_data_string = persona_data.to_string(index=False).lower()
+
+    def search():
+        if PERSONA_BATCH_WINDOW > 0:
+            return _PERSONA_SEARCH_BATCHER.submit((query, persona_data_string, session_id))
+        return _persona_search_single(query, persona_data_string, session_id)
+
+    return _PERSONA_SEARCH_FLIGHT.do((query, persona_data_string), search)
+
+
 def read_persona_csv(filename):
     data = pd.read_csv(filename)
     main_categories = data['Group'].unique().tolist()